@@ -2,6 +2,13 @@
 ASGI config for Recommender project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the production entry point (see the Procfile), so the async views in
+Recommender.views can serve cheap requests while refreshes are computed:
+
+    uvicorn MovieRecommender.asgi:application --host 0.0.0.0 --port 8000 --workers 2
+
+Each worker process computes at most RECOMMENDER_PREFETCH_WORKERS refreshes
+at once. MovieRecommender.wsgi still works with a sync server such as gunicorn.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
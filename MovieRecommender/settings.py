@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import dj_database_url
 import django_heroku
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'Recommender.metrics.QueryMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'MovieRecommender.urls'
@@ -95,6 +97,29 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# Reads inside Recommender.routers.read_replica() go to RECOMMENDER_READ_DATABASE, everything else to 'default'
+DATABASE_ROUTERS = ['Recommender.routers.ReadReplicaRouter']
+
+# With REDIS_URL set (e.g. Heroku Data for Redis) both caches are Redis. Otherwise 'default' is
+# per process and fast, with an atomic incr() for the recommendation queues, and 'shared' is a
+# table of the primary database created by `manage.py createcachetable`, for the state every
+# process must see: read-your-writes marks, genre lists, movie payloads and popularity
+if os.environ.get('REDIS_URL'):
+    redis_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+    CACHES = {'default': redis_cache, 'shared': redis_cache}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'shared': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'recommender_cache',
+        },
+    }
 
 
 # Password validation
@@ -139,9 +164,122 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
 
+# Recommender
+# Number of movies kept from each get_predictions run
+RECOMMENDER_TOP_N = 10
+# Maintain user similarities incrementally on every Rating write and read them
+# from the store in get_predictions. Run `manage.py rebuild_similarities` before enabling.
+RECOMMENDER_SIMILARITY_STORE = False
+# Name of the RECOMMENDER_ENGINES entry that scores recommendations: 'user' for user-user
+# cosine similarity, 'item' to score from the index written by `manage.py build_item_index`,
+# 'factors' to score from the model written by `manage.py train_factors` (both fall back
+# to 'user' until their artifacts exist)
+RECOMMENDER_MODE = 'user'
+# Recommendation engines by name; each implements Recommender.engines.Engine.
+# `manage.py evaluate_engines` compares them on a holdout of the ratings.
+RECOMMENDER_ENGINES = {
+    'user': 'Recommender.engines.UserEngine',
+    'item': 'Recommender.engines.ItemEngine',
+    'factors': 'Recommender.engines.FactorEngine',
+}
+RECOMMENDER_ITEM_INDEX_DIR = os.path.join(BASE_DIR, 'artifacts', 'item_index')
+RECOMMENDER_ITEM_NEIGHBOURS = 50
+RECOMMENDER_FACTORS_DIR = os.path.join(BASE_DIR, 'artifacts', 'factors')
+# Content neighbours from `manage.py build_content_index`, blended into the scores of users
+# and movies with few ratings; both sources weigh the same at this many ratings (0 disables it)
+RECOMMENDER_CONTENT_INDEX_DIR = os.path.join(BASE_DIR, 'artifacts', 'content_index')
+RECOMMENDER_CONTENT_NEIGHBOURS = 50
+RECOMMENDER_CONTENT_SHRINKAGE = 5
+# The index, model and content commands publish a new version of their artifact next to the
+# previous ones (keeping this many); web workers switch to it on their next request and
+# memory-map its arrays read-only, so the workers of a dyno share one copy in the page cache
+RECOMMENDER_ARTIFACT_MMAP = True
+RECOMMENDER_ARTIFACT_VERSIONS_KEPT = 2
+# `manage.py recommender_worker` rebuilds these artifacts ('item', 'factors', 'content'; None for
+# those already published) once this many ratings changed, or once the oldest change waited this
+# many seconds; fewer changes or seconds give fresher recommendations for more CPU
+RECOMMENDER_WORKER_ARTIFACTS = None
+RECOMMENDER_WORKER_MIN_CHANGES = 1000
+RECOMMENDER_WORKER_MAX_STALENESS = 60 * 60
+RECOMMENDER_WORKER_POLL_INTERVAL = 60
+# File the worker records its state in, read back after a restart and by /metrics
+RECOMMENDER_WORKER_STATUS_PATH = os.path.join(BASE_DIR, 'artifacts', 'worker_status.json')
+# Aggregate ratings from only the k approximate nearest users (None for every user).
+# More LSH tables or probes raise recall, more bits per table lower latency;
+# compare settings with `manage.py benchmark_ann`.
+RECOMMENDER_ANN_NEIGHBOURS = None
+RECOMMENDER_ANN_TABLES = 16
+RECOMMENDER_ANN_BITS = 8
+RECOMMENDER_ANN_PROBES = 2
+# 'Recommender.queues.DatabaseQueue' pops from the Recommendation table,
+# 'Recommender.queues.CacheQueue' pops from the ranked lists held in the cache below, which
+# needs an atomic incr() (Redis, memcached or the per-process LocMemCache; Recommender.E002)
+RECOMMENDER_QUEUE_BACKEND = 'Recommender.queues.DatabaseQueue'
+RECOMMENDER_QUEUE_CACHE = 'default'
+RECOMMENDER_QUEUE_TIMEOUT = 60 * 60 * 24
+# Refresh a user's recommendations on a background thread once fewer than this
+# many are left in their queue, e.g. 3 (None disables prefetching)
+RECOMMENDER_PREFETCH_THRESHOLD = None
+# Threads computing refreshes per process, for prefetching and for the async views
+# (0 computes them in the request instead)
+RECOMMENDER_PREFETCH_WORKERS = 2
+# Cold-start and sign-up popularity list: how many movies to keep and for how long (seconds)
+RECOMMENDER_POPULAR_SIZE = 100
+RECOMMENDER_POPULAR_TTL = 15 * 60
+# Seconds a caller waits for the list another one is computing before going on without it
+RECOMMENDER_POPULAR_WAIT = 5
+RECOMMENDER_POPULAR_CACHE = 'shared'
+# Cache holding the per-genre candidate lists of genre-filtered recommendations, shared by every
+# process so that Movie writes invalidate them everywhere (Recommender.W002), and their lifetime
+RECOMMENDER_GENRE_CACHE = 'shared'
+RECOMMENDER_GENRE_TIMEOUT = 60 * 60 * 24
+# Pre-serialized movie JSON: entries kept per process (and for how many seconds, which bounds
+# how long other processes serve a changed movie) in front of the shared cache below; a
+# process-local cache there stretches that bound to its timeout (Recommender.W001)
+RECOMMENDER_MOVIE_PAYLOAD_LRU_SIZE = 4096
+RECOMMENDER_MOVIE_PAYLOAD_LRU_TTL = 60
+RECOMMENDER_MOVIE_PAYLOAD_CACHE = 'shared'
+RECOMMENDER_MOVIE_PAYLOAD_TIMEOUT = 60 * 60 * 24
+# Keep a per-process columnar ratings snapshot that catches up incrementally instead
+# of reloading the Rating table on every refresh; optionally persisted as .npz and
+# reloaded in full every RECOMMENDER_SNAPSHOT_FULL_RELOAD seconds to drop deleted rows
+RECOMMENDER_RATINGS_SNAPSHOT = False
+RECOMMENDER_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'artifacts', 'ratings_snapshot.npz')
+RECOMMENDER_SNAPSHOT_FULL_RELOAD = 60 * 60
+# DATABASES alias serving the snapshot, scoring and popularity reads (None reads from 'default');
+# set from DATABASE_REPLICA_URL below. A user who rated within the last
+# RECOMMENDER_READ_YOUR_WRITES_SECONDS is scored from the primary, tracked in this cache, which
+# every process must share (a process-local cache fails the Recommender.E001 system check)
+RECOMMENDER_READ_DATABASE = None
+RECOMMENDER_READ_YOUR_WRITES_SECONDS = 30
+RECOMMENDER_READ_YOUR_WRITES_CACHE = 'shared'
+# Largest batch accepted by the rate_movies bulk endpoint
+RECOMMENDER_BULK_MAX_RATINGS = 10000
+# Bearer token required to read /metrics (None leaves it open to any scraper)
+RECOMMENDER_METRICS_TOKEN = os.environ.get('RECOMMENDER_METRICS_TOKEN')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-django_heroku.settings(locals())
\ No newline at end of file
+django_heroku.settings(locals())
+
+# A streaming replica of the primary, e.g. a Heroku Postgres follower
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=600)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    RECOMMENDER_READ_DATABASE = 'replica'
+
+# django_heroku inserts the sync-only WhiteNoise middleware first; use the async-capable subclass
+# there (dropping the duplicate entry above) so async views are not run through a sync adapter
+MIDDLEWARE = list(dict.fromkeys(
+    'MovieRecommender.middleware.AsyncWhiteNoiseMiddleware'
+    if middleware == 'whitenoise.middleware.WhiteNoiseMiddleware' else middleware
+    for middleware in MIDDLEWARE))
+
+# Recommender log lines (timings, refreshes) are only formatted at or above this level
+LOGGING['loggers']['Recommender'] = {
+    'handlers': ['console'],
+    'level': os.environ.get('RECOMMENDER_LOG_LEVEL', 'WARNING'),
+}
@@ -0,0 +1,123 @@
+import hashlib
+import numpy as np
+from django.conf import settings
+from sklearn.preprocessing import normalize
+from .sparse import select_top_n
+
+"""
+Approximate nearest-neighbour lookup of similar users for the Recommender app.
+Users are hashed with random-projection LSH (signed random hyperplanes), so
+finding a user's most similar users only compares them with the users that
+share a hash bucket instead of with every user.
+
+Recall is traded against latency with the number of hash tables and probes
+(more of either find more true neighbours) and the bits per table (more bits
+give smaller buckets and faster lookups). Each probe also visits the bucket
+reached by flipping one of the query's least certain hash bits.
+"""
+
+
+class UserLSHIndex:
+    """
+    Random-projection LSH index over the rows of a UserItemMatrix.
+
+    Arguments:
+    - matrix: The UserItemMatrix whose users are indexed.
+    - n_tables: Number of independent hash tables.
+    - n_bits: Number of hyperplanes, i.e. hash bits, per table.
+    - seed: Seed for the random hyperplanes.
+    """
+
+    def __init__(self, matrix, n_tables=16, n_bits=8, seed=0):
+        self.user_ids = matrix.user_ids
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.vectors = normalize(matrix.matrix, norm='l2', axis=1)
+
+        # Drawn table by table, so an index with more tables extends one with fewer
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal((n_tables, matrix.matrix.shape[1], n_bits)).astype(np.float32)
+        self.planes = planes.transpose(1, 0, 2).reshape(matrix.matrix.shape[1], n_tables * n_bits)
+
+        # Every table is a sorted array of bucket codes plus the users in that order
+        codes = self.hash(self.vectors)
+        self.tables = []
+        for table in range(n_tables):
+            order = np.argsort(codes[:, table], kind='stable')
+            self.tables.append((codes[order, table], order))
+
+    def project(self, vectors):
+        """
+        Return the (rows, n_tables, n_bits) projections of a sparse matrix of row vectors.
+        """
+        projections = np.asarray(vectors @ self.planes)
+        return projections.reshape(projections.shape[0], self.n_tables, self.n_bits)
+
+    def hash(self, vectors):
+        """
+        Return the (rows, n_tables) bucket codes of a sparse matrix of row vectors.
+        """
+        return (self.project(vectors) > 0) @ (1 << np.arange(self.n_bits, dtype=np.int64))
+
+    def candidates(self, vector, probes=0):
+        """
+        Return the positions of every indexed user sharing a bucket with the vector in any table.
+        With probes > 0 the buckets one bit flip away, for the probes bits
+        closest to their hyperplane, are visited as well.
+        """
+        projections = self.project(vector)[0]
+        codes = (projections > 0) @ (1 << np.arange(self.n_bits, dtype=np.int64))
+        found = []
+        for table, (sorted_codes, order) in enumerate(self.tables):
+            flips = np.argsort(np.abs(projections[table]))[:probes]
+            for code in np.concatenate([[codes[table]], codes[table] ^ (1 << flips)]):
+                start, end = np.searchsorted(sorted_codes, code, 'left'), np.searchsorted(sorted_codes, code, 'right')
+                found.append(order[start:end])
+        return np.unique(np.concatenate(found))
+
+    def query(self, vector, k, exclude=None, probes=0):
+        """
+        Find approximately the k users most similar to a rating vector.
+        Candidates from the hash buckets are re-ranked by exact cosine similarity.
+
+        Arguments:
+        - vector: 1 x movies sparse rating vector to look up.
+        - k: Number of neighbours to return.
+        - exclude: Optional user id to leave out, normally the querying user.
+        - probes: Number of extra buckets to visit per table.
+
+        Returns:
+        - (user_ids, similarities) arrays, most similar first.
+        """
+        candidates = self.candidates(vector, probes)
+        if exclude is not None:
+            candidates = candidates[self.user_ids[candidates] != exclude]
+
+        similarities = (self.vectors[candidates] @ normalize(vector, norm='l2', axis=1).T).toarray().ravel()
+        keep = similarities > 0
+        candidates, similarities = candidates[keep], similarities[keep]
+
+        best = select_top_n(similarities, k)
+        return self.user_ids[candidates[best]], similarities[best]
+
+
+_loaded_index = {}
+
+
+def get_user_index(matrix):
+    """
+    Return an LSH index for the given matrix, reusing the one built for the
+    same users and movies earlier in this process.
+    New ratings between known users and movies do not trigger a rebuild; the
+    index only selects candidate neighbours, whose similarities get_predictions
+    recomputes from the live matrix.
+    """
+    n_tables = getattr(settings, 'RECOMMENDER_ANN_TABLES', 16)
+    n_bits = getattr(settings, 'RECOMMENDER_ANN_BITS', 8)
+    fingerprint = hashlib.blake2b(matrix.user_ids.tobytes() + matrix.movie_ids.tobytes(), digest_size=16).digest()
+    key = (fingerprint, n_tables, n_bits)
+
+    if key not in _loaded_index:
+        _loaded_index.clear()
+        _loaded_index[key] = UserLSHIndex(matrix, n_tables=n_tables, n_bits=n_bits)
+    return _loaded_index[key]
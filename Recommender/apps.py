@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RecommenderConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Recommender'
+
+    def ready(self):
+        # Connect the Rating signal handlers and register the system checks
+        from . import signals, checks  # noqa: F401
@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from django.conf import settings
+
+"""
+Versioned, memory-mapped model artifacts for the Recommender app.
+Each build of an artifact (item index, factor model, content index) is
+written to a new version directory next to the previous ones, then published
+by atomically replacing the CURRENT file that names the live version. Readers
+stat CURRENT on every lookup and load a new version as soon as it appears, so
+web workers pick up a rebuilt artifact without restarting and never see a
+half-written one.
+
+The .npy arrays are opened with numpy's mmap_mode='r', so all worker
+processes of a dyno share one copy of them through the OS page cache instead
+of each holding its own. Pruned versions stay readable by workers that still
+have them mapped until those workers move on.
+"""
+
+CURRENT_FILE = 'CURRENT'
+# Version directories are written under this prefix and renamed once complete
+PARTIAL_PREFIX = '.partial-'
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def get_mmap_mode():
+    return 'r' if getattr(settings, 'RECOMMENDER_ARTIFACT_MMAP', True) else None
+
+
+def publish(directory, save):
+    """
+    Write a new version of an artifact and make it the current one.
+
+    Arguments:
+    - directory: The artifact's directory, e.g. get_item_index_dir().
+    - save: Callable writing the artifact's files into the directory it is given.
+
+    Returns:
+    - Path of the published version directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Sortable by build time, and unique across concurrent builds
+    version = f'{datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")}-{uuid.uuid4().hex[:8]}'
+    partial = os.path.join(directory, PARTIAL_PREFIX + version)
+    try:
+        save(partial)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    path = os.path.join(directory, version)
+    os.rename(partial, path)
+
+    # Readers see either the previous or the new name, never a partial file
+    pointer = os.path.join(directory, f'{CURRENT_FILE}.{version}')
+    with open(pointer, 'w') as file:
+        file.write(version)
+    os.replace(pointer, os.path.join(directory, CURRENT_FILE))
+
+    prune(directory, keep=getattr(settings, 'RECOMMENDER_ARTIFACT_VERSIONS_KEPT', 2))
+    return path
+
+
+def prune(directory, keep):
+    """
+    Delete all but the newest keep versions; the current version is always kept.
+    """
+    current = current_version(directory)
+    versions = sorted((name for name in os.listdir(directory)
+                       if os.path.isdir(os.path.join(directory, name)) and not name.startswith(PARTIAL_PREFIX)),
+                      reverse=True)
+    for name in versions[max(keep, 1):]:
+        if name != current:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def current_version(directory):
+    """
+    Return the name of the current version of an artifact, or None if none was published.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def load_current(directory, load):
+    """
+    Return the current version of an artifact, loaded once per process and version.
+
+    Arguments:
+    - directory: The artifact's directory.
+    - load: Callable taking a version directory and the mmap_mode to open its arrays with.
+
+    Returns:
+    - The loaded artifact, or None if no version has been published yet.
+    """
+    try:
+        stat = os.stat(os.path.join(directory, CURRENT_FILE))
+    except OSError:
+        return None
+    # os.replace gives CURRENT a new inode on every publish
+    token = (stat.st_ino, stat.st_mtime_ns, get_mmap_mode())
+
+    cached = _loaded.get(directory)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+    with _lock:
+        cached = _loaded.get(directory)
+        if cached is None or cached[0] != token:
+            version = current_version(directory)
+            if version is None:
+                return None
+            cached = (token, load(os.path.join(directory, version), get_mmap_mode()))
+            _loaded[directory] = cached
+    return cached[1]
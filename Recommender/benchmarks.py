@@ -0,0 +1,157 @@
+import json
+import time
+import tracemalloc
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from .models import Movie, Rating, Recommendation
+from .utils import refresh_recommendation, fetch_next_recommendation
+from .views import rate_movie
+
+"""
+Synthetic-data benchmarks for the recommendation hot paths.
+A seeded generator fills the database with users, movies and ratings at a
+chosen size and sparsity, then every hot path is timed and measured for
+peak Python memory (tracemalloc, which includes NumPy buffers) and SQL
+query count. Results are plain dicts so runs can be saved as JSON and
+compared before and after a change.
+"""
+
+# Named dataset sizes for `manage.py benchmark_recommender --preset`
+PRESETS = {
+    'small': {'users': 1000, 'movies': 500, 'density': 0.02},
+    'medium': {'users': 10000, 'movies': 2000, 'density': 0.01},
+    'large': {'users': 100000, 'movies': 5000, 'density': 0.002},
+}
+
+
+def synthetic_ratings(n_users, n_movies, density, seed):
+    """
+    Generate unique (user, movie) pairs with ratings from latent tastes, so
+    that users genuinely have more and less similar neighbours. Pairs come in
+    random order, like ratings arriving over time, so a time-based holdout of
+    the newest ones spans all users.
+
+    Returns:
+    - (users, movies, ratings) arrays with 1-based user and movie numbers.
+    """
+    rng = np.random.default_rng(seed)
+    n_ratings = int(n_users * n_movies * density)
+    keys = rng.permutation(np.unique(rng.integers(0, n_users * n_movies, size=n_ratings)))
+    users, movies = keys // n_movies + 1, keys % n_movies + 1
+
+    user_tastes = rng.standard_normal((n_users + 1, 8))
+    movie_traits = rng.standard_normal((n_movies + 1, 8))
+    affinity = np.einsum('ij,ij->i', user_tastes[users], movie_traits[movies])
+    ratings = np.clip(np.rint(3 + affinity / 2), 1, 5).astype(np.int64)
+    return users, movies, ratings
+
+
+def populate(n_users, n_movies, density, seed, batch_size=5000):
+    """
+    Fill the database with a synthetic dataset.
+
+    Returns:
+    - dict describing the generated dataset.
+    """
+    started = time.perf_counter()
+    users, movies, ratings = synthetic_ratings(n_users, n_movies, density, seed)
+
+    # Unusable passwords skip the password hashing of create_user
+    User.objects.bulk_create([User(username=f'bench_user_{i}', password='!') for i in range(1, n_users + 1)],
+                             batch_size=batch_size)
+    Movie.objects.bulk_create([Movie(title=f'Benchmark Movie {i}', genre='Drama', overview='Synthetic movie')
+                               for i in range(1, n_movies + 1)], batch_size=batch_size)
+    user_ids = np.array(User.objects.filter(username__startswith='bench_user_').order_by('id')
+                        .values_list('id', flat=True))
+    movie_ids = np.array(Movie.objects.filter(title__startswith='Benchmark Movie ').order_by('id')
+                         .values_list('id', flat=True))
+
+    for start in range(0, len(ratings), batch_size):
+        end = start + batch_size
+        Rating.objects.bulk_create([
+            Rating(user_id=int(user_id), movie_id=int(movie_id), rating=int(rating))
+            for user_id, movie_id, rating in zip(user_ids[users[start:end] - 1], movie_ids[movies[start:end] - 1],
+                                                 ratings[start:end])
+        ])
+
+    return {
+        'users': n_users,
+        'movies': n_movies,
+        'density': density,
+        'ratings': int(len(ratings)),
+        'seed': seed,
+        'populate_seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def measure(call, samples):
+    """
+    Run call(sample) for every sample and summarise wall time, peak memory and SQL queries.
+    Timings are taken without tracemalloc; peak memory comes from one extra traced call.
+    """
+    timings, query_counts = [], []
+    for sample in samples:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            call(sample)
+            timings.append(time.perf_counter() - started)
+        query_counts.append(len(queries))
+
+    tracemalloc.start()
+    try:
+        call(samples[0])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings_ms = np.array(timings) * 1000
+    return {
+        'calls': len(samples),
+        'wall_ms_mean': round(float(timings_ms.mean()), 3),
+        'wall_ms_p50': round(float(np.percentile(timings_ms, 50)), 3),
+        'wall_ms_p95': round(float(np.percentile(timings_ms, 95)), 3),
+        'wall_ms_max': round(float(timings_ms.max()), 3),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'queries_mean': round(float(np.mean(query_counts)), 2),
+        'queries_max': int(max(query_counts)),
+    }
+
+
+def run_benchmarks(samples, seed):
+    """
+    Measure each hot path for a seeded sample of the users in the database.
+
+    Returns:
+    - dict mapping path names to their measurements.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = list(Rating.objects.values_list('user_id', flat=True).distinct().order_by('user_id'))
+    users = list(User.objects.filter(id__in=rng.choice(user_ids, size=min(samples, len(user_ids)), replace=False)))
+    movie_ids = list(Movie.objects.values_list('id', flat=True))
+    factory = RequestFactory()
+
+    def rate(user):
+        rated = set(Rating.objects.filter(user=user).values_list('movie_id', flat=True))
+        movie_id = next(movie_id for movie_id in rng.permutation(movie_ids) if movie_id not in rated)
+        request = factory.post(reverse('rate_movie'), data=json.dumps(
+            {'movie_id': int(movie_id), 'user_id': user.id, 'rating': int(rng.integers(1, 6))}),
+            content_type='application/json')
+        async_to_sync(rate_movie)(request)
+
+    def fetch_next(user):
+        # Measure the pop of a filled queue rather than a refresh
+        if not Recommendation.objects.filter(user=user).exists():
+            refresh_recommendation(user)
+        fetch_next_recommendation(user)
+
+    return {
+        'get_predictions': measure(Recommendation.get_predictions, users),
+        'refresh_recommendation': measure(refresh_recommendation, users),
+        'fetch_next_recommendation': measure(fetch_next, users),
+        'rate_movie': measure(rate, users),
+    }
@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core import checks
+from django.db import DEFAULT_DB_ALIAS
+from .queues import ATOMIC_INCR_CACHES
+
+"""
+System checks for the Recommender app.
+Several features keep state in a Django cache that every web and worker
+process must see. A process-local backend would silently give each process
+its own copy, so these checks report it at startup instead.
+"""
+
+# Cache backends that keep their entries inside one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def process_local_cache(setting):
+    """
+    Return the alias and backend named by a cache setting if that backend is process-local, else None.
+    """
+    alias = getattr(settings, setting, 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    return (alias, backend) if backend in PROCESS_LOCAL_CACHES else None
+
+
+@checks.register(checks.Tags.caches, checks.Tags.database)
+def check_read_your_writes_cache(app_configs, **kwargs):
+    """
+    Fail if a replica is configured but the read-your-writes marks are kept in a
+    process-local cache, where other processes would score recent writers from the replica.
+    """
+    if getattr(settings, 'RECOMMENDER_READ_DATABASE', None) in (None, DEFAULT_DB_ALIAS):
+        return []
+    local = process_local_cache('RECOMMENDER_READ_YOUR_WRITES_CACHE')
+    if local:
+        return [checks.Error(
+            f'RECOMMENDER_READ_YOUR_WRITES_CACHE {local[0]!r} uses {local[1]}, which other processes cannot see.',
+            hint='Point it at a shared cache (Redis or DatabaseCache) or unset RECOMMENDER_READ_DATABASE.',
+            id='Recommender.E001',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_movie_payload_cache(app_configs, **kwargs):
+    """
+    Warn if movie payloads are cached per process, where a changed movie is only
+    dropped from the process that saved it.
+    """
+    local = process_local_cache('RECOMMENDER_MOVIE_PAYLOAD_CACHE')
+    if local:
+        return [checks.Warning(
+            f'RECOMMENDER_MOVIE_PAYLOAD_CACHE {local[0]!r} uses {local[1]}; other processes serve a changed movie '
+            f'for up to RECOMMENDER_MOVIE_PAYLOAD_TIMEOUT seconds.',
+            hint='Point it at a shared cache (Redis or DatabaseCache).',
+            id='Recommender.W001',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_genre_cache(app_configs, **kwargs):
+    """
+    Warn if the genre lists are cached per process, where Movie writes only invalidate
+    the lists of the process that made them.
+    """
+    local = process_local_cache('RECOMMENDER_GENRE_CACHE')
+    if local:
+        return [checks.Warning(
+            f'RECOMMENDER_GENRE_CACHE {local[0]!r} uses {local[1]}; other processes serve outdated genre lists '
+            f'for up to RECOMMENDER_GENRE_TIMEOUT seconds.',
+            hint='Point it at a shared cache (Redis or DatabaseCache).',
+            id='Recommender.W002',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_queue_cache(app_configs, **kwargs):
+    """
+    Fail if CacheQueue is selected with a cache whose incr() is not atomic, and warn if
+    its positions are kept per process, where a user served by two processes sees movies twice.
+    """
+    if getattr(settings, 'RECOMMENDER_QUEUE_BACKEND', None) != 'Recommender.queues.CacheQueue':
+        return []
+    alias = getattr(settings, 'RECOMMENDER_QUEUE_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in ATOMIC_INCR_CACHES:
+        return [checks.Error(
+            f'RECOMMENDER_QUEUE_CACHE {alias!r} uses {backend}, whose incr() is not atomic.',
+            hint='Point it at Redis or memcached, or use Recommender.queues.DatabaseQueue.',
+            id='Recommender.E002',
+        )]
+    local = process_local_cache('RECOMMENDER_QUEUE_CACHE')
+    if local:
+        return [checks.Warning(
+            f'RECOMMENDER_QUEUE_CACHE {local[0]!r} uses {local[1]}; every process keeps its own queue positions.',
+            hint='Point it at Redis or memcached.',
+            id='Recommender.W003',
+        )]
+    return []
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from django.conf import settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+from .item_index import ItemIndex, top_k_neighbours
+from .sparse import select_top_n
+from .genres import split_genres
+from .artifacts import load_current
+
+"""
+Content-based movie neighbours for the Recommender app.
+`manage.py build_content_index` vectorizes every movie's overview and genres
+with TF-IDF and stores the top-K cosine neighbours of each movie, in the same
+array layout and with the same versioned, memory-mapped storage as the item index. Unlike the item index it covers movies that
+have no ratings yet, so Recommendation.get_predictions blends it into the
+collaborative scores of users and movies with few ratings.
+"""
+
+MOVIE_IDS_FILE = 'movie_ids.npy'
+NEIGHBOURS_FILE = 'neighbours.npy'
+SIMILARITIES_FILE = 'similarities.npy'
+RATING_COUNTS_FILE = 'rating_counts.npy'
+
+
+def get_content_index_dir():
+    return getattr(settings, 'RECOMMENDER_CONTENT_INDEX_DIR',
+                   os.path.join(settings.BASE_DIR, 'artifacts', 'content_index'))
+
+
+def tfidf_vectors(documents, **options):
+    """
+    L2-normalized TF-IDF vectors of the documents, one row each; no columns if no document has a term.
+    """
+    try:
+        return TfidfVectorizer(**options).fit_transform(documents)
+    except ValueError:
+        return sparse.csr_matrix((len(documents), 0))
+
+
+class ContentIndex(ItemIndex):
+    """
+    Top-K content neighbours of every movie, plus the number of active ratings
+    each movie had when the index was built.
+
+    - similarities: (movies, K) float16, which is precise enough to rank neighbours.
+    - rating_counts: (movies,) int32.
+    """
+
+    def __init__(self, movie_ids, neighbours, similarities, rating_counts):
+        super().__init__(movie_ids, neighbours, similarities)
+        self.rating_counts = rating_counts
+
+    @classmethod
+    def build(cls, movies, rating_counts, k, genre_weight=0.5, chunk_size=1024):
+        """
+        Compute the index from the movie catalog.
+
+        Arguments:
+        - movies: (movie_id, overview, genre) tuples; missing texts may be None.
+        - rating_counts: {movie_id: number of active ratings}.
+        - k: Number of neighbours to keep per movie.
+        - genre_weight: Weight of the genre vector relative to the overview vector.
+        - chunk_size: Number of movies whose similarities are computed together.
+        """
+        movies = sorted(movies, key=lambda movie: movie[0])
+        overviews = tfidf_vectors([overview or '' for _, overview, _ in movies],
+                                  stop_words='english', sublinear_tf=True)
+        genres = tfidf_vectors([genre or '' for _, _, genre in movies], tokenizer=split_genres,
+                               token_pattern=None, lowercase=False)
+        vectors = sparse.hstack([overviews, genre_weight * genres]).tocsr()
+
+        neighbours, similarities = top_k_neighbours(vectors, k, chunk_size)
+        movie_ids = np.array([movie_id for movie_id, _, _ in movies], dtype=np.int64)
+        counts = np.array([rating_counts.get(movie_id, 0) for movie_id in movie_ids], dtype=np.int32)
+        return cls(movie_ids, neighbours, similarities.astype(np.float16), counts)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, MOVIE_IDS_FILE), self.movie_ids)
+        np.save(os.path.join(directory, SIMILARITIES_FILE), self.similarities)
+        np.save(os.path.join(directory, RATING_COUNTS_FILE), self.rating_counts)
+        np.save(os.path.join(directory, NEIGHBOURS_FILE), self.neighbours)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        return cls(np.load(os.path.join(directory, MOVIE_IDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, NEIGHBOURS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, SIMILARITIES_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, RATING_COUNTS_FILE), mmap_mode=mmap_mode))
+
+    def predict(self, movie_ids, ratings, top_n=None, candidates=None):
+        """
+        Score a user's affinity to every movie reached from the movies they rated.
+        Unlike the item index's weighted mean, the score is the mean of
+        similarity * rating over the rated movies, so close neighbours of
+        well-rated movies beat movies that only share a common word.
+
+        Returns:
+        - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+        """
+        positions, weighted_sums, weight_totals = self.neighbour_sums(movie_ids, ratings)
+
+        columns = self.candidate_columns(weight_totals > 0, positions, candidates)
+        scores = weighted_sums[columns] / max(len(positions), 1)
+
+        best = select_top_n(scores, top_n)
+        return pd.DataFrame({'movie_id': self.movie_ids[columns[best]], 'predicted_rating': scores[best]})
+
+    def counts_of(self, movie_ids):
+        """
+        Return the rating counts of the given movies, 0 for movies the index does not know.
+        """
+        positions, known = self.movie_positions(movie_ids)
+        counts = np.zeros(len(positions), dtype=np.int64)
+        counts[known] = self.rating_counts[positions[known]]
+        return counts
+
+
+def scale(scores):
+    # Min-max scale to [0, 1]; the engines' scores are not all on the rating scale
+    if np.isnan(scores).all():
+        return scores
+    low, high = np.nanmin(scores), np.nanmax(scores)
+    return np.ones_like(scores) if high == low else (scores - low) / (high - low)
+
+
+def blend_predictions(predictions, content_index, movie_ids, ratings, exclude=(), shrinkage=5, top_n=None,
+                      candidates=None):
+    """
+    Blend an engine's predictions with the content neighbours of the movies a user rated.
+    The content weight of a candidate is shrinkage / (shrinkage + n) for the
+    smaller of the user's and the movie's number of ratings, so content
+    dominates for new users and new movies and fades out as ratings accumulate.
+    Movies only one source can score keep that source's score.
+
+    Arguments:
+    - predictions: The engine's predictions for all candidates (top_n=None).
+    - content_index: The ContentIndex to score with.
+    - movie_ids, ratings: The user's active ratings.
+    - exclude: Ids of movies never to recommend, e.g. those already rated or skipped.
+    - shrinkage: Number of ratings at which both sources weigh the same.
+    - top_n: Number of predictions to keep, best first.
+    - candidates: If given, only these movie ids are scored by the content index.
+
+    Returns:
+    - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+      Scores are on a [0, 1] scale.
+    """
+    content = content_index.predict(movie_ids, ratings, candidates=candidates)
+    merged = pd.merge(predictions, content, on='movie_id', how='outer', suffixes=('', '_content'))
+    merged = merged[~merged['movie_id'].isin(list(exclude))]
+
+    collaborative = scale(merged['predicted_rating'].to_numpy(dtype=np.float64))
+    content_scores = scale(merged['predicted_rating_content'].to_numpy(dtype=np.float64))
+    counts = np.minimum(content_index.counts_of(merged['movie_id']), len(movie_ids))
+    weight = shrinkage / (shrinkage + counts)
+    scores = np.where(np.isnan(collaborative), content_scores,
+                      np.where(np.isnan(content_scores), collaborative,
+                               weight * content_scores + (1 - weight) * collaborative))
+
+    movie_ids = merged['movie_id'].to_numpy(dtype=np.int64)
+    best = select_top_n(scores, top_n)
+    return pd.DataFrame({'movie_id': movie_ids[best], 'predicted_rating': scores[best]})
+
+
+def get_content_index():
+    """
+    Return the current content index, memory-mapped once per process and version.
+    A rebuilt index takes effect on the next call. Returns None if no index has
+    been built yet.
+    """
+    return load_current(get_content_index_dir(), ContentIndex.load)
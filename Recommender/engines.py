@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import Rating
+from .item_index import ItemIndex, get_item_index
+from .ann import get_user_index
+from .factorization import FactorModel, get_factor_model
+from .metrics import timed
+
+"""
+Recommendation engines for the Recommender app.
+Every scoring method implements the Engine interface and is registered by
+name in RECOMMENDER_ENGINES; RECOMMENDER_MODE selects the one that
+Recommendation.get_predictions uses. An engine scores users in two ways:
+
+- predict(user, top_n) serves the web process from the live ratings and
+  from the engine's artifacts built offline.
+- predict_snapshot(matrix, user_id, top_n) scores a user of a ratings
+  snapshot with the same artifacts, so `manage.py precompute_recommendations`
+  stores what predict would return without a query per user.
+- fit(matrix) and recommend(user_id, top_n) score from an in-memory
+  training matrix only, so `manage.py evaluate_engines` can compare engines
+  on a holdout split without touching the artifacts.
+"""
+
+DEFAULT_ENGINE = 'user'
+
+DEFAULT_ENGINES = {
+    'user': 'Recommender.engines.UserEngine',
+    'item': 'Recommender.engines.ItemEngine',
+    'factors': 'Recommender.engines.FactorEngine',
+}
+
+
+def empty_predictions():
+    return pd.DataFrame({'movie_id': [], 'predicted_rating': []})
+
+
+class Engine:
+    """
+    Interface of a recommendation engine.
+    """
+    name = None
+
+    def is_ready(self):
+        """
+        Return whether predict() can be served, e.g. whether the engine's artifacts have been built.
+        get_predictions falls back to the default engine while it is not.
+        """
+        return True
+
+    def predict(self, user, top_n=None, candidates=None):
+        """
+        Score the movies the user has not rated yet from the live data.
+        If candidates (sorted movie ids) are given, only those movies are scored.
+
+        Returns:
+        - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+        """
+        raise NotImplementedError
+
+    def predict_snapshot(self, matrix, user_id, top_n=None, skipped=()):
+        """
+        Score a user of a UserItemMatrix of active ratings like predict(), from the
+        engine's artifacts; skipped movies, absent from the matrix, are not returned either.
+        """
+        raise NotImplementedError
+
+    def fit(self, matrix):
+        """
+        Prepare the engine to score from a UserItemMatrix of training ratings only.
+
+        Returns:
+        - self.
+        """
+        raise NotImplementedError
+
+    def recommend(self, user_id, top_n=None):
+        """
+        Score the movies a user of the fitted matrix has not rated, like predict().
+        """
+        raise NotImplementedError
+
+
+class UserEngine(Engine):
+    """
+    User-user cosine similarity over the ratings matrix, optionally restricted
+    to approximate nearest neighbours (RECOMMENDER_ANN_NEIGHBOURS) or read from
+    the incremental similarity store (RECOMMENDER_SIMILARITY_STORE).
+    """
+    name = 'user'
+
+    def predict(self, user, top_n=None, candidates=None):
+        # Build a sparse user-item matrix from the columnar ratings snapshot
+        from .snapshot import load_ratings_matrix
+        user_movie_matrix = load_ratings_matrix()
+
+        user_id = user.id
+        if user_id not in user_movie_matrix:
+            return empty_predictions()
+
+        # Aggregate only the approximate top-k most similar users when enabled
+        ann_neighbours = getattr(settings, 'RECOMMENDER_ANN_NEIGHBOURS', None)
+        if ann_neighbours:
+            with timed('neighbours'):
+                user_index = get_user_index(user_movie_matrix)
+                row = user_movie_matrix.user_position(user_id)
+                neighbour_ids, _ = user_index.query(user_movie_matrix.matrix[row], ann_neighbours, exclude=user_id,
+                                                    probes=getattr(settings, 'RECOMMENDER_ANN_PROBES', 2))
+            neighbours = [user_movie_matrix.user_position(neighbour_id) for neighbour_id in neighbour_ids]
+            return user_movie_matrix.predict(user_id, top_n=top_n, neighbours=neighbours, candidates=candidates)
+
+        # Read the similarity row from the incremental store instead of recomputing it
+        similarities = None
+        if getattr(settings, 'RECOMMENDER_SIMILARITY_STORE', False):
+            from .similarity import similarity_row
+            with timed('similarity'):
+                similarities = user_movie_matrix.align_users(similarity_row(user_id))
+
+        # Score every unrated movie in one pass and keep only the best top_n
+        return user_movie_matrix.predict(user_id, top_n=top_n, similarities=similarities, candidates=candidates)
+
+    def predict_snapshot(self, matrix, user_id, top_n=None, skipped=()):
+        return matrix.predict(user_id, top_n=top_n)
+
+    def fit(self, matrix):
+        self.matrix = matrix
+        return self
+
+    def recommend(self, user_id, top_n=None):
+        return self.matrix.predict(user_id, top_n=top_n)
+
+
+class ItemEngine(Engine):
+    """
+    Item-item cosine similarity from the neighbour index written by `manage.py build_item_index`.
+    """
+    name = 'item'
+
+    def is_ready(self):
+        return get_item_index() is not None
+
+    def predict(self, user, top_n=None, candidates=None):
+        with timed('load_ratings'):
+            user_ratings = dict(Rating.objects.filter(user=user, is_skipped=False, rating__isnull=False)
+                                .order_by('id').values_list('movie_id', 'rating'))
+        with timed('scoring'):
+            return get_item_index().predict(list(user_ratings.keys()), list(user_ratings.values()), top_n=top_n,
+                                            candidates=candidates)
+
+    def predict_snapshot(self, matrix, user_id, top_n=None, skipped=()):
+        row = matrix.matrix[matrix.user_position(user_id)]
+        return get_item_index().predict(matrix.movie_ids[row.indices], row.data, top_n=top_n)
+
+    def fit(self, matrix):
+        self.matrix = matrix
+        self.index = ItemIndex.build(matrix, getattr(settings, 'RECOMMENDER_ITEM_NEIGHBOURS', 50))
+        return self
+
+    def recommend(self, user_id, top_n=None):
+        row = self.matrix.matrix[self.matrix.user_position(user_id)]
+        return self.index.predict(self.matrix.movie_ids[row.indices], row.data, top_n=top_n)
+
+
+class FactorEngine(Engine):
+    """
+    Matrix factorization from the model written by `manage.py train_factors`.
+    """
+    name = 'factors'
+
+    def is_ready(self):
+        return get_factor_model() is not None
+
+    def predict(self, user, top_n=None, candidates=None):
+        factor_model = get_factor_model()
+        with timed('load_ratings'):
+            user_ratings = list(Rating.objects.filter(user=user).values_list('movie_id', 'rating', 'is_skipped'))
+        # Rated and skipped movies are both excluded; only active ratings fold a new user in
+        active = [(movie_id, rating) for movie_id, rating, is_skipped in user_ratings
+                  if not is_skipped and rating is not None]
+        with timed('scoring'):
+            vector = factor_model.user_vector(user.id, [movie_id for movie_id, _ in active],
+                                              [rating for _, rating in active])
+            return factor_model.predict(vector, exclude=[movie_id for movie_id, _, _ in user_ratings], top_n=top_n,
+                                        candidates=candidates)
+
+    def predict_snapshot(self, matrix, user_id, top_n=None, skipped=()):
+        factor_model = get_factor_model()
+        row = matrix.matrix[matrix.user_position(user_id)]
+        rated = matrix.movie_ids[row.indices]
+        return factor_model.predict(factor_model.user_vector(user_id, rated, row.data),
+                                    exclude=np.concatenate([rated, np.asarray(skipped, dtype=rated.dtype)]),
+                                    top_n=top_n)
+
+    def fit(self, matrix, factors=32, regularization=0.1, iterations=10):
+        self.matrix = matrix
+        self.model = FactorModel.train(matrix, factors, regularization, iterations)
+        return self
+
+    def recommend(self, user_id, top_n=None):
+        row = self.matrix.matrix[self.matrix.user_position(user_id)]
+        rated = self.matrix.movie_ids[row.indices]
+        return self.model.predict(self.model.user_vector(user_id, rated, row.data), exclude=rated, top_n=top_n)
+
+
+def get_engine_classes():
+    """
+    Return {name: engine class} of every registered engine.
+    """
+    engines = getattr(settings, 'RECOMMENDER_ENGINES', DEFAULT_ENGINES)
+    return {name: import_string(path) for name, path in engines.items()}
+
+
+def get_engine(name=None):
+    """
+    Return the engine registered under name (RECOMMENDER_MODE by default),
+    or the default engine if that one is not ready to serve.
+    """
+    if name is None:
+        name = getattr(settings, 'RECOMMENDER_MODE', DEFAULT_ENGINE)
+    engines = get_engine_classes()
+    if name not in engines:
+        raise ValueError(f'Unknown recommendation engine: {name!r}')
+
+    engine = engines[name]()
+    if name != DEFAULT_ENGINE and not engine.is_ready():
+        engine = engines[DEFAULT_ENGINE]()
+    return engine
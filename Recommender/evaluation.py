@@ -0,0 +1,137 @@
+import time
+import tracemalloc
+import numpy as np
+from .snapshot import RatingsSnapshot
+from .sparse import UserItemMatrix
+from .engines import get_engine_classes
+
+"""
+Offline evaluation of the recommendation engines for the Recommender app.
+The active ratings are split by time: the newest fraction (by rating id, i.e.
+creation order) is held out and every engine is fitted on the older ratings
+only. Each engine is then scored on the held-out ratings of a sample of users
+for quality (precision@k, recall@k, RMSE) and cost (fit time and peak memory,
+p50/p99 latency of a top-k recommendation).
+"""
+
+
+def time_split(snapshot, test_fraction):
+    """
+    Split the active ratings of a snapshot into older training and newer test ratings.
+
+    Arguments:
+    - snapshot: A RatingsSnapshot loaded with active_only=True; its arrays are sorted by rating id.
+    - test_fraction: Fraction of the newest ratings to hold out.
+
+    Returns:
+    - (train, test) tuples of (user_ids, movie_ids, ratings) arrays. Test ratings
+      of users or movies without any training rating are dropped.
+    """
+    cutoff = len(snapshot) - int(round(len(snapshot) * test_fraction))
+    users, movies, ratings = snapshot.user_ids, snapshot.movie_ids, snapshot.ratings.astype(np.float64)
+    train = users[:cutoff], movies[:cutoff], ratings[:cutoff]
+
+    known = np.isin(users[cutoff:], train[0]) & np.isin(movies[cutoff:], train[1])
+    test = users[cutoff:][known], movies[cutoff:][known], ratings[cutoff:][known]
+    return train, test
+
+
+def evaluate_engine(engine, train_matrix, held_out, k, threshold):
+    """
+    Fit one engine on the training matrix and score it on the held-out ratings.
+
+    Arguments:
+    - engine: An unfitted Engine instance.
+    - train_matrix: The UserItemMatrix of training ratings.
+    - held_out: {user_id: {movie_id: rating}} of the evaluated users.
+    - k: Length of the recommendation list for precision and recall.
+    - threshold: Minimum held-out rating that counts as relevant.
+
+    Returns:
+    - dict of quality and cost metrics.
+    """
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        engine.fit(train_matrix)
+        fit_seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings, precisions, recalls, errors = [], [], [], []
+    for user_id, ratings in held_out.items():
+        started = time.perf_counter()
+        top = engine.recommend(user_id, top_n=k)
+        timings.append(time.perf_counter() - started)
+
+        relevant = {movie_id for movie_id, rating in ratings.items() if rating >= threshold}
+        if relevant:
+            hits = len(relevant.intersection(int(movie_id) for movie_id in top['movie_id']))
+            precisions.append(hits / k)
+            recalls.append(hits / len(relevant))
+
+        # RMSE over the held-out movies the engine can score at all
+        scores = engine.recommend(user_id)
+        scores = dict(zip(scores['movie_id'].astype(int), scores['predicted_rating']))
+        errors.extend(scores[movie_id] - rating for movie_id, rating in ratings.items() if movie_id in scores)
+
+    n_ratings = sum(len(ratings) for ratings in held_out.values())
+    timings_ms = np.array(timings or [0.0]) * 1000
+    return {
+        f'precision_at_{k}': round(float(np.mean(precisions)), 4) if precisions else None,
+        f'recall_at_{k}': round(float(np.mean(recalls)), 4) if recalls else None,
+        'rmse': round(float(np.sqrt(np.mean(np.square(errors)))), 4) if errors else None,
+        'rmse_coverage': round(len(errors) / n_ratings, 4) if n_ratings else None,
+        'latency_ms_p50': round(float(np.percentile(timings_ms, 50)), 3),
+        'latency_ms_p99': round(float(np.percentile(timings_ms, 99)), 3),
+        'fit_seconds': round(fit_seconds, 3),
+        'fit_peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_evaluation(engines=None, test_fraction=0.2, k=10, users=None, threshold=4, seed=0):
+    """
+    Evaluate the registered engines on a time-based holdout of the ratings in the database.
+
+    Arguments:
+    - engines: Names of the engines to evaluate; all registered engines by default.
+    - test_fraction: Fraction of the newest ratings to hold out.
+    - k: Length of the recommendation list for precision@k and recall@k.
+    - users: Evaluate a seeded sample of at most this many test users; all of them by default.
+    - threshold: Minimum held-out rating that counts as relevant.
+    - seed: Seed of the user sample.
+
+    Returns:
+    - dict describing the split and the metrics of every engine.
+    """
+    engine_classes = get_engine_classes()
+    names = list(engine_classes) if engines is None else list(engines)
+    unknown = [name for name in names if name not in engine_classes]
+    if unknown:
+        raise ValueError(f'Unknown recommendation engines: {", ".join(unknown)}')
+
+    snapshot = RatingsSnapshot.from_database(active_only=True)
+    train, test = time_split(snapshot, test_fraction)
+    train_matrix = UserItemMatrix.from_arrays(*train)
+
+    held_out = {}
+    for user_id, movie_id, rating in zip(*test):
+        held_out.setdefault(int(user_id), {})[int(movie_id)] = float(rating)
+    if users is not None and len(held_out) > users:
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(sorted(held_out), size=users, replace=False)
+        held_out = {int(user_id): held_out[int(user_id)] for user_id in sample}
+
+    return {
+        'split': {
+            'train_ratings': int(train_matrix.matrix.nnz),
+            'test_ratings': int(sum(len(ratings) for ratings in held_out.values())),
+            'test_users': len(held_out),
+            'test_fraction': test_fraction,
+            'k': k,
+            'threshold': threshold,
+        },
+        'engines': {name: evaluate_engine(engine_classes[name](), train_matrix, held_out, k, threshold)
+                    for name in names},
+    }
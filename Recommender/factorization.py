@@ -0,0 +1,176 @@
+import os
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from .sparse import select_top_n
+from .artifacts import load_current
+
+"""
+Matrix-factorization model for the Recommender app.
+`manage.py train_factors` factorizes the rating matrix offline with
+alternating least squares (ALS-WR) into user and movie factor arrays. The web
+process scores a user with one product of the movie factors and the user's
+factor vector, followed by a partial top-N selection. Users who joined after
+training are folded in with a single regularized least-squares solve over the
+movies they rated, without retraining.
+"""
+
+USER_IDS_FILE = 'user_ids.npy'
+MOVIE_IDS_FILE = 'movie_ids.npy'
+USER_FACTORS_FILE = 'user_factors.npy'
+ITEM_FACTORS_FILE = 'item_factors.npy'
+PARAMETERS_FILE = 'parameters.npy'
+
+
+def get_factor_model_dir():
+    return getattr(settings, 'RECOMMENDER_FACTORS_DIR', os.path.join(settings.BASE_DIR, 'artifacts', 'factors'))
+
+
+def solve_rows(ratings, fixed, regularization):
+    """
+    Solve the regularized least-squares problem of every row of a CSR matrix
+    against the fixed factors of its columns, weighting the regularization by
+    the row's number of ratings. Rows without ratings get zero factors.
+    """
+    factors = np.zeros((ratings.shape[0], fixed.shape[1]))
+    identity = np.eye(fixed.shape[1])
+    for row in range(ratings.shape[0]):
+        start, end = ratings.indptr[row], ratings.indptr[row + 1]
+        if start == end:
+            continue
+        columns = fixed[ratings.indices[start:end]]
+        factors[row] = np.linalg.solve(columns.T @ columns + regularization * (end - start) * identity,
+                                       columns.T @ ratings.data[start:end])
+    return factors
+
+
+class FactorModel:
+    """
+    Latent factors of users and movies; a predicted rating is
+    global_mean + user_factors[u] . item_factors[m].
+
+    - user_ids, movie_ids: sorted ids; row i of the factor arrays belongs to the i-th id.
+    - user_factors: (users, factors) float32.
+    - item_factors: (movies, factors) float32.
+    """
+
+    def __init__(self, user_ids, movie_ids, user_factors, item_factors, global_mean, regularization):
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.global_mean = global_mean
+        self.regularization = regularization
+
+    @classmethod
+    def train(cls, matrix, factors=32, regularization=0.1, iterations=10, seed=0):
+        """
+        Factorize a UserItemMatrix with alternating least squares.
+
+        Arguments:
+        - matrix: The UserItemMatrix of explicit ratings to train on.
+        - factors: Number of latent factors.
+        - regularization: L2 penalty, scaled by each user's and movie's number of ratings.
+        - iterations: Number of user-then-movie alternations.
+        - seed: Seed of the random initial movie factors.
+        """
+        by_user = matrix.matrix.tocsr().astype(np.float64)
+        global_mean = float(by_user.data.mean()) if by_user.nnz else 0.0
+        by_user.data -= global_mean
+        by_movie = by_user.T.tocsr()
+
+        rng = np.random.default_rng(seed)
+        item_factors = rng.normal(scale=0.1, size=(by_movie.shape[0], factors))
+        user_factors = np.zeros((by_user.shape[0], factors))
+        for _ in range(iterations):
+            user_factors = solve_rows(by_user, item_factors, regularization)
+            item_factors = solve_rows(by_movie, user_factors, regularization)
+
+        return cls(matrix.user_ids.astype(np.int64), matrix.movie_ids.astype(np.int64),
+                   user_factors.astype(np.float32), item_factors.astype(np.float32), global_mean, regularization)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, USER_IDS_FILE), self.user_ids)
+        np.save(os.path.join(directory, MOVIE_IDS_FILE), self.movie_ids)
+        np.save(os.path.join(directory, USER_FACTORS_FILE), self.user_factors)
+        np.save(os.path.join(directory, ITEM_FACTORS_FILE), self.item_factors)
+        np.save(os.path.join(directory, PARAMETERS_FILE), np.array([self.global_mean, self.regularization]))
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        global_mean, regularization = np.load(os.path.join(directory, PARAMETERS_FILE))
+        return cls(np.load(os.path.join(directory, USER_IDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, MOVIE_IDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, USER_FACTORS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, ITEM_FACTORS_FILE), mmap_mode=mmap_mode),
+                   float(global_mean), float(regularization))
+
+    def movie_positions(self, movie_ids):
+        """
+        Return the factor rows of the given movies and a mask of which ones the model knows.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        known = positions < len(self.movie_ids)
+        known[known] = self.movie_ids[positions[known]] == movie_ids[known]
+        return positions, known
+
+    def fold_in(self, movie_ids, ratings):
+        """
+        Compute the factor vector of a user the model was not trained on, keeping the movie factors fixed.
+        """
+        positions, known = self.movie_positions(movie_ids)
+        columns = self.item_factors[positions[known]].astype(np.float64)
+        residuals = np.asarray(ratings, dtype=np.float64)[known] - self.global_mean
+        if not len(residuals):
+            return np.zeros(self.item_factors.shape[1])
+        identity = np.eye(columns.shape[1])
+        return np.linalg.solve(columns.T @ columns + self.regularization * len(residuals) * identity,
+                               columns.T @ residuals)
+
+    def user_vector(self, user_id, movie_ids, ratings):
+        """
+        Return the user's trained factor vector, or fold the user in from their ratings.
+        """
+        position = np.searchsorted(self.user_ids, user_id)
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return self.user_factors[position]
+        return self.fold_in(movie_ids, ratings)
+
+    def predict(self, user_vector, exclude=(), top_n=None, candidates=None):
+        """
+        Score every movie, or only the candidate movies, for a user factor vector.
+
+        Arguments:
+        - user_vector: The user's factors, from user_vector().
+        - exclude: Ids of movies never to recommend, e.g. those already rated or skipped.
+        - top_n: Number of predictions to keep, best first.
+        - candidates: If given, only these movie ids are scored, e.g. the movies of one genre.
+
+        Returns:
+        - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+        """
+        if candidates is None:
+            columns = np.arange(len(self.movie_ids))
+            scores = self.item_factors @ user_vector.astype(np.float32) + self.global_mean
+        else:
+            positions, known = self.movie_positions(candidates)
+            columns = np.unique(positions[known])
+            scores = self.item_factors[columns] @ user_vector.astype(np.float32) + self.global_mean
+        positions, known = self.movie_positions(list(exclude))
+        keep = ~np.isin(columns, positions[known])
+        columns, scores = columns[keep], scores[keep]
+
+        best = select_top_n(scores, top_n)
+        return pd.DataFrame({'movie_id': self.movie_ids[columns[best]],
+                             'predicted_rating': scores[best].astype(np.float64)})
+
+
+def get_factor_model():
+    """
+    Return the current factor model, memory-mapped once per process and version.
+    A retrained model takes effect on the next call. Returns None if no model
+    has been trained yet.
+    """
+    return load_current(get_factor_model_dir(), FactorModel.load)
@@ -0,0 +1,124 @@
+import re
+import uuid
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+"""
+Per-genre candidate lists for the Recommender app.
+The movie ids of every genre are grouped in one pass over the Movie table and
+cached as packed int64 arrays, one cache entry per genre, so a genre-filtered
+request reads only its own genre's list and the engines score only those
+movies. The entries of one build share a version token; writes to the Movie
+table drop the token and the entries it names, and the next reader builds the
+lists again. Every process must see those writes, so RECOMMENDER_GENRE_CACHE
+has to be shared (Redis or the database cache; Recommender.checks warns
+otherwise). Entries also expire after RECOMMENDER_GENRE_TIMEOUT seconds, so
+lists left behind by a build that raced an invalidation do not live forever.
+"""
+
+GENRE_VERSION_KEY = 'genre-index-version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECOMMENDER_GENRE_CACHE', 'default')]
+
+
+def split_genres(genres):
+    # Genres are stored as one name or a list such as MovieLens' 'Action|Comedy'
+    return [genre.strip().lower() for genre in re.split(r'[|,/]', genres) if genre.strip()]
+
+
+def genre_key(version, genre):
+    return f'genre-movies:{version}:{genre}'
+
+
+def genres_key(version):
+    return f'genre-names:{version}'
+
+
+def get_timeout():
+    return getattr(settings, 'RECOMMENDER_GENRE_TIMEOUT', 60 * 60 * 24)
+
+
+def delete_genre_lists(cache, version):
+    """
+    Delete the cached lists of one version of the index.
+    """
+    names = cache.get(genres_key(version)) or []
+    cache.delete_many([genre_key(version, genre) for genre in names] + [genres_key(version)])
+
+
+def build_genre_index():
+    """
+    Group the ids of all movies by genre and cache the lists under a new version.
+
+    Returns:
+    - (version, {genre: sorted int64 array of movie ids}).
+    """
+    from .models import Movie
+
+    grouped = {}
+    for movie_id, genres in Movie.objects.exclude(genre=None).order_by('id').values_list('id', 'genre').iterator():
+        for genre in split_genres(genres):
+            grouped.setdefault(genre, []).append(movie_id)
+    index = {genre: np.array(movie_ids, dtype=np.int64) for genre, movie_ids in grouped.items()}
+
+    cache = get_cache()
+    previous = cache.get(GENRE_VERSION_KEY)
+    version = uuid.uuid4().hex
+    entries = {genre_key(version, genre): movie_ids.tobytes() for genre, movie_ids in index.items()}
+    entries[genres_key(version)] = sorted(index)
+    cache.set_many(entries, get_timeout())
+    cache.set(GENRE_VERSION_KEY, version, get_timeout())
+    if previous is not None and previous != version:
+        # Replaced by a concurrent rebuild; nothing reads the previous version anymore
+        delete_genre_lists(cache, previous)
+    return version, index
+
+
+def get_genre_movie_ids(genre):
+    """
+    Return the sorted ids of the movies of a genre (case-insensitive), empty for an unknown genre.
+    """
+    names = split_genres(genre)
+    if not names:
+        return np.zeros(0, dtype=np.int64)
+    genre = names[0]
+
+    cache = get_cache()
+    version = cache.get(GENRE_VERSION_KEY)
+    if version is not None:
+        entries = cache.get_many([genre_key(version, genre), genres_key(version)])
+        if genre_key(version, genre) in entries:
+            return np.frombuffer(entries[genre_key(version, genre)], dtype=np.int64)
+        if genres_key(version) in entries and genre not in entries[genres_key(version)]:
+            return np.zeros(0, dtype=np.int64)
+
+    # Not built yet, invalidated or evicted
+    _, index = build_genre_index()
+    return index.get(genre, np.zeros(0, dtype=np.int64))
+
+
+def get_genres():
+    """
+    Return the names of all genres, sorted.
+    """
+    cache = get_cache()
+    version = cache.get(GENRE_VERSION_KEY)
+    names = cache.get(genres_key(version)) if version is not None else None
+    if names is None:
+        _, index = build_genre_index()
+        names = sorted(index)
+    return names
+
+
+def invalidate_genre_index():
+    """
+    Drop the current lists so the next reader builds them again.
+    """
+    cache = get_cache()
+    version = cache.get(GENRE_VERSION_KEY)
+    cache.delete(GENRE_VERSION_KEY)
+    if version is not None:
+        delete_genre_lists(cache, version)
@@ -0,0 +1,97 @@
+from django.core import signing
+from django.db.models import Subquery, Value
+from django.db.models.functions import Coalesce
+from .models import Rating
+
+"""
+Rating history cursor for the back/next navigation of the Recommender app.
+Each step is a single query over the (user, id) index of Rating, with the
+movie fetched through select_related unless the caller reads it from the
+payload cache instead. Responses carry an opaque cursor
+token naming the rating that was returned, so the following step does not
+need to look the current rating up again.
+"""
+
+CURSOR_SALT = 'Recommender.history'
+
+# Anchor used when the current movie was never rated: everything is "before" it
+END_OF_HISTORY = 2 ** 63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(rating):
+    """
+    Return the opaque cursor token for a rating in the user's history.
+    The token is the same on every call, so ETags derived from it can match.
+    """
+    return signing.Signer(salt=CURSOR_SALT).sign_object(rating.id, compress=True)
+
+
+def decode_cursor(token):
+    try:
+        return int(signing.Signer(salt=CURSOR_SALT).unsign_object(token))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+def history_anchor(user, cursor=None, movie_id=None, default=None):
+    """
+    Return the rating id to navigate from: the cursor's rating when a token is
+    given, otherwise a subquery resolving the user's rating of movie_id in the same query.
+    """
+    if cursor:
+        return decode_cursor(cursor)
+    current = Rating.objects.filter(user=user, movie_id=movie_id).values('id')[:1]
+    if default is None:
+        return Subquery(current)
+    return Coalesce(Subquery(current), Value(default))
+
+
+def with_movie_or_ids(ratings, with_movie):
+    # Without the movie only the indexed columns are read, never the movie's overview
+    return ratings.select_related('movie') if with_movie else ratings.only('id', 'movie_id')
+
+
+def previous_ratings(user, cursor=None, movie_id=None, with_movie=True):
+    anchor = history_anchor(user, cursor, movie_id, default=END_OF_HISTORY)
+    return with_movie_or_ids(Rating.objects.filter(user=user, id__lt=anchor), with_movie).order_by('-id')
+
+
+def next_ratings(user, cursor=None, movie_id=None, with_movie=True):
+    anchor = history_anchor(user, cursor, movie_id)
+    return with_movie_or_ids(Rating.objects.filter(user=user, id__gt=anchor), with_movie).order_by('id')
+
+
+def previous_rating(user, cursor=None, movie_id=None):
+    """
+    Return the rating the user made before the current one, with its movie loaded.
+    When the current movie has not been rated, the user's latest rating is returned.
+    """
+    return previous_ratings(user, cursor, movie_id).first()
+
+
+def next_rating(user, cursor=None, movie_id=None):
+    """
+    Return the rating the user made after the current one, with its movie loaded,
+    or None at the end of the history or when the current movie has not been rated.
+    """
+    return next_ratings(user, cursor, movie_id).first()
+
+
+async def aprevious_rating(user, cursor=None, movie_id=None, with_movie=True):
+    """
+    Async version of previous_rating, for the async views.
+    With with_movie=False only the rating's id and movie_id are loaded.
+    """
+    return await previous_ratings(user, cursor, movie_id, with_movie).afirst()
+
+
+async def anext_rating(user, cursor=None, movie_id=None, with_movie=True):
+    """
+    Async version of next_rating, for the async views.
+    With with_movie=False only the rating's id and movie_id are loaded.
+    """
+    return await next_ratings(user, cursor, movie_id, with_movie).afirst()
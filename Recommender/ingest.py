@@ -0,0 +1,230 @@
+import csv
+import hashlib
+import json
+from django.conf import settings
+from django.db import transaction
+from .models import Movie, Rating
+from . import similarity
+from .genres import invalidate_genre_index
+from .payloads import invalidate_movie_payloads
+from .routers import note_rating_writes
+
+"""
+Bulk rating and catalog ingestion for the Recommender app.
+Batches of ratings are written with a single INSERT ... ON CONFLICT DO UPDATE
+per chunk instead of a get-then-save pair of queries per rating. Used by the
+rate_movies view for offline clients and by `manage.py import_ratings` for
+backfills from MovieLens-style CSV files.
+
+Movies are upserted the same way on their external_id by `manage.py import_movies`,
+skipping rows whose content hash has not changed since the previous import.
+"""
+
+# Columns overwritten when a user rates a movie they already have a rating for
+UPDATE_FIELDS = ['rating', 'is_skipped', 'updated_at']
+
+# Catalog columns imported for each movie, in content hash order
+MOVIE_FIELDS = ['title', 'overview', 'genre', 'poster_url']
+
+# Accepted spellings of the catalog columns, e.g. the MovieLens movies.csv header
+MOVIE_COLUMN_ALIASES = {
+    'external_id': ('external_id', 'movieId', 'id'),
+    'title': ('title',),
+    'overview': ('overview', 'description'),
+    'genre': ('genre', 'genres'),
+    'poster_url': ('poster_url', 'poster'),
+}
+
+
+class InvalidRating(ValueError):
+    pass
+
+
+class InvalidMovie(ValueError):
+    pass
+
+
+def parse_ratings(body):
+    """
+    Parse a request body holding either a JSON array of ratings or one JSON object per line (JSONL).
+
+    Returns:
+    - list of dicts.
+    """
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    try:
+        rows = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as error:
+            raise InvalidRating(f'Invalid JSON on line {error.lineno}: {error.msg}')
+    if isinstance(rows, dict):
+        rows = [rows]
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise InvalidRating('Expected a JSON array of rating objects or JSON lines')
+    return rows
+
+
+def clean_rating(value):
+    """
+    Convert a submitted rating to the stored integer scale of 1 to 5.
+    Half stars, as in MovieLens, are rounded up; None stays None.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        rating = float(value)
+    except (TypeError, ValueError):
+        raise InvalidRating(f'Invalid rating: {value!r}')
+    if not 0.5 <= rating <= 5:
+        raise InvalidRating(f'Rating out of range: {value!r}')
+    return int(rating + 0.5)
+
+
+def upsert_ratings(ratings, batch_size=5000, update_similarities=True):
+    """
+    Insert or update ratings in bulk inside one transaction.
+
+    Arguments:
+    - ratings: Iterable of (user_id, movie_id, rating, is_skipped) tuples. When a
+      (user, movie) pair appears more than once, the last one wins.
+    - batch_size: Number of rows per INSERT statement.
+    - update_similarities: Apply each change to the similarity store when
+      RECOMMENDER_SIMILARITY_STORE is enabled. Large imports should pass False
+      and rebuild the store once afterwards.
+
+    Returns:
+    - Number of ratings written.
+    """
+    latest = {(user_id, movie_id): (rating, is_skipped) for user_id, movie_id, rating, is_skipped in ratings}
+    if not latest:
+        return 0
+    objects = [Rating(user_id=user_id, movie_id=movie_id, rating=rating, is_skipped=is_skipped)
+               for (user_id, movie_id), (rating, is_skipped) in latest.items()]
+
+    track_similarities = update_similarities and getattr(settings, 'RECOMMENDER_SIMILARITY_STORE', False)
+    with transaction.atomic():
+        if track_similarities:
+            previous = current_values(latest)
+
+        Rating.objects.bulk_create(objects, batch_size=batch_size, update_conflicts=True,
+                                   unique_fields=['user', 'movie'], update_fields=UPDATE_FIELDS)
+
+        if track_similarities:
+            for (user_id, movie_id), (rating, is_skipped) in latest.items():
+                new_rating = 0 if is_skipped or rating is None else rating
+                similarity.apply_rating_change(user_id, movie_id, previous.get((user_id, movie_id), 0), new_rating)
+
+    note_rating_writes(user_id for user_id, _ in latest)
+    return len(objects)
+
+
+def current_values(pairs):
+    """
+    Return {(user_id, movie_id): rating} of the rating matrix cells that are currently set.
+    """
+    user_ids = {user_id for user_id, _ in pairs}
+    movie_ids = {movie_id for _, movie_id in pairs}
+    rows = Rating.objects.filter(user_id__in=user_ids, movie_id__in=movie_ids, is_skipped=False,
+                                 rating__isnull=False).values_list('user_id', 'movie_id', 'rating')
+    return {(user_id, movie_id): rating for user_id, movie_id, rating in rows if (user_id, movie_id) in pairs}
+
+
+def read_ratings_csv(file, chunk_size=50000):
+    """
+    Stream a MovieLens-format ratings CSV (userId,movieId,rating[,timestamp]).
+    Only one chunk of parsed rows is held in memory at a time.
+
+    Yields:
+    - Lists of (user_id, movie_id, rating) tuples.
+    """
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip() for column in header]
+    try:
+        user_column, movie_column, rating_column = (columns.index(name) for name in ('userId', 'movieId', 'rating'))
+    except ValueError:
+        raise InvalidRating('The CSV header must contain userId, movieId and rating columns')
+
+    chunk = []
+    for line_number, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        try:
+            chunk.append((int(row[user_column]), int(row[movie_column]), clean_rating(row[rating_column])))
+        except (IndexError, ValueError) as error:
+            raise InvalidRating(f'Line {line_number}: {error}')
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_movies(file, file_format='csv', chunk_size=10000):
+    """
+    Stream catalog rows from a CSV file with a header, or from JSON lines.
+    Only one chunk of rows is held in memory at a time.
+
+    Yields:
+    - Lists of dicts with an 'external_id' and the MOVIE_FIELDS, truncated to
+      the model's column lengths. Missing fields are None.
+    """
+    rows = csv.DictReader(file) if file_format == 'csv' else (json.loads(line) for line in file if line.strip())
+    max_lengths = {field: Movie._meta.get_field(field).max_length for field in MOVIE_COLUMN_ALIASES}
+
+    chunk = []
+    for position, row in enumerate(rows, start=1):
+        movie = {}
+        for field, aliases in MOVIE_COLUMN_ALIASES.items():
+            value = next((row[alias] for alias in aliases if row.get(alias) not in (None, '')), None)
+            movie[field] = None if value is None else str(value).strip()[:max_lengths[field]]
+        if not movie['external_id'] or not movie['title']:
+            raise InvalidMovie(f'Row {position}: an id and a title are required')
+        chunk.append(movie)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def movie_content_hash(movie):
+    """
+    Return a digest of a movie's imported fields, stored to detect unchanged rows on re-import.
+    """
+    content = '\x1f'.join(movie[field] or '' for field in MOVIE_FIELDS)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def upsert_movies(movies, batch_size=2000):
+    """
+    Insert new movies and update changed ones by external_id, in one transaction.
+    Rows whose content hash matches the stored one are not written.
+
+    Returns:
+    - (created, updated, unchanged) counts.
+    """
+    latest = {movie['external_id']: movie for movie in movies}
+    hashes = {external_id: movie_content_hash(movie) for external_id, movie in latest.items()}
+    stored = {external_id: (movie_id, content_hash) for external_id, movie_id, content_hash in
+              Movie.objects.filter(external_id__in=list(latest)).values_list('external_id', 'id', 'content_hash')}
+
+    changed = [Movie(external_id=external_id, content_hash=hashes[external_id],
+                     **{field: movie[field] for field in MOVIE_FIELDS})
+               for external_id, movie in latest.items() if stored.get(external_id, (None, ''))[1] != hashes[external_id]]
+    with transaction.atomic():
+        Movie.objects.bulk_create(changed, batch_size=batch_size, update_conflicts=True,
+                                  unique_fields=['external_id'], update_fields=MOVIE_FIELDS + ['content_hash'])
+
+    updated = [stored[movie.external_id][0] for movie in changed if movie.external_id in stored]
+    if changed:
+        # bulk_create sends no save signals, so the genre lists and the cached JSON of updated movies are dropped here
+        invalidate_genre_index()
+    if updated:
+        invalidate_movie_payloads(updated)
+
+    return len(changed) - len(updated), len(updated), len(latest) - len(changed)
@@ -0,0 +1,170 @@
+import os
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from sklearn.preprocessing import normalize
+from .sparse import select_top_n
+from .artifacts import load_current
+
+"""
+Precomputed item-item similarity index for the Recommender app.
+`manage.py build_item_index` computes the top-K cosine neighbours of every
+movie offline and publishes them as a new version of .npy arrays. The web
+process memory-maps the current version and scores a user from those arrays
+with a few array lookups and no per-request matrix math.
+"""
+
+MOVIE_IDS_FILE = 'movie_ids.npy'
+NEIGHBOURS_FILE = 'neighbours.npy'
+SIMILARITIES_FILE = 'similarities.npy'
+
+
+def get_item_index_dir():
+    return getattr(settings, 'RECOMMENDER_ITEM_INDEX_DIR',
+                   os.path.join(settings.BASE_DIR, 'artifacts', 'item_index'))
+
+
+def top_k_neighbours(vectors, k, chunk_size=1024):
+    """
+    Find the top-k cosine neighbours of every row of a sparse matrix.
+    Similarities are computed a block of rows at a time so that only
+    chunk_size rows of the rows x rows similarity matrix exist at once.
+
+    Returns:
+    - (neighbours, similarities) arrays as stored by ItemIndex.
+    """
+    vectors = normalize(vectors, norm='l2', axis=1)
+    n_rows = vectors.shape[0]
+    k = min(k, max(n_rows - 1, 0))
+
+    neighbours = np.full((n_rows, k), -1, dtype=np.int32)
+    similarities = np.zeros((n_rows, k), dtype=np.float32)
+
+    for start in range(0, n_rows, chunk_size):
+        block = (vectors[start:start + chunk_size] @ vectors.T).toarray()
+        # A row is never its own neighbour
+        block[np.arange(block.shape[0]), np.arange(start, start + block.shape[0])] = 0
+        for offset, row in enumerate(block):
+            best = select_top_n(row, k)
+            best = best[row[best] > 0]
+            neighbours[start + offset, :len(best)] = best
+            similarities[start + offset, :len(best)] = row[best]
+
+    return neighbours, similarities
+
+
+class ItemIndex:
+    """
+    Top-K neighbours of every movie.
+
+    - movie_ids: (movies,) sorted movie ids; row i of the other arrays belongs to movie_ids[i].
+    - neighbours: (movies, K) int32 row positions of each movie's neighbours, -1 for padding.
+    - similarities: (movies, K) float32 cosine similarity to each neighbour, 0 for padding.
+    """
+
+    def __init__(self, movie_ids, neighbours, similarities):
+        self.movie_ids = movie_ids
+        self.neighbours = neighbours
+        self.similarities = similarities
+
+    @classmethod
+    def build(cls, matrix, k, chunk_size=1024):
+        """
+        Compute the index from a UserItemMatrix.
+
+        Arguments:
+        - matrix: The UserItemMatrix to build from.
+        - k: Number of neighbours to keep per movie.
+        - chunk_size: Number of movies whose similarities are computed together.
+        """
+        neighbours, similarities = top_k_neighbours(matrix.matrix.T.tocsr(), k, chunk_size)
+        return cls(matrix.movie_ids.astype(np.int64), neighbours, similarities)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, MOVIE_IDS_FILE), self.movie_ids)
+        np.save(os.path.join(directory, NEIGHBOURS_FILE), self.neighbours)
+        np.save(os.path.join(directory, SIMILARITIES_FILE), self.similarities)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        return cls(np.load(os.path.join(directory, MOVIE_IDS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, NEIGHBOURS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(directory, SIMILARITIES_FILE), mmap_mode=mmap_mode))
+
+    def movie_positions(self, movie_ids):
+        """
+        Return the index rows of the given movies and a mask of which ones the index knows.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        known = positions < len(self.movie_ids)
+        known[known] = self.movie_ids[positions[known]] == movie_ids[known]
+        return positions, known
+
+    def candidate_columns(self, reached, rated, candidates=None):
+        """
+        Return the rows of the movies reached through a neighbour that were not rated,
+        restricted to the candidate movie ids if given.
+        """
+        if candidates is not None:
+            positions, known = self.movie_positions(candidates)
+            columns = np.unique(positions[known])
+            columns = columns[reached[columns]]
+        else:
+            columns = np.flatnonzero(reached)
+        return np.setdiff1d(columns, rated)
+
+    def predict(self, movie_ids, ratings, top_n=None, candidates=None):
+        """
+        Score a user from their ratings using only the stored neighbour lists.
+        Each rated movie passes its rating, weighted by similarity, to its
+        neighbours; a candidate's prediction is the weighted mean of what it received.
+
+        Arguments:
+        - movie_ids: Ids of the movies the user rated.
+        - ratings: The user's ratings of those movies.
+        - top_n: Number of predictions to keep, best first.
+        - candidates: If given, only these movie ids are scored, e.g. the movies of one genre.
+
+        Returns:
+        - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+        """
+        positions, weighted_sums, weight_totals = self.neighbour_sums(movie_ids, ratings)
+
+        # Candidates are movies reached through a neighbour that the user has not rated yet
+        columns = self.candidate_columns(weight_totals > 0, positions, candidates)
+        scores = weighted_sums[columns] / weight_totals[columns]
+
+        best = select_top_n(scores, top_n)
+        return pd.DataFrame({'movie_id': self.movie_ids[columns[best]], 'predicted_rating': scores[best]})
+
+    def neighbour_sums(self, movie_ids, ratings):
+        """
+        Pass each rated movie's rating, weighted by similarity, to its neighbours.
+
+        Returns:
+        - The index positions of the rated movies the index knows, and per movie
+          the similarity-weighted sum of the ratings it received and the sum of the weights.
+        """
+        positions, known = self.movie_positions(movie_ids)
+        positions, ratings = positions[known], np.asarray(ratings, dtype=np.float64)[known]
+
+        neighbours = self.neighbours[positions].ravel()
+        weights = self.similarities[positions].astype(np.float64).ravel()
+        values = np.repeat(ratings, self.neighbours.shape[1])
+        valid = neighbours >= 0
+        neighbours, weights, values = neighbours[valid], weights[valid], values[valid]
+
+        weighted_sums = np.bincount(neighbours, weights=weights * values, minlength=len(self.movie_ids))
+        weight_totals = np.bincount(neighbours, weights=weights, minlength=len(self.movie_ids))
+        return positions, weighted_sums, weight_totals
+
+
+def get_item_index():
+    """
+    Return the current item index, memory-mapped once per process and version.
+    A rebuilt index takes effect on the next call. Returns None if no index
+    has been built yet.
+    """
+    return load_current(get_item_index_dir(), ItemIndex.load)
@@ -1,14 +1,84 @@
-from django.core.management.base import BaseCommand
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+# Personal fields of User overwritten for every user
+SCRUBBED_FIELDS = ['username', 'email', 'first_name', 'last_name', 'password', 'last_login']
+# Prefix of the anonymized usernames, e.g. user_42
+USERNAME_PREFIX = 'user_'
+# Prefix of the interim usernames; '#' is not allowed in registered usernames, so they never collide
+INTERIM_PREFIX = '#'
+
 
 class Command(BaseCommand):
     help = 'Anonymizes the database for public use'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of users updated per transaction')
+        parser.add_argument('--password', default='defaultPassword123!',
+                            help='Password every anonymized user can log in with')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be changed without writing')
+
     def handle(self, *args, **options):
-        # Anonymize user data
-        for user in User.objects.all():
-            user.email = f"user_{user.id}@example.com"
-            user.set_password("defaultPassword123!")
-            user.save()
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        dry_run = options['dry_run']
+        total = User.objects.count()
+        prefix = 'Would anonymize' if dry_run else 'Anonymized'
+
+        # Users already named like another user's anonymized name are moved out of the way first
+        named_like_anonymized = User.objects.filter(username__regex=rf'^{USERNAME_PREFIX}[0-9]+$')
+        taken = [User(id=user_id, username=f'{INTERIM_PREFIX}{user_id}')
+                 for user_id, username in named_like_anonymized.values_list('id', 'username').iterator()
+                 if username != f'{USERNAME_PREFIX}{user_id}']
+        if taken:
+            if not dry_run:
+                with transaction.atomic():
+                    User.objects.bulk_update(taken, ['username'], batch_size=batch_size)
+            self.stdout.write(f'{"Would rename" if dry_run else "Renamed"} {len(taken)} users whose username '
+                              f'another user is anonymized to')
+
+        # One PBKDF2 hash shared by every user, instead of one per user
+        password = make_password(options['password'])
+        done = 0
+        batch = []
+        for user in User.objects.only('id').order_by('id').iterator(chunk_size=batch_size):
+            user.username = f'{USERNAME_PREFIX}{user.id}'
+            user.email = f'user_{user.id}@example.com'
+            user.first_name = user.last_name = ''
+            user.password = password
+            user.last_login = None
+            batch.append(user)
+            if len(batch) == batch_size:
+                done += self.write_batch(batch, dry_run)
+                self.stdout.write(f'{prefix} {done} of {total} users')
+                batch = []
+        if batch:
+            done += self.write_batch(batch, dry_run)
+            self.stdout.write(f'{prefix} {done} of {total} users')
+
+        # Sessions and admin history hold user data outside the User table
+        for app_label, model_name in (('sessions', 'Session'), ('admin', 'LogEntry')):
+            if apps.is_installed(f'django.contrib.{app_label}'):
+                queryset = apps.get_model(app_label, model_name).objects.all()
+                if dry_run:
+                    self.stdout.write(f'Would delete {queryset.count()} {model_name} rows')
+                else:
+                    deleted, _ = queryset.delete()
+                    self.stdout.write(f'Deleted {deleted} {model_name} rows')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was written'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Successfully anonymized the database'))
 
-        self.stdout.write(self.style.SUCCESS('Successfully anonymized the database'))
+    @staticmethod
+    def write_batch(users, dry_run):
+        if not dry_run:
+            with transaction.atomic():
+                User.objects.bulk_update(users, SCRUBBED_FIELDS)
+        return len(users)
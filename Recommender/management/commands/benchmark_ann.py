@@ -0,0 +1,69 @@
+import json
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from Recommender.sparse import UserItemMatrix, select_top_n
+from Recommender.ann import UserLSHIndex
+from Recommender.benchmarks import synthetic_ratings
+
+
+class Command(BaseCommand):
+    help = 'Compares recall and latency of the approximate similar-user lookup against the exact path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--movies', type=int, default=2000)
+        parser.add_argument('--density', type=float, default=0.01, help='Fraction of user-movie pairs rated')
+        parser.add_argument('--k', type=int, default=50, help='Number of similar users to find')
+        parser.add_argument('--tables', type=int, default=16)
+        parser.add_argument('--bits', type=int, default=8)
+        parser.add_argument('--probes', type=int, default=2, help='Extra buckets visited per table')
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        matrix = UserItemMatrix.from_arrays(*synthetic_ratings(options['users'], options['movies'],
+                                                               options['density'], options['seed']))
+
+        started = time.perf_counter()
+        index = UserLSHIndex(matrix, n_tables=options['tables'], n_bits=options['bits'], seed=options['seed'])
+        build_seconds = time.perf_counter() - started
+
+        rng = np.random.default_rng(options['seed'])
+        queries = rng.choice(len(matrix.user_ids), size=min(options['queries'], len(matrix.user_ids)), replace=False)
+        k = options['k']
+        exact_times, ann_times, recalls = [], [], []
+
+        for row in queries:
+            user_id = matrix.user_ids[row]
+
+            started = time.perf_counter()
+            similarities = matrix.similarity_row(user_id)
+            similarities[row] = 0
+            best = select_top_n(similarities, k)
+            exact = set(matrix.user_ids[best[similarities[best] > 0]])
+            exact_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            found, _ = index.query(matrix.matrix[row], k, exclude=user_id, probes=options['probes'])
+            ann_times.append(time.perf_counter() - started)
+
+            if exact:
+                recalls.append(len(exact.intersection(found)) / len(exact))
+
+        self.stdout.write(json.dumps({
+            'users': options['users'],
+            'movies': options['movies'],
+            'ratings': int(matrix.matrix.nnz),
+            'k': k,
+            'tables': options['tables'],
+            'bits': options['bits'],
+            'probes': options['probes'],
+            'index_build_seconds': round(build_seconds, 4),
+            'recall_at_k': round(float(np.mean(recalls)), 4) if recalls else None,
+            'exact_ms_p50': round(float(np.percentile(exact_times, 50)) * 1000, 3),
+            'exact_ms_p99': round(float(np.percentile(exact_times, 99)) * 1000, 3),
+            'ann_ms_p50': round(float(np.percentile(ann_times, 50)) * 1000, 3),
+            'ann_ms_p99': round(float(np.percentile(ann_times, 99)) * 1000, 3),
+        }, indent=2))
+
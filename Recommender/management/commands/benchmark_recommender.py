@@ -0,0 +1,45 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from Recommender.benchmarks import PRESETS, populate, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the recommendation hot paths on a seeded synthetic dataset in a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', choices=sorted(PRESETS), default='small',
+                            help='Dataset size; --users, --movies and --density override it')
+        parser.add_argument('--users', type=int, default=None)
+        parser.add_argument('--movies', type=int, default=None)
+        parser.add_argument('--density', type=float, default=None, help='Fraction of user-movie pairs rated')
+        parser.add_argument('--samples', type=int, default=20, help='Number of users measured per path')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        dataset = dict(PRESETS[options['preset']])
+        for option in ('users', 'movies', 'density'):
+            if options[option] is not None:
+                dataset[option] = options[option]
+        if options['samples'] < 1:
+            raise CommandError('--samples must be at least 1')
+
+        # The benchmark never touches the configured database; it runs in a fresh test database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            report = {
+                'preset': options['preset'],
+                'vendor': connection.vendor,
+                'dataset': populate(dataset['users'], dataset['movies'], dataset['density'], options['seed']),
+                'paths': run_benchmarks(options['samples'], options['seed']),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
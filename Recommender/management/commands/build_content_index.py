@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Recommender.artifacts import publish
+from django.db.models import Count
+from Recommender.models import Movie, Rating
+from Recommender.content_index import ContentIndex, get_content_index_dir
+
+
+class Command(BaseCommand):
+    help = 'Builds the content-similarity index of movie overviews and genres used for sparse users and movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbours', type=int, default=getattr(settings, 'RECOMMENDER_CONTENT_NEIGHBOURS', 50),
+                            help='Number of neighbours to keep per movie')
+        parser.add_argument('--genre-weight', type=float, default=0.5,
+                            help='Weight of the genres relative to the overview')
+        parser.add_argument('--output', default=None, help='Directory to publish the index in')
+
+    def handle(self, *args, **options):
+        movies = list(Movie.objects.values_list('id', 'overview', 'genre').iterator())
+        rating_counts = dict(Rating.objects.filter(is_skipped=False, rating__isnull=False)
+                             .values_list('movie_id').annotate(count=Count('id')).values_list('movie_id', 'count'))
+
+        index = ContentIndex.build(movies, rating_counts, options['neighbours'], options['genre_weight'])
+        output = options['output'] or get_content_index_dir()
+        path = publish(output, index.save)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully built the content index for {len(index.movie_ids)} movies in {path}'))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Recommender.artifacts import publish
+from Recommender.snapshot import RatingsSnapshot
+from Recommender.item_index import ItemIndex, get_item_index_dir
+
+
+class Command(BaseCommand):
+    help = 'Builds the item-item similarity index used by the item-based recommendation mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbours', type=int, default=getattr(settings, 'RECOMMENDER_ITEM_NEIGHBOURS', 50),
+                            help='Number of neighbours to keep per movie')
+        parser.add_argument('--output', default=None, help='Directory to publish the index in')
+
+    def handle(self, *args, **options):
+        matrix = RatingsSnapshot.from_database(active_only=True).matrix()
+
+        index = ItemIndex.build(matrix, options['neighbours'])
+        output = options['output'] or get_item_index_dir()
+        path = publish(output, index.save)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully built the item index for {len(index.movie_ids)} movies in {path}'))
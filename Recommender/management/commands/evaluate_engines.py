@@ -0,0 +1,35 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from Recommender.evaluation import run_evaluation
+
+
+class Command(BaseCommand):
+    help = 'Compares the recommendation engines on a time-based holdout of the ratings: quality against latency and memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engines', nargs='+', default=None,
+                            help='Names of the engines to evaluate (default: all registered engines)')
+        parser.add_argument('--test-fraction', type=float, default=0.2, help='Fraction of the newest ratings to hold out')
+        parser.add_argument('--k', type=int, default=10, help='Length of the recommendation list for precision@k and recall@k')
+        parser.add_argument('--users', type=int, default=None, help='Evaluate a sample of at most this many users')
+        parser.add_argument('--threshold', type=float, default=4, help='Minimum held-out rating that counts as relevant')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if not 0 < options['test_fraction'] < 1:
+            raise CommandError('--test-fraction must be between 0 and 1')
+        if options['k'] < 1:
+            raise CommandError('--k must be at least 1')
+
+        try:
+            report = run_evaluation(options['engines'], options['test_fraction'], options['k'],
+                                    options['users'], options['threshold'], options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,43 @@
+import gzip
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from Recommender.ingest import InvalidMovie, read_movies, upsert_movies
+
+
+class Command(BaseCommand):
+    help = 'Streams a movie catalog from CSV or JSON lines into the Movie table, upserting on external_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, optionally gzip-compressed')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help='Input format; guessed from the file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of rows read and committed per transaction')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of rows per INSERT statement')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path = options['path']
+        name = path[:-3] if path.endswith('.gz') else path
+        file_format = options['format'] or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+        opener = gzip.open if path.endswith('.gz') else open
+        created = updated = unchanged = 0
+        try:
+            with opener(path, 'rt', newline='', encoding='utf-8') as file:
+                for chunk in read_movies(file, file_format, options['chunk_size']):
+                    counts = upsert_movies(chunk, options['batch_size'])
+                    created, updated, unchanged = (total + count for total, count in
+                                                   zip((created, updated, unchanged), counts))
+
+                    rows = created + updated + unchanged
+                    self.stdout.write(f'{rows} rows read: {created} created, {updated} updated, '
+                                      f'{unchanged} unchanged, {rows / (time.perf_counter() - started):.0f} rows/s')
+        except (OSError, InvalidMovie, json.JSONDecodeError) as error:
+            raise CommandError(f'{error} ({created + updated} movies were written before the error)')
+
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported {created + updated + unchanged} movies ({created} created, {updated} updated, '
+            f'{unchanged} unchanged) in {time.perf_counter() - started:.1f}s'))
@@ -0,0 +1,57 @@
+import gzip
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from Recommender.models import Movie
+from Recommender.ingest import InvalidRating, read_ratings_csv, upsert_ratings
+from Recommender.popularity import invalidate_popular_movies
+from Recommender import similarity
+
+
+class Command(BaseCommand):
+    help = 'Streams a MovieLens-format ratings CSV (userId,movieId,rating) into the Rating table in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to import, optionally gzip-compressed')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Number of rows read and committed per transaction')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows per INSERT statement')
+        parser.add_argument('--movie-pk', action='store_true',
+                            help='movieId is the Movie primary key, not the external_id written by import_movies')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # userId is a primary key and movieId the external_id of import_movies (or a primary key
+        # with --movie-pk); rows naming unknown users or movies are skipped
+        user_ids = set(User.objects.values_list('id', flat=True).iterator())
+        if options['movie_pk']:
+            movie_ids = {movie_id: movie_id for movie_id in Movie.objects.values_list('id', flat=True).iterator()}
+        else:
+            movie_ids = {int(external_id): movie_id for external_id, movie_id in
+                         Movie.objects.exclude(external_id=None).values_list('external_id', 'id').iterator()
+                         if external_id.isdigit()}
+
+        opener = gzip.open if options['path'].endswith('.gz') else open
+        written = skipped = 0
+        try:
+            with opener(options['path'], 'rt', newline='') as file:
+                for chunk in read_ratings_csv(file, options['chunk_size']):
+                    known = [(user_id, movie_ids[movie_id], rating, rating is None)
+                             for user_id, movie_id, rating in chunk if user_id in user_ids and movie_id in movie_ids]
+                    skipped += len(chunk) - len(known)
+                    written += upsert_ratings(known, options['batch_size'], update_similarities=False)
+
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f'{written + skipped} rows read: {written} ratings written, {skipped} skipped, '
+                                      f'{(written + skipped) / elapsed:.0f} rows/s')
+        except (OSError, InvalidRating) as error:
+            raise CommandError(f'{error} ({written} ratings were written before the error)')
+
+        invalidate_popular_movies()
+        if getattr(settings, 'RECOMMENDER_SIMILARITY_STORE', False):
+            self.stdout.write('Rebuilding the similarity store')
+            similarity.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully imported {written} ratings ({skipped} skipped) in {time.perf_counter() - started:.1f}s'))
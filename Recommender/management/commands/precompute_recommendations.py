@@ -0,0 +1,38 @@
+import os
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from Recommender.precompute import precompute, get_checkpoint_path
+
+
+class Command(BaseCommand):
+    help = 'Precomputes recommendations for every user in sharded worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=64, help='Number of shards to split the users into')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--top-n', type=int, default=getattr(settings, 'RECOMMENDER_TOP_N', 10))
+        parser.add_argument('--checkpoint', default=None, help='File recording finished shards')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue the interrupted run recorded in the checkpoint, skipping its finished shards')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        user_ids = list(User.objects.values_list('id', flat=True))
+        shards = max(1, min(options['shards'], len(user_ids)))
+
+        def progress(shard, users, recommendations):
+            self.stdout.write(f'Shard {shard}: {users} users, {recommendations} recommendations')
+
+        try:
+            written = precompute(user_ids, shards, options['workers'], options['top_n'],
+                                 options['checkpoint'] or get_checkpoint_path(), resume=options['resume'],
+                                 progress=progress)
+        except ValueError as error:
+            raise CommandError(error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully precomputed {written} of {shards} shards for {len(user_ids)} users '
+            f'in {time.perf_counter() - started:.1f}s'))
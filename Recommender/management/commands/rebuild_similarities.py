@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from Recommender import similarity
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the incremental user similarity store from the Rating table'
+
+    def handle(self, *args, **options):
+        similarity.rebuild()
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt the similarity store'))
@@ -0,0 +1,51 @@
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from Recommender.worker import ARTIFACTS, RetrainingWorker, published_artifacts
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the scoring artifacts whenever enough ratings have changed or the oldest change has waited too long'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artifacts', nargs='+', choices=sorted(ARTIFACTS),
+                            default=getattr(settings, 'RECOMMENDER_WORKER_ARTIFACTS', None),
+                            help='Artifacts to rebuild (default: those already published)')
+        parser.add_argument('--min-changes', type=int,
+                            default=getattr(settings, 'RECOMMENDER_WORKER_MIN_CHANGES', 1000),
+                            help='Number of changed ratings that triggers a rebuild')
+        parser.add_argument('--max-staleness', type=float,
+                            default=getattr(settings, 'RECOMMENDER_WORKER_MAX_STALENESS', 60 * 60),
+                            help='Seconds the oldest changed rating may wait before it triggers a rebuild')
+        parser.add_argument('--interval', type=float,
+                            default=getattr(settings, 'RECOMMENDER_WORKER_POLL_INTERVAL', 60),
+                            help='Seconds between checks of the Rating table')
+        parser.add_argument('--once', action='store_true', help='Check once, rebuilding if due, then exit')
+
+    def handle(self, *args, **options):
+        artifacts = options['artifacts'] or published_artifacts()
+        if not artifacts:
+            raise CommandError('No artifact has been published yet; choose some with --artifacts')
+        worker = RetrainingWorker(artifacts, options['min_changes'], options['max_staleness'])
+
+        # Stop between checks on SIGTERM (sent by Heroku on restarts) or Ctrl-C
+        stopping = threading.Event()
+        if not options['once']:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *_: stopping.set())
+
+        self.stdout.write(f'Watching ratings to rebuild {", ".join(artifacts)}')
+        while not stopping.is_set():
+            close_old_connections()
+            if worker.check():
+                durations = ', '.join(f'{name} in {seconds:.1f}s'
+                                      for name, seconds in worker.status['build_seconds'].items())
+                self.stdout.write(self.style.SUCCESS(
+                    f'Rebuilt {durations} up to rating {worker.status["last_rating_id"]}'))
+            else:
+                self.stdout.write(f'{worker.status["pending_changes"]} ratings changed since the last rebuild')
+            if options['once']:
+                break
+            stopping.wait(options['interval'])
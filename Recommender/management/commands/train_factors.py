@@ -0,0 +1,36 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from Recommender.artifacts import publish
+from Recommender.snapshot import RatingsSnapshot
+from Recommender.factorization import FactorModel, get_factor_model_dir
+
+
+class Command(BaseCommand):
+    help = 'Trains the matrix-factorization model used by the factors recommendation mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factors', type=int, default=32, help='Number of latent factors')
+        parser.add_argument('--regularization', type=float, default=0.1)
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Directory to publish the model in')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        matrix = RatingsSnapshot.from_database(active_only=True).matrix()
+
+        model = FactorModel.train(matrix, options['factors'], options['regularization'], options['iterations'],
+                                  options['seed'])
+        output = options['output'] or get_factor_model_dir()
+        path = publish(output, model.save)
+
+        # Error on the training ratings, as a sanity check of the fit
+        ratings = matrix.matrix.tocoo()
+        predicted = np.einsum('ij,ij->i', model.user_factors[ratings.row], model.item_factors[ratings.col])
+        rmse = float(np.sqrt(np.mean((predicted + model.global_mean - ratings.data) ** 2))) if ratings.nnz else 0.0
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully trained {options["factors"]} factors for {len(model.user_ids)} users and '
+            f'{len(model.movie_ids)} movies in {time.perf_counter() - started:.1f}s '
+            f'(training RMSE {rmse:.3f}) in {path}'))
@@ -0,0 +1,210 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+"""
+Timing instrumentation for the Recommender app.
+Pipeline stages are timed with the `timed` context manager, and the SQL
+issued by every request is counted and timed by QueryMetricsMiddleware,
+through an execute wrapper that every database connection gets on creation.
+Both are recorded in in-process histograms that the /metrics view renders in
+the Prometheus text format. Each process exposes its own counts, so every
+worker has to be scraped (or the values summed) under a multi-process server.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from sub-millisecond cache hits to full refreshes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with optional labels. Observations are thread-safe.
+    """
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            if position < len(self.buckets):
+                series['counts'][position] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        """
+        Return the histogram in the Prometheus text exposition format.
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, dict(values, counts=list(values['counts'])))
+                            for labels, values in self._series.items())
+        for labels, values in series:
+            pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets, values['counts']):
+                cumulative += count
+                bucket_labels = format_labels(pairs + ['le="%s"' % bound])
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = format_labels(pairs + ['le="+Inf"'])
+            lines.append(f'{self.name}_bucket{bucket_labels} {values["count"]}')
+            suffix = format_labels(pairs) if pairs else ''
+            lines.append(f'{self.name}_sum{suffix} {values["sum"]}')
+            lines.append(f'{self.name}_count{suffix} {values["count"]}')
+        return '\n'.join(lines)
+
+
+def render_gauge(name, documentation, samples, labelnames=()):
+    """
+    Return gauge samples, given as (labels, value) pairs, in the Prometheus text exposition format.
+    """
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        pairs = [f'{label}="{escape_label(label_value)}"' for label, label_value in zip(labelnames, labels)]
+        lines.append(f'{name}{format_labels(pairs) if pairs else ""} {value}')
+    return '\n'.join(lines)
+
+
+def format_labels(pairs):
+    return '{' + ','.join(pairs) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+STAGE_SECONDS = Histogram('recommender_stage_seconds', 'Time spent in each stage of the recommendation pipeline.',
+                          labelnames=('stage',))
+REQUEST_SECONDS = Histogram('recommender_request_seconds', 'Time spent handling each request.',
+                            labelnames=('view',))
+REQUEST_QUERIES = Histogram('recommender_request_queries', 'Number of SQL queries issued by each request.',
+                            buckets=QUERY_COUNT_BUCKETS, labelnames=('view',))
+REQUEST_QUERY_SECONDS = Histogram('recommender_request_query_seconds',
+                                  'Time spent in SQL queries by each request.', labelnames=('view',))
+
+REGISTRY = (STAGE_SECONDS, REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Time the enclosed block as one stage of the recommendation pipeline.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        logger.debug('stage=%s seconds=%.6f', stage, elapsed)
+
+
+def render_metrics():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def reset_metrics():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+class QueryCounter:
+    """
+    Count the queries of one request and the time they take.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# The counter of the request being handled; copied into the threads that run its ORM calls
+_request_queries = ContextVar('recommender_request_queries', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding each query to the current request's counter, if any.
+    """
+    counter = _request_queries.get()
+    if counter is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counter.count += 1
+        counter.seconds += time.perf_counter() - started
+
+
+def install_query_counter(connection):
+    # Inserted first, so the wrappers pushed and popped by connection.execute_wrapper() stay balanced
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
+
+
+class QueryMetricsMiddleware:
+    """
+    Record the duration, SQL query count and SQL time of every request,
+    labelled with the name of the URL pattern that handled it.
+    Works in both the sync (WSGI) and async (ASGI) request paths.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        token, started = _request_queries.set(counter), time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, counter, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token, started = _request_queries.set(counter), time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_queries.reset(token)
+        self.record(request, response, counter, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def record(request, response, counter, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name if match else None) or 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, view)
+        REQUEST_QUERIES.observe(counter.count, view)
+        REQUEST_QUERY_SECONDS.observe(counter.seconds, view)
+        logger.debug('view=%s status=%s seconds=%.6f queries=%d query_seconds=%.6f',
+                     view, response.status_code, elapsed, counter.count, counter.seconds)
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Recommender', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserNorm',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True,
+                                              related_name='rating_norm', serialize=False,
+                                              to=settings.AUTH_USER_MODEL)),
+                ('norm_sq', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserDotProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dot', models.FloatField(default=0)),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                                 to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                           to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'other_user')},
+            },
+        ),
+    ]
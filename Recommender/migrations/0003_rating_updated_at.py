@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recommender', '0002_usernorm_userdotproduct'),
+    ]
+
+    operations = [
+        # Not backfilled: rows written before this migration keep NULL, which the ratings
+        # snapshot and the retraining worker read as "not changed since it was first loaded"
+        migrations.AddField(
+            model_name='rating',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+    ]
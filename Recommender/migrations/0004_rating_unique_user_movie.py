@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def delete_duplicate_ratings(apps, schema_editor):
+    # Earlier versions could store several ratings of one movie by one user; the newest one counts
+    Rating = apps.get_model('Recommender', 'Rating')
+    ratings = Rating.objects.using(schema_editor.connection.alias)
+    newer = ratings.filter(user=OuterRef('user'), movie=OuterRef('movie'), id__gt=OuterRef('id'))
+    ratings.filter(Exists(newer)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recommender', '0003_rating_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='unique_user_movie_rating'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['user', 'id'], name='rating_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Recommender', '0004_rating_unique_user_movie'),
+    ]
+
+    operations = [
+        # The unique index is the conflict target of import_movies' bulk upsert
+        migrations.AddField(
+            model_name='movie',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+    ]
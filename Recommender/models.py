@@ -1,9 +1,12 @@
 from django.db import models
-from sklearn.metrics.pairwise import cosine_similarity
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Count
 import numpy as np
 import pandas as pd
+from .popularity import get_popular_movie_ids, get_popular_movie_ids_among
+from .genres import get_genre_movie_ids
+from .content_index import get_content_index, blend_predictions
+from .metrics import timed
 # Create your models here.
 
 
@@ -13,6 +16,10 @@ class Movie(models.Model):
     overview = models.CharField(max_length=2000, null=True)
     genre = models.CharField(max_length=50, null=True)
     poster_url = models.CharField(max_length=200, null=True)
+    # Natural key of catalog imports (e.g. the MovieLens or TMDB id) and a digest of the imported
+    # fields, so `manage.py import_movies` can upsert and skip unchanged rows
+    external_id = models.CharField(max_length=64, null=True, blank=True, unique=True)
+    content_hash = models.CharField(max_length=32, null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.title
@@ -24,10 +31,45 @@ class Rating(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='movie_ratings')
     rating = models.IntegerField(blank=True, null=True)
     is_skipped = models.BooleanField(default=False)
+    # Lets the ratings snapshot pick up changed rows without rescanning the table;
+    # NULL on rows not written since the column was added
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            # One rating per user and movie, so the current rating is a single indexed lookup
+            models.UniqueConstraint(fields=['user', 'movie'], name='unique_user_movie_rating'),
+        ]
+        indexes = [
+            # Serves the back/next history navigation in Recommender.history
+            models.Index(fields=['user', 'id'], name='rating_user_history_idx'),
+        ]
 
     def __str__(self):
         return f' {self.movie.title}: {self.rating}'
 
+# Squared norm of a user's rating vector, maintained incrementally by Recommender.similarity
+class UserNorm(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rating_norm')
+    norm_sq = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'{self.user}: {self.norm_sq}'
+
+
+# Dot product between two users' rating vectors, stored in both directions
+class UserDotProduct(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    other_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    dot = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'other_user')
+
+    def __str__(self):
+        return f'{self.user} . {self.other_user}: {self.dot}'
+
+
 # Recommendation model representing movies recommended to users
 class Recommendation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -37,54 +79,43 @@ class Recommendation(models.Model):
     def __str__(self):
         return self.movie.title
     @classmethod
-    def get_predictions(cls, user):
-        user_id = user.id
-        
+    def get_predictions(cls, user, top_n=None, mode=None, genre=None):
+        if top_n is None:
+            top_n = getattr(settings, 'RECOMMENDER_TOP_N', 10)
+
+        candidates = None
+        if genre is not None:
+            # Only the genre's movies the user has not rated or skipped yet are scored
+            with timed('candidates'):
+                seen = Rating.objects.filter(user=user).values_list('movie_id', flat=True)
+                candidates = np.setdiff1d(get_genre_movie_ids(genre), np.fromiter(seen, dtype=np.int64))
+
         if not Rating.objects.filter(user=user, rating__gt=0).exists():
-            highly_rated_movies = Rating.objects.exclude(user=user).filter(rating__gt=3)\
-                .values('movie_id').annotate(count_ratings=Count('movie_id')).order_by('-count_ratings')[:10]
-            highly_rated_movie_ids = [movie['movie_id'] for movie in highly_rated_movies]
+            # The user has no rating above 0, so the shared ranking never includes their own ratings
+            with timed('popular'):
+                if candidates is None:
+                    highly_rated_movie_ids = get_popular_movie_ids(top_n)
+                else:
+                    highly_rated_movie_ids = get_popular_movie_ids_among(candidates, top_n)
             return pd.DataFrame({'movie_id': highly_rated_movie_ids, 'predicted_rating': [np.nan] * len(highly_rated_movie_ids)})
         
-        non_skipped_ratings = Rating.objects.filter(is_skipped=False)
-
-        ratings_df = pd.DataFrame.from_records(non_skipped_ratings.values())
-
-        ratings_df = ratings_df.drop('id', axis=1)
-        ratings_df = ratings_df.drop('is_skipped', axis=1)
-
-        ratings_df = ratings_df.drop_duplicates(subset=['user_id', 'movie_id'], keep='last')
-
-        user_movie_matrix = ratings_df.pivot(index='user_id', columns='movie_id', values='rating')
-
-        similarities = cosine_similarity(user_movie_matrix.fillna(0))
-
-        sim_df = pd.DataFrame(data=similarities, index=user_movie_matrix.index, columns=user_movie_matrix.index)
-
-            
-        user_similarities = sim_df[user_id]
-
-        unrated_movie_ids = user_movie_matrix.loc[user_id][user_movie_matrix.loc[user_id].isnull()].index
-
-        predicted_ratings = {}
-
-        for movie_id in unrated_movie_ids:
-            other_users_ratings = user_movie_matrix.loc[:, movie_id].dropna()
-            if not other_users_ratings.empty:
-                average = np.nanmean([rating * user_similarities[other_user_id] for other_user_id, rating in
-                                      other_users_ratings.items()])
-                predicted_ratings[movie_id] = average
-
-        predicted_ratings_df = pd.DataFrame.from_records(list(predicted_ratings.items()),
-                                                         columns=['movie_id', 'predicted_rating'])
-
-        sorted_predicted_ratings_df = predicted_ratings_df.sort_values('predicted_rating', ascending=False)
-
-        top_movies = sorted_predicted_ratings_df.head(10)
-
-        return top_movies
-
-
-
-
-
+        # Score with the selected engine, or the default one while its artifacts are missing
+        from .engines import get_engine
+        engine = get_engine(mode)
+
+        content_index = get_content_index()
+        shrinkage = getattr(settings, 'RECOMMENDER_CONTENT_SHRINKAGE', 5)
+        if content_index is None or not shrinkage:
+            return engine.predict(user, top_n=top_n, candidates=candidates)
+
+        # Blend in the content neighbours of the user's movies, which also reach movies nobody has rated yet
+        predictions = engine.predict(user, candidates=candidates)
+        with timed('load_ratings'):
+            user_ratings = list(Rating.objects.filter(user=user).values_list('movie_id', 'rating', 'is_skipped'))
+        active = [(movie_id, rating) for movie_id, rating, is_skipped in user_ratings
+                  if not is_skipped and rating is not None]
+        with timed('content'):
+            return blend_predictions(predictions, content_index, [movie_id for movie_id, _ in active],
+                                     [rating for _, rating in active],
+                                     exclude=[movie_id for movie_id, _, _ in user_ratings],
+                                     shrinkage=shrinkage, top_n=top_n, candidates=candidates)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+"""
+Pre-serialized movie payloads for the Recommender app.
+The JSON of every movie shown to users is built once and kept in two layers:
+a bounded in-process LRU, then the shared Django cache, before falling back
+to one query for the missing movies. Each payload carries an ETag, so the
+views answer If-None-Match with 304 Not Modified without re-serializing.
+
+Shared cache entries are keyed by a per-movie version token, the way the
+genre lists are. Movie saves and deletes replace the token (again when their
+transaction commits) and drop the payload from this process's LRU, so a reader
+that loaded the old columns before the write stores them under a token nobody
+reads anymore instead of serving them until they expire. Other processes may serve their LRU copy for up to
+RECOMMENDER_MOVIE_PAYLOAD_LRU_TTL seconds more. That bound only holds if
+RECOMMENDER_MOVIE_PAYLOAD_CACHE is shared by every process (Redis or the
+database cache); with a process-local cache they keep a changed movie for up
+to RECOMMENDER_MOVIE_PAYLOAD_TIMEOUT seconds, which Recommender.checks warns about.
+"""
+
+# Movie columns loaded for a payload, in build_movie_data order
+PAYLOAD_FIELDS = ('title', 'id', 'overview', 'poster_url')
+
+
+class MoviePayload(namedtuple('MoviePayload', ['data', 'json', 'etag'])):
+    """
+    - data: The movie dict of build_movie_data.
+    - json: data serialized as JSON bytes.
+    - etag: Quoted digest of json.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_values(cls, values):
+        data = {field: values[field] for field in PAYLOAD_FIELDS}
+        body = json.dumps(data).encode()
+        return cls(data, body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest())
+
+    def context(self):
+        return {'recommended_movie': dict(self.data)}
+
+
+class PayloadLRU:
+    """
+    Thread-safe LRU of movie payloads whose entries expire after a fixed time.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, movie_id):
+        with self._lock:
+            entry = self._entries.get(movie_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[movie_id]
+                return None
+            self._entries.move_to_end(movie_id)
+            return entry[1]
+
+    def put(self, movie_id, payload):
+        size = getattr(settings, 'RECOMMENDER_MOVIE_PAYLOAD_LRU_SIZE', 4096)
+        expires = time.monotonic() + getattr(settings, 'RECOMMENDER_MOVIE_PAYLOAD_LRU_TTL', 60)
+        with self._lock:
+            self._entries[movie_id] = (expires, payload)
+            self._entries.move_to_end(movie_id)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard(self, movie_ids):
+        with self._lock:
+            for movie_id in movie_ids:
+                self._entries.pop(movie_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_lru = PayloadLRU()
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECOMMENDER_MOVIE_PAYLOAD_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'RECOMMENDER_MOVIE_PAYLOAD_TIMEOUT', 60 * 60 * 24)
+
+
+def version_key(movie_id):
+    return f'movie-payload-version:{movie_id}'
+
+
+def payload_key(movie_id, version):
+    return f'movie-payload:{movie_id}:{version}'
+
+
+def new_versions(cache, movie_ids):
+    """
+    Store a fresh version token for each movie and return {movie_id: token}.
+    """
+    versions = {movie_id: uuid.uuid4().hex for movie_id in movie_ids}
+    cache.set_many({version_key(movie_id): version for movie_id, version in versions.items()}, get_timeout())
+    return versions
+
+
+def get_versions(cache, movie_ids):
+    """
+    Return {movie_id: token} of the current version tokens, creating the missing ones.
+    """
+    cached = cache.get_many([version_key(movie_id) for movie_id in movie_ids])
+    versions = {movie_id: cached[version_key(movie_id)] for movie_id in movie_ids if version_key(movie_id) in cached}
+    versions.update(new_versions(cache, [movie_id for movie_id in movie_ids if movie_id not in versions]))
+    return versions
+
+
+def get_movie_payloads(movie_ids):
+    """
+    Return {movie_id: MoviePayload} for the given movie ids; movies that do not exist are left out.
+    """
+    from .models import Movie
+
+    payloads = {}
+    missing = []
+    for movie_id in dict.fromkeys(int(movie_id) for movie_id in movie_ids):
+        payload = _lru.get(movie_id)
+        if payload is None:
+            missing.append(movie_id)
+        else:
+            payloads[movie_id] = payload
+    if not missing:
+        return payloads
+
+    cache = get_cache()
+    # Read before the rows: a write after this point replaces the tokens, so what is loaded below can only land under stale keys
+    versions = get_versions(cache, missing)
+    cached = cache.get_many([payload_key(movie_id, versions[movie_id]) for movie_id in missing])
+    loaded = {}
+    for movie_id in missing:
+        payload = cached.get(payload_key(movie_id, versions[movie_id]))
+        if payload is None:
+            loaded[movie_id] = None
+        else:
+            payloads[movie_id] = payload
+            _lru.put(movie_id, payload)
+
+    if loaded:
+        for values in Movie.objects.filter(id__in=list(loaded)).values(*PAYLOAD_FIELDS):
+            payloads[values['id']] = loaded[values['id']] = MoviePayload.from_values(values)
+            _lru.put(values['id'], loaded[values['id']])
+        cache.set_many({payload_key(movie_id, versions[movie_id]): payload
+                        for movie_id, payload in loaded.items() if payload}, get_timeout())
+    return payloads
+
+
+def get_movie_payload(movie_id):
+    """
+    Return the MoviePayload of one movie, or None if it does not exist.
+    """
+    return get_movie_payloads([movie_id]).get(int(movie_id))
+
+
+def invalidate_movie_payloads(movie_ids):
+    """
+    Drop the payloads of changed or deleted movies from this process and the shared cache.
+
+    Inside a transaction the tokens are replaced again on commit, since readers
+    still see the old rows until then.
+    """
+    movie_ids = [int(movie_id) for movie_id in movie_ids]
+    _lru.discard(movie_ids)
+    new_versions(get_cache(), movie_ids)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: new_versions(get_cache(), movie_ids))
+
+
+def clear_payload_lru():
+    """
+    Empty this process's LRU, e.g. between tests.
+    """
+    _lru.clear()
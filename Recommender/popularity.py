@@ -0,0 +1,110 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count
+from .routers import read_replica
+
+"""
+Shared popularity ranking for the Recommender app.
+Cold-start recommendations and the initial movies of newly registered users
+both read a materialized list of the most popular movies from the cache.
+The list is recomputed by one caller once it is older than
+RECOMMENDER_POPULAR_TTL while everyone else keeps reading the previous copy,
+so sign-up spikes do not turn into repeated full-table aggregations. When
+there is no copy at all (first use, invalidation or eviction) the others wait
+up to RECOMMENDER_POPULAR_WAIT seconds for it, then go on with an empty list.
+"""
+
+POPULAR_MOVIES_KEY = 'popular-movies'
+POPULAR_MOVIES_LOCK_KEY = 'popular-movies-refreshing'
+# Seconds between two reads of a caller waiting for the list
+POPULAR_MOVIES_POLL = 0.05
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECOMMENDER_POPULAR_CACHE', 'default')]
+
+
+def compute_popular_movie_ids(limit):
+    """
+    Rank movies by how many ratings above 3 they have received.
+    """
+    from .models import Rating
+
+    with read_replica():
+        highly_rated_movies = Rating.objects.filter(rating__gt=3).values('movie_id')\
+            .annotate(count_ratings=Count('movie_id')).order_by('-count_ratings')[:limit]
+        return [movie['movie_id'] for movie in highly_rated_movies]
+
+
+def refresh_popular_movies():
+    """
+    Recompute the popular list and store it in the cache.
+    """
+    movie_ids = compute_popular_movie_ids(getattr(settings, 'RECOMMENDER_POPULAR_SIZE', 100))
+    expires = time.time() + getattr(settings, 'RECOMMENDER_POPULAR_TTL', 15 * 60)
+    get_cache().set(POPULAR_MOVIES_KEY, {'movie_ids': movie_ids, 'expires': expires}, None)
+    return movie_ids
+
+
+def wait_for_popular_movies(cache):
+    """
+    Wait for the caller holding the lock to store the list.
+
+    Returns:
+    - The stored entry, or one without movies if it is not there within
+      RECOMMENDER_POPULAR_WAIT seconds or the holder gave up.
+    """
+    deadline = time.monotonic() + getattr(settings, 'RECOMMENDER_POPULAR_WAIT', 5)
+    while time.monotonic() < deadline:
+        time.sleep(POPULAR_MOVIES_POLL)
+        popular = cache.get(POPULAR_MOVIES_KEY)
+        if popular is not None:
+            return popular
+        if cache.get(POPULAR_MOVIES_LOCK_KEY) is None:
+            break
+    return {'movie_ids': [], 'expires': 0}
+
+
+def get_popular_movie_ids(limit=None):
+    """
+    Return the ids of the most popular movies, most popular first.
+
+    Arguments:
+    - limit: Maximum number of ids to return; at most RECOMMENDER_POPULAR_SIZE are kept.
+    """
+    cache = get_cache()
+    popular = cache.get(POPULAR_MOVIES_KEY)
+
+    if popular is None or popular['expires'] < time.time():
+        if cache.add(POPULAR_MOVIES_LOCK_KEY, True, 60):
+            # Only the caller holding the lock recomputes
+            try:
+                return refresh_popular_movies()[:limit]
+            finally:
+                cache.delete(POPULAR_MOVIES_LOCK_KEY)
+        if popular is None:
+            popular = wait_for_popular_movies(cache)
+        # Otherwise the stale list is served meanwhile
+
+    return popular['movie_ids'][:limit]
+
+
+def get_popular_movie_ids_among(candidates, limit):
+    """
+    Return up to limit ids out of the candidates, e.g. the movies of one genre:
+    the most popular ones first, then the remaining candidates in id order.
+    """
+    candidates = [int(movie_id) for movie_id in candidates]
+    allowed = set(candidates)
+    movie_ids = [movie_id for movie_id in get_popular_movie_ids() if movie_id in allowed][:limit]
+    chosen = set(movie_ids)
+    movie_ids.extend([movie_id for movie_id in candidates if movie_id not in chosen][:limit - len(movie_ids)])
+    return movie_ids
+
+
+def invalidate_popular_movies():
+    """
+    Drop the cached list so the next reader recomputes it.
+    """
+    get_cache().delete(POPULAR_MOVIES_KEY)
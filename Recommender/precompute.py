@@ -0,0 +1,229 @@
+import json
+import os
+import multiprocessing
+import uuid
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from .models import Rating, Recommendation
+from .snapshot import RatingsSnapshot, NO_RATING
+from .engines import Engine, get_engine
+from .content_index import get_content_index, blend_predictions
+from .queues import get_recommendation_queue
+from .routers import read_replica
+
+"""
+Offline, sharded precomputation of recommendations for the Recommender app.
+One ratings snapshot and the RECOMMENDER_MODE engine, with its artifacts and
+the content index get_predictions blends in, are loaded in the parent process
+and shared with a pool of worker processes (copy-on-write under fork). Workers only do the numpy scoring; the parent writes each finished shard with bulk_create inside its
+own transaction and records it in a checkpoint file, so an interrupted run
+can resume with the shards that are still missing. The checkpoint keeps the
+run's user-id sharding rather than its ratings, so a run can be resumed after
+new ratings arrived; users who joined since go to the shard of their id.
+"""
+
+# Shared with the worker processes through the pool initializer
+_snapshot = {}
+
+
+def load_snapshot():
+    """
+    Load everything needed to score any user from the database, in one pass.
+
+    Returns:
+    - dict with the UserItemMatrix, the skipped movie ids of each user, the
+      engine scoring them, the content index and shrinkage to blend with (None
+      and 0 without one), the cold-start popularity ranking and the id of the
+      newest rating.
+    """
+    with read_replica():
+        ratings = RatingsSnapshot.from_database()
+        last_rating_id = Rating.objects.aggregate(last=Max('id'))['last'] or 0
+    matrix = ratings.matrix()
+
+    # Skipped or unrated movies are not in the matrix but must not be recommended either
+    inactive = ratings.skipped | (ratings.ratings == NO_RATING)
+    order = np.argsort(ratings.user_ids[inactive], kind='stable')
+    inactive_users, starts = np.unique(ratings.user_ids[inactive][order], return_index=True)
+    skipped = dict(zip(inactive_users.tolist(), np.split(ratings.movie_ids[inactive][order], starts[1:])))
+
+    # Loaded here so that forked workers share the engine's artifacts
+    engine = get_engine()
+    if type(engine).predict_snapshot is Engine.predict_snapshot:
+        raise ValueError(f'The {engine.name} engine cannot score a ratings snapshot')
+    shrinkage = getattr(settings, 'RECOMMENDER_CONTENT_SHRINKAGE', 5)
+    content_index = get_content_index() if shrinkage else None
+
+    # Same ranking as the cold-start branch of get_predictions. A cold-start user
+    # has no rating above 0, so excluding their own ratings changes nothing.
+    liked = matrix.matrix.copy()
+    liked.data = (liked.data > 3).astype(np.float64)
+    like_counts = np.asarray(liked.sum(axis=0)).ravel()
+    liked_columns = np.flatnonzero(like_counts)
+    popular = matrix.movie_ids[liked_columns[np.argsort(-like_counts[liked_columns], kind='stable')]]
+
+    return {
+        'matrix': matrix,
+        'skipped': skipped,
+        'engine': engine,
+        'content_index': content_index,
+        'shrinkage': shrinkage if content_index is not None else 0,
+        'popular': popular,
+        'last_rating_id': last_rating_id,
+    }
+
+
+def init_worker(snapshot):
+    _snapshot.update(snapshot)
+
+
+def score_user(snapshot, user_id, top_n):
+    """
+    Score one user from a snapshot with the snapshot's engine, mirroring Recommendation.get_predictions.
+
+    Returns:
+    - list of (movie_id, score) tuples, best first; score is None for cold-start picks.
+    """
+    matrix = snapshot['matrix']
+    row = matrix.user_position(user_id)
+    if row is None or not (matrix.matrix[row].data > 0).any():
+        return [(int(movie_id), None) for movie_id in snapshot['popular'][:top_n]]
+
+    skipped = snapshot['skipped'].get(user_id, ())
+    content_index = snapshot.get('content_index')
+    if content_index is None:
+        predictions = snapshot['engine'].predict_snapshot(matrix, user_id, top_n=top_n, skipped=skipped)
+    else:
+        # Blend in the content neighbours of the user's movies, as get_predictions does
+        predictions = snapshot['engine'].predict_snapshot(matrix, user_id, skipped=skipped)
+        rated = matrix.matrix[row]
+        movie_ids = matrix.movie_ids[rated.indices]
+        predictions = blend_predictions(predictions, content_index, movie_ids, rated.data,
+                                        exclude=np.concatenate([movie_ids, np.asarray(skipped, dtype=np.int64)]),
+                                        shrinkage=snapshot['shrinkage'], top_n=top_n)
+    return [(int(movie_id), float(score))
+            for movie_id, score in zip(predictions['movie_id'], predictions['predicted_rating'])]
+
+
+def score_shard(task):
+    """
+    Pool worker: score every user of one shard against the shared snapshot.
+    """
+    shard, user_ids, top_n = task
+    return shard, [(user_id, score_user(_snapshot, user_id, top_n)) for user_id in user_ids]
+
+
+def write_shard(scored_users, batch_size=1000):
+    """
+    Replace the stored recommendations of one shard's users in a single transaction.
+    """
+    user_ids = [user_id for user_id, _ in scored_users]
+    recommendations = [Recommendation(user_id=user_id, movie_id=movie_id, score=score)
+                       for user_id, scored in scored_users for movie_id, score in scored]
+    with transaction.atomic():
+        Recommendation.objects.filter(user_id__in=user_ids).delete()
+        Recommendation.objects.bulk_create(recommendations, batch_size=batch_size)
+    # Cached queues would otherwise keep serving the previous lists
+    get_recommendation_queue().invalidate(user_ids)
+    return len(recommendations)
+
+
+def get_checkpoint_path():
+    return getattr(settings, 'RECOMMENDER_PRECOMPUTE_CHECKPOINT',
+                   os.path.join(settings.BASE_DIR, 'artifacts', 'precompute_checkpoint.json'))
+
+
+def new_run(user_ids, shards, last_rating_id):
+    """
+    Describe a new run: its id and the user-id sharding it keeps until it finishes.
+
+    Returns:
+    - dict with 'run_id', 'shards', 'boundaries' (the highest user id of every
+      shard but the last), 'last_rating_id' and the 'finished' shards.
+    """
+    parts = np.array_split(np.asarray(sorted(user_ids), dtype=np.int64), shards)
+    return {'run_id': uuid.uuid4().hex, 'shards': shards,
+            'boundaries': [int(part[-1]) for part in parts[:-1] if len(part)],
+            'last_rating_id': last_rating_id, 'finished': []}
+
+
+def split_users(user_ids, boundaries):
+    """
+    Split user ids into the shards of a run; shard i holds the ids up to boundaries[i].
+    """
+    user_ids = np.asarray(sorted(user_ids), dtype=np.int64)
+    shard_of = np.searchsorted(np.asarray(boundaries, dtype=np.int64), user_ids, side='left')
+    return [user_ids[shard_of == shard] for shard in range(len(boundaries) + 1)]
+
+
+def read_checkpoint(path, shards):
+    """
+    Return the run recorded by an interrupted run with the same number of shards, or None.
+    """
+    try:
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get('shards') != shards or 'boundaries' not in checkpoint:
+        return None
+    return checkpoint
+
+
+def write_checkpoint(path, run, finished):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as checkpoint_file:
+        json.dump(dict(run, finished=sorted(finished)), checkpoint_file)
+    os.replace(temporary_path, path)
+
+
+def precompute(user_ids, shards, workers, top_n, checkpoint_path, resume=False, progress=None):
+    """
+    Score and store recommendations for the given users.
+
+    Arguments:
+    - user_ids: Ids of the users to refresh.
+    - shards: Number of shards to split the users into.
+    - workers: Number of worker processes; 1 scores in this process.
+    - top_n: Number of recommendations per user.
+    - checkpoint_path: File recording finished shards.
+    - resume: Continue the run recorded in the checkpoint, skipping its finished shards.
+    - progress: Optional callable(shard, users, recommendations) called per written shard.
+
+    Returns:
+    - Number of shards written by this run.
+    """
+    snapshot = load_snapshot()
+    run = read_checkpoint(checkpoint_path, shards) if resume else None
+    if run is None:
+        run = new_run(user_ids, shards, snapshot['last_rating_id'])
+    finished = set(run['finished'])
+
+    tasks = [(shard, [int(user_id) for user_id in shard_user_ids], top_n)
+             for shard, shard_user_ids in enumerate(split_users(user_ids, run['boundaries']))
+             if shard not in finished]
+
+    def store(results):
+        written = 0
+        for shard, scored_users in results:
+            count = write_shard(scored_users)
+            finished.add(shard)
+            write_checkpoint(checkpoint_path, run, finished)
+            written += 1
+            if progress:
+                progress(shard, len(scored_users), count)
+        return written
+
+    if workers <= 1:
+        init_worker(snapshot)
+        written = store(map(score_shard, tasks))
+    else:
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        with context.Pool(workers, initializer=init_worker, initargs=(snapshot,)) as pool:
+            written = store(pool.imap_unordered(score_shard, tasks))
+
+    _snapshot.clear()
+    return written
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connections
+
+"""
+Background prefetching of recommendations for the Recommender app.
+When a user's queue drops below RECOMMENDER_PREFETCH_THRESHOLD, a refresh is
+scheduled on an in-process thread pool, so the next batch is usually ready
+before the queue runs dry and the request path only pops precomputed results.
+No external broker is needed; a refresh that is lost with its process is
+simply scheduled again by the user's next request.
+
+A prefetch is scheduled while the movie just popped is on screen and not rated
+yet, so that movie is handed to the refresh to leave out; otherwise it would be
+queued again and shown a second time once rated.
+
+The async views wait for refreshes, and for genre lists (run_on_executor),
+on the same bounded pool, so CPU-heavy scoring never runs on the event loop or
+on the single thread-sensitive executor, and at most
+RECOMMENDER_PREFETCH_WORKERS scorings are computed at once.
+"""
+
+_executor = None
+_pending = {}
+# Movies on screen when each user's refreshes were scheduled, left out of the next one
+_on_screen = {}
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'RECOMMENDER_PREFETCH_WORKERS', 2),
+                                           thread_name_prefix='recommendation-prefetch')
+        return _executor
+
+
+def run_refresh(user_id):
+    """
+    Refresh one user's recommendations in a worker thread, with its own database connection.
+    """
+    from .utils import refresh_recommendation
+
+    close_old_connections()
+    refreshed = False
+    try:
+        user = User.objects.filter(id=user_id).first()
+        if user is not None:
+            refresh_recommendation(user)
+        else:
+            take_on_screen(user_id)
+        refreshed = True
+    finally:
+        with _lock:
+            _pending.pop(user_id, None)
+            if refreshed and user_id in _on_screen:
+                # A movie went on screen after this refresh read the ones to leave out
+                _pending[user_id] = _executor.submit(run_refresh, user_id)
+            elif not refreshed:
+                _on_screen.pop(user_id, None)
+        connections.close_all()
+
+
+def take_on_screen(user_id):
+    """
+    Return and forget the ids of the movies to leave out of the user's next refresh.
+    """
+    with _lock:
+        return _on_screen.pop(user_id, set())
+
+
+def schedule_refresh(user, on_screen=()):
+    """
+    Schedule a background refresh for the user unless one is already pending.
+    With RECOMMENDER_PREFETCH_WORKERS set to 0 the refresh runs immediately in the caller.
+
+    Arguments:
+    - user: The user whose recommendations are refreshed.
+    - on_screen: Ids of movies shown to the user but not rated yet, to leave out of the refresh.
+
+    Returns:
+    - The Future of the pending refresh, or None if it already ran inline.
+    """
+    if on_screen:
+        with _lock:
+            _on_screen.setdefault(user.id, set()).update(on_screen)
+    if getattr(settings, 'RECOMMENDER_PREFETCH_WORKERS', 2) == 0:
+        from .utils import refresh_recommendation
+        try:
+            refresh_recommendation(user)
+        finally:
+            # Already read by the refresh, unless it failed first
+            take_on_screen(user.id)
+        return None
+
+    executor = get_executor()
+    with _lock:
+        future = _pending.get(user.id)
+        if future is None:
+            future = executor.submit(run_refresh, user.id)
+            _pending[user.id] = future
+    return future
+
+
+def pending_refresh(user):
+    """
+    Return the Future of the user's pending background refresh, if any.
+    """
+    with _lock:
+        return _pending.get(user.id)
+
+
+def maybe_prefetch(queue, user, movie_id=None):
+    """
+    Schedule a refresh if the user's queue has dropped below the low watermark.
+    movie_id is the movie just popped, which the refresh leaves out.
+    """
+    threshold = getattr(settings, 'RECOMMENDER_PREFETCH_THRESHOLD', None)
+    if threshold is not None and queue.remaining(user) < threshold:
+        schedule_refresh(user, on_screen=() if movie_id is None else (movie_id,))
+
+
+def run_task(func, *args):
+    """
+    Run func in a worker thread, with its own database connection.
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+async def run_on_executor(func, *args):
+    """
+    Run func(*args) on the bounded pool and return its result without blocking the event loop.
+    With RECOMMENDER_PREFETCH_WORKERS set to 0 it runs on the thread-sensitive executor instead.
+    """
+    if getattr(settings, 'RECOMMENDER_PREFETCH_WORKERS', 2) == 0:
+        return await sync_to_async(func)(*args)
+    return await asyncio.wrap_future(get_executor().submit(run_task, func, *args))
+
+
+async def await_refresh(user):
+    """
+    Wait for the user's pending refresh, or schedule one, without blocking the event loop.
+    """
+    future = pending_refresh(user)
+    if future is None:
+        future = await sync_to_async(schedule_refresh)(user)
+    if future is not None:
+        await asyncio.wrap_future(future)
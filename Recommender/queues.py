@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils.module_loading import import_string
+from .models import Recommendation, Rating
+from .genres import split_genres
+
+"""
+Per-user recommendation queues for the Recommender app.
+A queue holds a user's ranked list of recommended movies. The backend is
+selected with the RECOMMENDER_QUEUE_BACKEND setting:
+
+- DatabaseQueue pops rows straight from the Recommendation table.
+- CacheQueue keeps each ranked list as packed movie ids in the Django cache,
+  so popping the next movie never touches the database. The Recommendation
+  table is still written in bulk as a durable fallback and is read back once
+  when the cached list is missing, e.g. after an eviction or restart.
+
+Genre-filtered recommendations use a GenreQueue per user and genre instead,
+held in the same cache.
+"""
+
+
+# Cache backends whose incr() is atomic; DummyCache stores nothing, so CacheQueue falls back to the table
+ATOMIC_INCR_CACHES = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class DatabaseQueue:
+    """
+    Queue backed by the Recommendation table only.
+    """
+
+    def push(self, user, predictions):
+        """
+        Replace the user's queue with the movie_id / predicted_rating rows of a predictions DataFrame.
+        """
+        recommendations = [Recommendation(user=user, movie_id=int(movie_id), score=None if pd.isna(score) else score)
+                           for movie_id, score in zip(predictions['movie_id'], predictions['predicted_rating'])]
+        with transaction.atomic():
+            Recommendation.objects.filter(user=user).delete()
+            Recommendation.objects.bulk_create(recommendations)
+
+    def pop(self, user):
+        """
+        Remove and return the id of the user's next movie, or None if the queue is empty.
+        """
+        recommendation = Recommendation.objects.filter(user=user).order_by('-score').first()
+        if recommendation is None:
+            return None
+        recommendation.delete()
+        return recommendation.movie_id
+
+    def remaining(self, user):
+        """
+        Return the number of movies left in the user's queue.
+        """
+        return Recommendation.objects.filter(user=user).count()
+
+    def invalidate(self, user_ids):
+        """
+        Drop any state held outside the Recommendation table for these users.
+        """
+
+
+class CacheQueue(DatabaseQueue):
+    """
+    Queue whose ranked lists live in the Django cache, with the Recommendation table as fallback.
+
+    Each user has two cache entries: the ranked movie ids packed as int64 bytes,
+    and a read position that is advanced with an atomic cache.incr(). Backends
+    whose incr() is a get and a set, such as DatabaseCache, would hand one
+    position to concurrent pops and are refused.
+    """
+
+    def __init__(self):
+        alias = getattr(settings, 'RECOMMENDER_QUEUE_CACHE', 'default')
+        backend = settings.CACHES[alias]['BACKEND']
+        if backend not in ATOMIC_INCR_CACHES:
+            raise ImproperlyConfigured(f'CacheQueue needs a cache with an atomic incr(); '
+                                       f'RECOMMENDER_QUEUE_CACHE {alias!r} uses {backend}')
+        self.cache = caches[alias]
+        self.timeout = getattr(settings, 'RECOMMENDER_QUEUE_TIMEOUT', 60 * 60 * 24)
+
+    def keys(self, user_id):
+        return f'recommendation-queue:{user_id}', f'recommendation-queue-position:{user_id}'
+
+    def store(self, user_id, movie_ids):
+        ids_key, position_key = self.keys(user_id)
+        self.cache.set_many({ids_key: np.asarray(movie_ids, dtype=np.int64).tobytes(), position_key: 0},
+                            self.timeout)
+
+    def push(self, user, predictions):
+        super().push(user, predictions)
+        self.store(user.id, predictions['movie_id'])
+
+    def load(self, user):
+        """
+        Rebuild the cached list from the Recommendation table after a cache miss.
+        Rows of movies the user has rated or skipped since are left out, because
+        cached pops do not delete rows.
+        """
+        already_seen = Rating.objects.filter(user=user, movie_id=OuterRef('movie_id'))
+        movie_ids = list(Recommendation.objects.filter(user=user).exclude(Exists(already_seen))
+                         .order_by('-score').values_list('movie_id', flat=True))
+        self.store(user.id, movie_ids)
+
+    def claim(self, user_id):
+        """
+        Atomically claim the next read position of the cached list.
+
+        Returns:
+        - (packed movie ids, position), or (None, None) if the list is not cached.
+        """
+        ids_key, position_key = self.keys(user_id)
+        packed = self.cache.get(ids_key)
+        if packed is None:
+            return None, None
+        try:
+            return packed, self.cache.incr(position_key) - 1
+        except ValueError:
+            return None, None
+
+    def pop(self, user):
+        packed, position = self.claim(user.id)
+        if packed is None:
+            self.load(user)
+            packed, position = self.claim(user.id)
+            if packed is None:
+                # The cache is not holding anything, e.g. DummyCache
+                return super().pop(user)
+
+        movie_ids = np.frombuffer(packed, dtype=np.int64)
+        if position >= len(movie_ids):
+            return None
+        return int(movie_ids[position])
+
+    def remaining(self, user):
+        ids_key, position_key = self.keys(user.id)
+        cached = self.cache.get_many([ids_key, position_key])
+        if ids_key not in cached or position_key not in cached:
+            return super().remaining(user)
+        return max(len(cached[ids_key]) // np.dtype(np.int64).itemsize - cached[position_key], 0)
+
+    def invalidate(self, user_ids):
+        self.cache.delete_many([key for user_id in user_ids for key in self.keys(user_id)])
+
+
+class GenreQueue:
+    """
+    Ranked lists of one genre's movies per user, held in the RECOMMENDER_QUEUE_CACHE.
+
+    A list is served until the user has rated or skipped every movie in it, so a
+    genre is rescored once per list rather than on every request. Nothing is
+    popped: the user's ratings are what moves the list on.
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'RECOMMENDER_QUEUE_CACHE', 'default')]
+        self.timeout = getattr(settings, 'RECOMMENDER_QUEUE_TIMEOUT', 60 * 60 * 24)
+
+    def key(self, user_id, genre):
+        names = split_genres(genre)
+        return f'genre-queue:{user_id}:{names[0] if names else ""}'
+
+    def push(self, user, genre, predictions):
+        """
+        Replace the user's list for the genre with the movie ids of a predictions DataFrame.
+        """
+        self.cache.set(self.key(user.id, genre), np.asarray(predictions['movie_id'], dtype=np.int64).tobytes(),
+                       self.timeout)
+
+    def unseen(self, user, genre):
+        """
+        Return the ids of the listed movies the user has not rated or skipped yet, best first.
+        Empty if no list is cached or the user has seen all of it.
+        """
+        packed = self.cache.get(self.key(user.id, genre))
+        if packed is None:
+            return []
+        movie_ids = np.frombuffer(packed, dtype=np.int64).tolist()
+        seen = set(Rating.objects.filter(user=user, movie_id__in=movie_ids).values_list('movie_id', flat=True))
+        return [movie_id for movie_id in movie_ids if movie_id not in seen]
+
+
+def get_recommendation_queue():
+    """
+    Return an instance of the queue backend configured in RECOMMENDER_QUEUE_BACKEND.
+    """
+    return import_string(getattr(settings, 'RECOMMENDER_QUEUE_BACKEND', 'Recommender.queues.DatabaseQueue'))()
@@ -0,0 +1,98 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+"""
+Read-replica routing for the Recommender app.
+The heavy reads of the recommendation pipeline (ratings snapshot, scoring,
+popularity aggregation) are wrapped in read_replica(), which sends them to
+the RECOMMENDER_READ_DATABASE alias through ReadReplicaRouter. Everything
+else, and every write, stays on 'default'.
+
+A replica lags behind the primary, so every rating write marks its user for
+RECOMMENDER_READ_YOUR_WRITES_SECONDS; while the mark is set, that user's
+recommendations are computed from the primary and reflect the rating just made.
+The mark must be seen by every process, so RECOMMENDER_READ_YOUR_WRITES_CACHE
+has to be a shared cache (Redis or the database cache, which always reads the
+primary); Recommender.checks fails the system checks otherwise.
+"""
+
+# The alias reads are routed to inside read_replica(); None outside of it leaves routing to Django
+_read_alias = ContextVar('recommender_read_alias', default=None)
+# app_label of the model DatabaseCache reads its table through
+DATABASE_CACHE_APP_LABEL = 'django_cache'
+
+
+def get_read_database():
+    """
+    Return the configured read alias, or None if there is no usable replica.
+    """
+    alias = getattr(settings, 'RECOMMENDER_READ_DATABASE', None)
+    if alias is None or alias == DEFAULT_DB_ALIAS or alias not in connections.settings:
+        return None
+    return alias
+
+
+def get_cache():
+    return caches[getattr(settings, 'RECOMMENDER_READ_YOUR_WRITES_CACHE', 'default')]
+
+
+def recent_write_key(user_id):
+    return f'recent-rating-write:{user_id}'
+
+
+def note_rating_writes(user_ids):
+    """
+    Mark users who just wrote ratings, so their next reads are served by the primary.
+    """
+    if get_read_database() is None:
+        return
+    window = getattr(settings, 'RECOMMENDER_READ_YOUR_WRITES_SECONDS', 30)
+    get_cache().set_many({recent_write_key(user_id): time.time() for user_id in set(user_ids)}, window)
+
+
+def wrote_recently(user_id):
+    return get_cache().get(recent_write_key(user_id)) is not None
+
+
+@contextmanager
+def read_replica(user=None):
+    """
+    Route the reads of the enclosed block to the read replica, unless the given
+    user wrote a rating recently or no replica is configured.
+
+    Yields:
+    - The alias the reads go to.
+    """
+    alias = get_read_database()
+    if alias is not None and (_read_alias.get() == DEFAULT_DB_ALIAS or
+                              user is not None and wrote_recently(user.id)):
+        # Nested blocks keep the primary chosen for a user who has just rated
+        alias = DEFAULT_DB_ALIAS
+    token = _read_alias.set(alias)
+    try:
+        yield alias or DEFAULT_DB_ALIAS
+    finally:
+        _read_alias.reset(token)
+
+
+class ReadReplicaRouter:
+    """
+    Database router sending reads inside read_replica() to the replica and all writes to 'default'.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == DATABASE_CACHE_APP_LABEL:
+            # A lagging replica would hide the read-your-writes marks and other fresh cache entries
+            return DEFAULT_DB_ALIAS
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
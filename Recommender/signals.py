@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from .models import Movie, Rating
+from . import similarity
+from .popularity import invalidate_popular_movies
+from .genres import invalidate_genre_index
+from .payloads import invalidate_movie_payloads
+from .routers import note_rating_writes
+from .metrics import install_query_counter
+
+"""
+Signal handlers for the Recommender app.
+Keep the incremental similarity store in step with single Rating writes,
+drop cached movie lists that could point at deleted or changed movies, and count the
+queries of every database connection for the request metrics.
+"""
+
+
+def similarity_store_enabled():
+    return getattr(settings, 'RECOMMENDER_SIMILARITY_STORE', False)
+
+
+@receiver(pre_save, sender=Rating)
+@receiver(pre_delete, sender=Rating)
+def remember_previous_rating(sender, instance, **kwargs):
+    """
+    Record the matrix cell value before the write so the change can be applied as a delta.
+    """
+    if similarity_store_enabled():
+        instance._previous_rating = similarity.effective_rating(instance.user_id, instance.movie_id)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def update_similarity_store(sender, instance, **kwargs):
+    """
+    Apply the change of the (user, movie) cell to the stored norms and dot products.
+    """
+    if similarity_store_enabled() and hasattr(instance, '_previous_rating'):
+        new_rating = similarity.effective_rating(instance.user_id, instance.movie_id)
+        similarity.apply_rating_change(instance.user_id, instance.movie_id, instance._previous_rating, new_rating)
+        del instance._previous_rating
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def note_rating_write(sender, instance, **kwargs):
+    """
+    Serve the user's next recommendations from the primary until the replica has caught up.
+    """
+    note_rating_writes([instance.user_id])
+
+
+@receiver(post_delete, sender=Movie)
+def forget_deleted_movie(sender, instance, **kwargs):
+    """
+    The popular list may contain the deleted movie, so it is recomputed on next use.
+    """
+    invalidate_popular_movies()
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def forget_movie_genres(sender, instance, **kwargs):
+    """
+    The movie may have joined, left or changed genres, so the genre lists are rebuilt on next use.
+    """
+    invalidate_genre_index()
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def forget_movie_payload(sender, instance, **kwargs):
+    """
+    Drop the movie's cached JSON so the next response is built from the new row.
+    """
+    invalidate_movie_payloads([instance.id])
+
+
+@receiver(connection_created)
+def count_connection_queries(sender, connection, **kwargs):
+    install_query_counter(connection)
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from .models import Rating, UserNorm, UserDotProduct
+from .snapshot import RatingsSnapshot
+
+"""
+Incremental user-user similarity store for the Recommender app.
+Keeps every user's squared rating norm and the dot products between users
+who rated a common movie, so a single rating write only touches the rows of
+the users who rated that movie, and a similarity row is read in O(users).
+
+The store is maintained from the Rating signals in Recommender.signals when
+the RECOMMENDER_SIMILARITY_STORE setting is enabled. Bulk writes bypass
+signals, so run `manage.py rebuild_similarities` after them.
+"""
+
+
+def effective_rating(user_id, movie_id):
+    """
+    Return the value that the (user, movie) cell of the rating matrix currently holds.
+    This is the latest non-skipped rating, or 0 when there is none.
+    """
+    rating = Rating.objects.filter(user_id=user_id, movie_id=movie_id, is_skipped=False, rating__isnull=False)\
+        .order_by('-id').values_list('rating', flat=True).first()
+    return rating or 0
+
+
+def movie_ratings(movie_id, exclude_user_id):
+    """
+    Return {user_id: rating} for every other user's current rating of a movie.
+    """
+    ratings = {}
+    for user_id, rating in Rating.objects.filter(movie_id=movie_id, is_skipped=False, rating__isnull=False)\
+            .exclude(user_id=exclude_user_id).order_by('id').values_list('user_id', 'rating'):
+        ratings[user_id] = rating
+    return ratings
+
+
+def apply_rating_change(user_id, movie_id, old_rating, new_rating):
+    """
+    Update the stored norm and dot products after one cell of the rating matrix changed.
+    Only the row and column of the user who rated are touched.
+
+    Arguments:
+    - user_id: The user whose rating changed.
+    - movie_id: The movie that was rated.
+    - old_rating: The cell value before the change (0 if unrated).
+    - new_rating: The cell value after the change (0 if unrated).
+    """
+    delta = new_rating - old_rating
+    if delta == 0:
+        return
+
+    with transaction.atomic():
+        norm, _ = UserNorm.objects.select_for_update().get_or_create(user_id=user_id)
+        norm.norm_sq += new_rating * new_rating - old_rating * old_rating
+        norm.save()
+
+        others = {other_id: rating for other_id, rating in movie_ratings(movie_id, user_id).items() if rating}
+        if not others:
+            return
+
+        existing = UserDotProduct.objects.select_for_update().filter(
+            Q(user_id=user_id, other_user_id__in=list(others)) | Q(user_id__in=list(others), other_user_id=user_id))
+        pairs = {(row.user_id, row.other_user_id): row for row in existing}
+
+        to_update, to_create = [], []
+        for other_id, rating in others.items():
+            for pair in ((user_id, other_id), (other_id, user_id)):
+                if pair in pairs:
+                    pairs[pair].dot += delta * rating
+                    to_update.append(pairs[pair])
+                else:
+                    to_create.append(UserDotProduct(user_id=pair[0], other_user_id=pair[1], dot=delta * rating))
+
+        UserDotProduct.objects.bulk_update(to_update, ['dot'])
+        UserDotProduct.objects.bulk_create(to_create)
+
+
+def similarity_row(user_id):
+    """
+    Read the cosine similarities between a user and every user they share a rated movie with.
+
+    Returns:
+    - dict mapping other user ids to cosine similarity.
+    """
+    own_norm = UserNorm.objects.filter(user_id=user_id).values_list('norm_sq', flat=True).first()
+    if not own_norm:
+        return {}
+
+    similarities = {}
+    for other_id, dot, other_norm in UserDotProduct.objects.filter(user_id=user_id)\
+            .values_list('other_user_id', 'dot', 'other_user__rating_norm__norm_sq'):
+        if other_norm:
+            similarities[other_id] = dot / math.sqrt(own_norm * other_norm)
+    return similarities
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute the whole store from the Rating table.
+    Used to initialise the store and to repair it after bulk writes.
+    """
+    matrix = RatingsSnapshot.from_database(active_only=True).matrix()
+    norms = np.asarray(matrix.matrix.multiply(matrix.matrix).sum(axis=1)).ravel()
+    dots = (matrix.matrix @ matrix.matrix.T).tocoo()
+
+    with transaction.atomic():
+        UserDotProduct.objects.all().delete()
+        UserNorm.objects.all().delete()
+        UserNorm.objects.bulk_create(
+            [UserNorm(user_id=int(user_id), norm_sq=float(norm)) for user_id, norm in zip(matrix.user_ids, norms)],
+            batch_size=batch_size)
+        UserDotProduct.objects.bulk_create(
+            [UserDotProduct(user_id=int(matrix.user_ids[row]), other_user_id=int(matrix.user_ids[col]), dot=float(dot))
+             for row, col, dot in zip(dots.row, dots.col, dots.data) if row != col and dot],
+            batch_size=batch_size)
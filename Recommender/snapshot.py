@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max, Q
+from django.utils import timezone
+from .models import Rating
+from .sparse import UserItemMatrix
+from .metrics import timed
+
+"""
+Columnar ratings snapshot for the Recommender app.
+Ratings are held as typed NumPy arrays instead of model instances or dicts,
+streamed from the database with values_list().iterator(). A long-lived
+snapshot catches up incrementally: it only reads rows with an id above the
+last one seen plus rows whose updated_at changed since the previous sync.
+Rows written before updated_at existed hold NULL there, meaning they have not
+changed since: a full load reads them and a catch-up rightly skips them.
+
+Deleted ratings are not visible to a catch-up, so the shared snapshot is
+reloaded in full every RECOMMENDER_SNAPSHOT_FULL_RELOAD seconds.
+"""
+
+FIELDS = ('id', 'user_id', 'movie_id', 'rating', 'is_skipped')
+
+# Null ratings are stored as this value in the int8 ratings column
+NO_RATING = -1
+
+# Overlap between catch-ups, so rows committed late or saved on a skewed clock are not missed
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class RatingsSnapshot:
+    """
+    The Rating table as parallel arrays sorted by rating id:
+    ids (int64), user_ids and movie_ids (int32), ratings (int8, -1 for null)
+    and skipped (bool).
+    """
+
+    def __init__(self, ids=None, user_ids=None, movie_ids=None, ratings=None, skipped=None,
+                 last_id=0, synced_at=None):
+        self.ids = np.zeros(0, dtype=np.int64) if ids is None else ids
+        self.user_ids = np.zeros(0, dtype=np.int32) if user_ids is None else user_ids
+        self.movie_ids = np.zeros(0, dtype=np.int32) if movie_ids is None else movie_ids
+        self.ratings = np.zeros(0, dtype=np.int8) if ratings is None else ratings
+        self.skipped = np.zeros(0, dtype=bool) if skipped is None else skipped
+        self.last_id = last_id
+        self.synced_at = synced_at
+        self.loaded_at = time.monotonic()
+        self.version = 0
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def read(queryset, chunk_size=50000):
+        """
+        Stream rows of a Rating queryset into typed arrays, one chunk at a time.
+
+        Returns:
+        - dict mapping each of FIELDS to an array.
+        """
+        columns = {field: [] for field in FIELDS}
+        rows = queryset.values_list(*FIELDS).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), rows)]
+            if not chunk:
+                break
+            ids, user_ids, movie_ids, ratings, skipped = zip(*chunk)
+            columns['id'].append(np.array(ids, dtype=np.int64))
+            columns['user_id'].append(np.array(user_ids, dtype=np.int32))
+            columns['movie_id'].append(np.array(movie_ids, dtype=np.int32))
+            columns['rating'].append(np.array([NO_RATING if rating is None else rating for rating in ratings],
+                                              dtype=np.int8))
+            columns['is_skipped'].append(np.array(skipped, dtype=bool))
+
+        dtypes = {'id': np.int64, 'user_id': np.int32, 'movie_id': np.int32, 'rating': np.int8, 'is_skipped': bool}
+        return {field: np.concatenate(parts) if parts else np.zeros(0, dtype=dtypes[field])
+                for field, parts in columns.items()}
+
+    @classmethod
+    def from_database(cls, active_only=False, chunk_size=50000):
+        """
+        Load a new snapshot of the whole Rating table.
+
+        Arguments:
+        - active_only: Only load non-skipped, non-null ratings. Such a snapshot
+          is meant for one-off use and must not be caught up.
+        - chunk_size: Number of rows fetched per round trip.
+        """
+        synced_at = timezone.now()
+        queryset = Rating.objects.order_by('id')
+        if active_only:
+            queryset = queryset.filter(is_skipped=False, rating__isnull=False)
+        columns = cls.read(queryset, chunk_size)
+        return cls(columns['id'], columns['user_id'], columns['movie_id'], columns['rating'], columns['is_skipped'],
+                   last_id=int(columns['id'][-1]) if len(columns['id']) else 0, synced_at=synced_at)
+
+    def catch_up(self, chunk_size=50000):
+        """
+        Apply the rows created or updated since the previous sync.
+
+        Returns:
+        - Number of rows read.
+        """
+        synced_at = timezone.now()
+        changed = Q(id__gt=self.last_id)
+        if self.synced_at is not None:
+            changed |= Q(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+        columns = self.read(Rating.objects.filter(changed).order_by('id'), chunk_size)
+        self.synced_at = synced_at
+        if not len(columns['id']):
+            return 0
+
+        positions = np.searchsorted(self.ids, columns['id'])
+        known = positions < len(self.ids)
+        known[known] = self.ids[positions[known]] == columns['id'][known]
+
+        # Rows already in the snapshot are overwritten in place
+        for array, field in ((self.user_ids, 'user_id'), (self.movie_ids, 'movie_id'),
+                             (self.ratings, 'rating'), (self.skipped, 'is_skipped')):
+            array[positions[known]] = columns[field][known]
+
+        # New rows are appended, keeping the arrays sorted by id
+        new = ~known
+        if new.any():
+            ids = np.concatenate([self.ids, columns['id'][new]])
+            order = np.argsort(ids, kind='stable')
+            self.ids = ids[order]
+            self.user_ids = np.concatenate([self.user_ids, columns['user_id'][new]])[order]
+            self.movie_ids = np.concatenate([self.movie_ids, columns['movie_id'][new]])[order]
+            self.ratings = np.concatenate([self.ratings, columns['rating'][new]])[order]
+            self.skipped = np.concatenate([self.skipped, columns['is_skipped'][new]])[order]
+            self.last_id = max(self.last_id, int(self.ids[-1]))
+
+        self.version += 1
+        self._matrix = None
+        return len(columns['id'])
+
+    def matrix(self):
+        """
+        Return the UserItemMatrix of the active (non-skipped, non-null) ratings.
+        The matrix is cached until the snapshot changes.
+        """
+        if self._matrix is None:
+            active = ~self.skipped & (self.ratings != NO_RATING)
+            self._matrix = UserItemMatrix.from_arrays(self.user_ids[active], self.movie_ids[active],
+                                                      self.ratings[active])
+        return self._matrix
+
+    def save(self, path):
+        """
+        Persist the snapshot as a compressed .npz file, written atomically.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary_path = f'{path}.tmp.npz'
+        np.savez_compressed(temporary_path, ids=self.ids, user_ids=self.user_ids, movie_ids=self.movie_ids,
+                            ratings=self.ratings, skipped=self.skipped, last_id=self.last_id,
+                            synced_at=self.synced_at.timestamp() if self.synced_at else np.nan)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            synced_at = float(data['synced_at'])
+            return cls(data['ids'], data['user_ids'], data['movie_ids'], data['ratings'], data['skipped'],
+                       last_id=int(data['last_id']),
+                       synced_at=None if np.isnan(synced_at) else datetime.fromtimestamp(synced_at, dt_timezone.utc))
+
+
+_shared_snapshot = None
+_lock = threading.Lock()
+
+
+def get_ratings_snapshot():
+    """
+    Return the process-wide snapshot, caught up with the database.
+    It starts from RECOMMENDER_SNAPSHOT_PATH when that .npz file exists, and is
+    reloaded in full (and persisted again) once RECOMMENDER_SNAPSHOT_FULL_RELOAD
+    seconds have passed or the table shrank below the last id seen.
+    """
+    global _shared_snapshot
+    path = getattr(settings, 'RECOMMENDER_SNAPSHOT_PATH', None)
+    max_age = getattr(settings, 'RECOMMENDER_SNAPSHOT_FULL_RELOAD', 60 * 60)
+
+    with _lock:
+        if _shared_snapshot is None and path and os.path.exists(path):
+            _shared_snapshot = RatingsSnapshot.load(path)
+
+        stale = _shared_snapshot is None or time.monotonic() - _shared_snapshot.loaded_at > max_age
+        # Checked on the primary: a lagging replica would look like a shrunk table
+        primary = Rating.objects.using(DEFAULT_DB_ALIAS)
+        if not stale and (primary.aggregate(last=Max('id'))['last'] or 0) < _shared_snapshot.last_id:
+            stale = True
+
+        with timed('load_ratings'):
+            if stale:
+                _shared_snapshot = RatingsSnapshot.from_database()
+                if path:
+                    _shared_snapshot.save(path)
+            else:
+                _shared_snapshot.catch_up()
+        # Built while holding the lock, so no reader caches a matrix of a half-applied catch-up
+        with timed('pivot'):
+            _shared_snapshot.matrix()
+        return _shared_snapshot
+
+
+def reset_ratings_snapshot():
+    """
+    Forget the process-wide snapshot so the next reader loads it again.
+    """
+    global _shared_snapshot
+    with _lock:
+        _shared_snapshot = None
+
+
+def load_ratings_matrix():
+    """
+    Return the UserItemMatrix of the current active ratings, from the shared
+    snapshot when RECOMMENDER_RATINGS_SNAPSHOT is enabled and from a one-off
+    streamed load otherwise.
+    """
+    if getattr(settings, 'RECOMMENDER_RATINGS_SNAPSHOT', False):
+        return get_ratings_snapshot().matrix()
+    with timed('load_ratings'):
+        snapshot = RatingsSnapshot.from_database(active_only=True)
+    with timed('pivot'):
+        return snapshot.matrix()
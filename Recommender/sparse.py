@@ -0,0 +1,196 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .metrics import timed
+
+"""
+Sparse user-item matrix engine for the Recommender app.
+Ratings are held in a compressed (CSR) matrix built straight from
+(user_id, movie_id, rating) triples, so memory grows with the number of
+ratings instead of users x movies.
+"""
+
+
+def select_top_n(scores, top_n=None):
+    """
+    Return the positions of the top_n highest scores, best first.
+    Uses a partial selection so only the kept scores are fully sorted.
+    All positions are returned, sorted, when top_n is None.
+    """
+    positions = np.arange(len(scores))
+    if top_n is not None and top_n < len(scores):
+        if top_n <= 0:
+            return positions[:0]
+        positions = np.argpartition(-scores, top_n - 1)[:top_n]
+    return positions[np.argsort(-scores[positions], kind='stable')]
+
+
+class UserItemMatrix:
+    """
+    A CSR user-item rating matrix together with the lookups needed to
+    translate between database ids and matrix positions.
+
+    Rows are users and columns are movies, both sorted by id. Explicit zero
+    ratings are kept in the sparsity structure so a stored 0 still counts as
+    "rated", exactly like a non-null cell in the old dense pivot.
+    """
+
+    def __init__(self, matrix, user_ids, movie_ids):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+
+    @classmethod
+    def from_triples(cls, triples):
+        """
+        Build the matrix from an iterable of (user_id, movie_id, rating) triples.
+        When a (user, movie) pair occurs more than once the last triple wins,
+        matching the keep='last' de-duplication of the dense pivot.
+
+        Arguments:
+        - triples: Iterable of (user_id, movie_id, rating), oldest first.
+        """
+        data = np.array(list(triples), dtype=np.float64).reshape(-1, 3)
+        return cls.from_arrays(data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2])
+
+    @classmethod
+    def from_arrays(cls, users, movies, ratings):
+        """
+        Build the matrix from parallel arrays of user ids, movie ids and ratings.
+        """
+        user_ids, rows = np.unique(users, return_inverse=True)
+        movie_ids, cols = np.unique(movies, return_inverse=True)
+
+        # Keep only the last occurrence of every (user, movie) pair
+        keys = rows.astype(np.int64) * len(movie_ids) + cols
+        _, last_from_end = np.unique(keys[::-1], return_index=True)
+        keep = len(keys) - 1 - last_from_end
+
+        matrix = sparse.csr_matrix(
+            (np.asarray(ratings, dtype=np.float64)[keep], (rows[keep], cols[keep])),
+            shape=(len(user_ids), len(movie_ids)),
+        )
+        return cls(matrix, user_ids, movie_ids)
+
+    def __contains__(self, user_id):
+        return self.user_position(user_id) is not None
+
+    def user_position(self, user_id):
+        """
+        Return the row of the given user id, or None if the user has no ratings.
+        """
+        position = np.searchsorted(self.user_ids, user_id)
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return int(position)
+        return None
+
+    def align_users(self, values):
+        """
+        Turn a {user_id: value} mapping into an array aligned with self.user_ids.
+        Users missing from the mapping get 0.
+        """
+        aligned = np.zeros(len(self.user_ids))
+        for user_id, value in values.items():
+            position = self.user_position(user_id)
+            if position is not None:
+                aligned[position] = value
+        return aligned
+
+    def similarity_row(self, user_id, others=None):
+        """
+        Compute the cosine similarity between one user and every user in the matrix.
+        Only the target user's row is computed, never the full users x users matrix.
+        Users with an all-zero rating vector get a similarity of 0, as in scikit-learn.
+
+        Arguments:
+        - user_id: The id of the target user.
+        - others: Optional sparse matrix of rating rows to compare against
+          instead of the whole matrix.
+
+        Returns:
+        - numpy array of similarities, aligned with the rows compared against.
+        """
+        if others is None:
+            others = self.matrix
+        target = self.matrix[self.user_position(user_id)]
+        dots = (others @ target.T).toarray().ravel()
+        norms = np.sqrt(np.asarray(others.multiply(others).sum(axis=1)).ravel())
+        denominators = norms * np.sqrt(target.multiply(target).sum())
+        return np.divide(dots, denominators, out=np.zeros_like(dots), where=denominators > 0)
+
+    def movie_columns(self, movie_ids):
+        """
+        Return the sorted column positions of the given movie ids, leaving out movies without ratings.
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        known = positions < len(self.movie_ids)
+        known[known] = self.movie_ids[positions[known]] == movie_ids[known]
+        return np.unique(positions[known])
+
+    def by_movie(self):
+        """
+        Return the matrix transposed to movie rows (CSR), built once per matrix.
+        """
+        if getattr(self, '_by_movie', None) is None:
+            self._by_movie = self.matrix.T.tocsr()
+        return self._by_movie
+
+    def unrated_columns(self, user_id, columns=None):
+        """
+        Return the column positions of the movies the user has not rated,
+        out of the given sorted columns or out of every column.
+        """
+        row = self.user_position(user_id)
+        rated = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+        if columns is None:
+            columns = np.arange(len(self.movie_ids))
+        return np.setdiff1d(columns, rated, assume_unique=True)
+
+    def predict(self, user_id, top_n=None, similarities=None, neighbours=None, candidates=None):
+        """
+        Predict the user's rating for every movie they have not rated yet.
+        The prediction for a movie is the mean of the other users' ratings of
+        that movie, each weighted by their similarity to the target user.
+        All candidates are scored with a single sparse matrix-vector product.
+
+        Arguments:
+        - user_id: The id of the user to score.
+        - top_n: If given, only the top_n predictions are kept, selected with
+          a partial sort instead of sorting every candidate.
+        - similarities: Precomputed similarity row aligned with self.user_ids.
+          Computed from the matrix when omitted.
+        - neighbours: If given, only these user rows contribute to the
+          predictions, e.g. the nearest users found by Recommender.ann, and
+          only their similarities are computed.
+        - candidates: If given, only these movie ids are scored, e.g. the
+          movies of one genre. Only their rating columns are multiplied, so the
+          scoring cost follows the candidates' ratings rather than the catalog's.
+
+        Returns:
+        - DataFrame with 'movie_id' and 'predicted_rating' columns, best first.
+        """
+        raters = self.matrix if neighbours is None else self.matrix[neighbours]
+        with timed('similarity'):
+            if similarities is None:
+                similarities = self.similarity_row(user_id, raters)
+            elif neighbours is not None:
+                similarities = similarities[neighbours]
+
+        with timed('scoring'):
+            if candidates is None:
+                weighted_sums = raters.T @ similarities
+                rater_counts = np.bincount(raters.indices, minlength=len(self.movie_ids))
+                columns = self.unrated_columns(user_id)
+                weighted_sums, rater_counts = weighted_sums[columns], rater_counts[columns]
+            else:
+                columns = self.unrated_columns(user_id, self.movie_columns(candidates))
+                by_movie = (self.by_movie() if neighbours is None else raters.T.tocsr())[columns]
+                weighted_sums, rater_counts = by_movie @ similarities, np.diff(by_movie.indptr)
+            rated = rater_counts > 0
+            columns = columns[rated]
+            scores = weighted_sums[rated] / rater_counts[rated]
+
+        with timed('top_n'):
+            best = select_top_n(scores, top_n)
+            return pd.DataFrame({'movie_id': self.movie_ids[columns[best]], 'predicted_rating': scores[best]})
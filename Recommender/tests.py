@@ -1,8 +1,59 @@
-from django.test import TestCase
+import json
+import os
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
+from datetime import timedelta
+import shutil
+import tempfile
+from io import StringIO
+import asyncio
+from asgiref.sync import async_to_sync
+from django.test import TestCase, TransactionTestCase, AsyncClient, override_settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.db.models import QuerySet
+from django.db.migrations.executor import MigrationExecutor
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
 from .models import Movie, Rating, Recommendation
-from .utils import fetch_next_recommendation, build_movie_data, refresh_recommendation
+from .utils import fetch_next_recommendation, build_movie_data, refresh_recommendation, fetch_genre_payload
+from .sparse import UserItemMatrix
+from . import similarity
+from .item_index import ItemIndex, get_item_index
+from .ann import UserLSHIndex
+from .precompute import precompute, load_snapshot, new_run, write_checkpoint
+from .queues import get_recommendation_queue
+from . import prefetch
+from .popularity import get_popular_movie_ids, invalidate_popular_movies
+from .snapshot import RatingsSnapshot, get_ratings_snapshot, reset_ratings_snapshot
+from .history import previous_rating, next_rating, encode_cursor
+from .benchmarks import synthetic_ratings, populate, run_benchmarks
+from .metrics import Histogram, STAGE_SECONDS, REQUEST_QUERIES, reset_metrics
+from .ingest import clean_rating
+from .factorization import FactorModel, get_factor_model
+from .engines import Engine, UserEngine, get_engine
+from .evaluation import run_evaluation
+from .content_index import ContentIndex, get_content_index
+from .genres import get_genre_movie_ids, get_genres, build_genre_index, genre_key, genres_key, GENRE_VERSION_KEY
+from .payloads import MoviePayload, get_movie_payload, clear_payload_lru
+from .ingest import upsert_movies, upsert_ratings
+from .routers import read_replica, note_rating_writes, wrote_recently
+from .checks import check_read_your_writes_cache, check_movie_payload_cache, check_genre_cache, check_queue_cache
+from .artifacts import publish, current_version
+from .worker import RetrainingWorker, get_worker_status, write_worker_status
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import cosine_similarity
 
 """
 This module contains the test suite for the Movie Recommender application. It includes tests for models, views, 
@@ -13,6 +64,11 @@ and utility functions to ensure that the system behaves as expected.
 - Utility functions are tested for correctness in a variety of scenarios.
 """
 
+LOCMEM_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+DATABASE_CACHE = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'recommender_cache'}
+# Both aliases in process memory, for tests that count queries
+LOCMEM_CACHES = {'default': LOCMEM_CACHE, 'shared': LOCMEM_CACHE}
+
 
 class MovieModelTest(TestCase):
     """Test case for the Movie model."""
@@ -97,6 +153,14 @@ class RecommendationModelTest(TestCase):
         for movie_id in rated_movies:
             self.assertNotIn(movie_id, recommendations['movie_id'])
 
+    def test_get_predictions_top_n(self):
+        """Ensure the number of recommendations can be configured."""
+        movie3 = Movie.objects.create(title='Tenet', overview='Time runs backwards', genre='Science Fiction')
+        Rating.objects.create(user=self.user1, movie=movie3, rating=3)
+        self.assertEqual(len(Recommendation.get_predictions(self.user2, top_n=1)), 1)
+        with self.settings(RECOMMENDER_TOP_N=2):
+            self.assertEqual(len(Recommendation.get_predictions(self.user2)), 2)
+
 
 class MovieRecommendationsViewTest(TestCase):
     """Test case for the movie recommendations view."""
@@ -206,4 +270,1616 @@ class UtilityFunctionTests(TestCase):
         data = build_movie_data(self.movie1)
         self.assertEqual(data['recommended_movie']['title'], 'Movie 1')
         self.assertEqual(data['recommended_movie']['overview'], 'Overview 1')
-        self.assertEqual(data['recommended_movie']['poster_url'], 'URL 1')
\ No newline at end of file
+        self.assertEqual(data['recommended_movie']['poster_url'], 'URL 1')
+
+
+class UserItemMatrixTests(TestCase):
+    """Test case for the sparse user-item matrix engine."""
+
+    def test_matches_dense_pivot(self):
+        """Ensure the sparse engine predicts the same ratings as the dense pandas pivot."""
+        rng = np.random.default_rng(7)
+        users = rng.integers(1, 30, size=300)
+        movies = rng.integers(1, 40, size=300)
+        ratings = rng.integers(0, 6, size=300)
+        matrix = UserItemMatrix.from_arrays(users, movies, ratings)
+
+        ratings_df = pd.DataFrame({'user_id': users, 'movie_id': movies, 'rating': ratings})
+        ratings_df = ratings_df.drop_duplicates(subset=['user_id', 'movie_id'], keep='last')
+        dense = ratings_df.pivot(index='user_id', columns='movie_id', values='rating')
+        sim_df = pd.DataFrame(cosine_similarity(dense.fillna(0)), index=dense.index, columns=dense.index)
+
+        user_id = int(users[0])
+        predictions = matrix.predict(user_id).set_index('movie_id')['predicted_rating']
+        unrated = dense.loc[user_id][dense.loc[user_id].isnull()].index
+        self.assertEqual(sorted(predictions.index), sorted(unrated))
+        for movie_id in unrated:
+            others = dense[movie_id].dropna()
+            expected = np.mean([rating * sim_df[user_id][other] for other, rating in others.items()])
+            self.assertAlmostEqual(predictions[movie_id], expected)
+
+    def test_last_duplicate_wins_and_zero_counts_as_rated(self):
+        """Ensure duplicate pairs keep the latest rating and a stored 0 still excludes the movie."""
+        matrix = UserItemMatrix.from_triples([(1, 10, 2), (1, 10, 5), (1, 11, 0), (2, 12, 4)])
+        self.assertEqual(matrix.matrix[0, 0], 5)
+        self.assertEqual(list(matrix.movie_ids[matrix.unrated_columns(1)]), [12])
+        self.assertNotIn(3, matrix)
+
+    def test_top_n_partial_selection(self):
+        """Ensure the partially selected top N equals the head of the fully sorted predictions."""
+        rng = np.random.default_rng(11)
+        matrix = UserItemMatrix.from_arrays(rng.integers(1, 50, size=800), rng.integers(1, 120, size=800),
+                                            rng.integers(1, 6, size=800))
+        user_id = int(matrix.user_ids[0])
+        full = matrix.predict(user_id)
+        top = matrix.predict(user_id, top_n=5)
+        self.assertEqual(len(top), 5)
+        self.assertTrue(full['predicted_rating'].is_monotonic_decreasing)
+        np.testing.assert_allclose(top['predicted_rating'], full['predicted_rating'].head(5))
+        self.assertTrue(matrix.predict(user_id, top_n=0).empty)
+
+
+@override_settings(RECOMMENDER_SIMILARITY_STORE=True)
+class SimilarityStoreTests(TestCase):
+    """Test case for the incremental user similarity store."""
+
+    def setUp(self):
+        """Set up users and movies rated through single saves so the signals fire."""
+        self.users = [User.objects.create_user(username=f'store_user{i}', password='123') for i in range(4)]
+        self.movies = [Movie.objects.create(title=f'Store Movie {i}') for i in range(5)]
+        for i, user in enumerate(self.users):
+            for j, movie in enumerate(self.movies):
+                if (i + j) % 3:
+                    Rating.objects.create(user=user, movie=movie, rating=(i * j) % 5 + 1)
+
+    def assertStoreMatchesMatrix(self):
+        """Compare every stored similarity row with a recomputation from the ratings."""
+        ratings = Rating.objects.filter(is_skipped=False, rating__isnull=False).order_by('id')
+        matrix = UserItemMatrix.from_triples(ratings.values_list('user_id', 'movie_id', 'rating'))
+        for user in self.users:
+            if user.id not in matrix:
+                continue
+            expected = matrix.similarity_row(user.id)
+            stored = matrix.align_users(similarity.similarity_row(user.id))
+            stored[matrix.user_position(user.id)] = expected[matrix.user_position(user.id)]
+            np.testing.assert_allclose(stored, expected)
+
+    def test_store_follows_creates_updates_and_deletes(self):
+        """Ensure the stored similarities track every kind of single rating write."""
+        self.assertStoreMatchesMatrix()
+
+        rating = Rating.objects.filter(user=self.users[0]).first()
+        rating.rating = 1
+        rating.save()
+        self.assertStoreMatchesMatrix()
+
+        rating.is_skipped = True
+        rating.save()
+        self.assertStoreMatchesMatrix()
+
+        Rating.objects.filter(user=self.users[1]).first().delete()
+        self.assertStoreMatchesMatrix()
+
+    def test_rebuild_matches_incremental(self):
+        """Ensure a full rebuild produces the same similarities as incremental maintenance."""
+        before = similarity.similarity_row(self.users[0].id)
+        call_command('rebuild_similarities', stdout=StringIO())
+        after = similarity.similarity_row(self.users[0].id)
+        self.assertEqual(before.keys(), after.keys())
+        for user_id, value in before.items():
+            self.assertAlmostEqual(value, after[user_id])
+
+    def test_get_predictions_reads_store(self):
+        """Ensure predictions from the stored similarities equal the recomputed ones."""
+        from_store = Recommendation.get_predictions(self.users[2])
+        with self.settings(RECOMMENDER_SIMILARITY_STORE=False):
+            recomputed = Recommendation.get_predictions(self.users[2])
+        self.assertEqual(list(from_store['movie_id']), list(recomputed['movie_id']))
+        np.testing.assert_allclose(from_store['predicted_rating'], recomputed['predicted_rating'])
+
+
+class ItemIndexTests(TestCase):
+    """Test case for the precomputed item-item index and the item-based mode."""
+
+    def setUp(self):
+        """Set up ratings and a temporary directory for the index artifact."""
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+        self.users = [User.objects.create_user(username=f'item_user{i}', password='123') for i in range(4)]
+        self.movies = [Movie.objects.create(title=f'Item Movie {i}') for i in range(5)]
+        for i, user in enumerate(self.users):
+            for j, movie in enumerate(self.movies):
+                if (i + j) % 3:
+                    Rating.objects.create(user=user, movie=movie, rating=(i + 2 * j) % 5 + 1)
+
+    def test_neighbours_match_brute_force(self):
+        """Ensure each movie keeps its most similar other movies."""
+        rng = np.random.default_rng(3)
+        matrix = UserItemMatrix.from_arrays(rng.integers(1, 40, size=500), rng.integers(1, 30, size=500),
+                                            rng.integers(1, 6, size=500))
+        index = ItemIndex.build(matrix, k=4, chunk_size=7)
+        dense = cosine_similarity(matrix.matrix.T.toarray())
+        np.fill_diagonal(dense, 0)
+        for row in range(len(index.movie_ids)):
+            np.testing.assert_allclose(index.similarities[row], np.sort(dense[row])[::-1][:4], rtol=1e-5)
+
+    def test_item_mode_scores_from_index(self):
+        """Ensure item-based predictions come from the built index and skip rated movies."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.index_dir, RECOMMENDER_MODE='item'):
+            user = User.objects.create_user(username='item_target', password='123')
+            Rating.objects.create(user=user, movie=self.movies[0], rating=5)
+            call_command('build_item_index', '--neighbours', '2', stdout=StringIO())
+
+            predictions = Recommendation.get_predictions(user)
+            self.assertFalse(predictions.empty)
+            self.assertNotIn(self.movies[0].id, list(predictions['movie_id']))
+            neighbours = get_item_index().neighbours[0]
+            self.assertEqual(set(predictions['movie_id']),
+                             set(get_item_index().movie_ids[neighbours[neighbours >= 0]]))
+
+    def test_item_mode_falls_back_without_index(self):
+        """Ensure the item mode uses the user-based method until an index is built."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.index_dir):
+            item_based = Recommendation.get_predictions(self.users[1], mode='item')
+        user_based = Recommendation.get_predictions(self.users[1], mode='user')
+        self.assertEqual(list(item_based['movie_id']), list(user_based['movie_id']))
+
+
+class UserLSHIndexTests(TestCase):
+    """Test case for the approximate nearest-neighbour lookup of similar users."""
+
+    def setUp(self):
+        """Set up a random rating matrix."""
+        rng = np.random.default_rng(5)
+        self.matrix = UserItemMatrix.from_arrays(rng.integers(1, 200, size=3000), rng.integers(1, 60, size=3000),
+                                                 rng.integers(1, 6, size=3000))
+
+    def test_query_returns_exact_neighbours_when_buckets_cover_everyone(self):
+        """Ensure re-ranking returns the exact top k once every user is a candidate."""
+        index = UserLSHIndex(self.matrix, n_tables=4, n_bits=1)
+        user_id = int(self.matrix.user_ids[0])
+        found, found_similarities = index.query(self.matrix.matrix[0], 10, exclude=user_id, probes=1)
+
+        similarities = self.matrix.similarity_row(user_id)
+        similarities[0] = 0
+        np.testing.assert_allclose(found_similarities, np.sort(similarities)[::-1][:10])
+        self.assertNotIn(user_id, found)
+
+    def test_more_tables_do_not_lower_recall(self):
+        """Ensure adding tables only ever adds candidates."""
+        vector = self.matrix.matrix[3]
+        few = set(UserLSHIndex(self.matrix, n_tables=2, n_bits=8).candidates(vector))
+        many = set(UserLSHIndex(self.matrix, n_tables=6, n_bits=8).candidates(vector))
+        self.assertTrue(few <= many)
+
+    def test_predict_from_neighbours_only(self):
+        """Ensure restricting the raters to neighbours only uses their ratings."""
+        user_id = int(self.matrix.user_ids[0])
+        everyone = self.matrix.predict(user_id, neighbours=np.arange(len(self.matrix.user_ids)))
+        np.testing.assert_allclose(everyone['predicted_rating'], self.matrix.predict(user_id)['predicted_rating'])
+
+        neighbours = [1, 2]
+        predictions = self.matrix.predict(user_id, neighbours=neighbours)
+        rated_by_neighbours = set(self.matrix.movie_ids[self.matrix.matrix[neighbours].indices])
+        self.assertTrue(set(predictions['movie_id']) <= rated_by_neighbours)
+
+    def test_get_predictions_with_ann(self):
+        """Ensure get_predictions aggregates the approximate neighbours when enabled."""
+        users = [User.objects.create_user(username=f'ann_user{i}', password='123') for i in range(3)]
+        movies = [Movie.objects.create(title=f'ANN Movie {i}') for i in range(3)]
+        Rating.objects.create(user=users[0], movie=movies[0], rating=5)
+        Rating.objects.create(user=users[1], movie=movies[0], rating=5)
+        Rating.objects.create(user=users[1], movie=movies[1], rating=4)
+        Rating.objects.create(user=users[2], movie=movies[2], rating=4)
+        with self.settings(RECOMMENDER_ANN_NEIGHBOURS=1, RECOMMENDER_ANN_BITS=1):
+            predictions = Recommendation.get_predictions(users[0])
+        self.assertEqual(list(predictions['movie_id']), [movies[1].id])
+
+
+class PrecomputeRecommendationsTests(TestCase):
+    """Test case for the sharded precompute_recommendations command."""
+
+    def setUp(self):
+        """Set up ratings for several users, one of them cold-start, and a checkpoint path."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.checkpoint = os.path.join(directory, 'checkpoint.json')
+        self.users = [User.objects.create_user(username=f'pre_user{i}', password='123') for i in range(6)]
+        self.movies = [Movie.objects.create(title=f'Pre Movie {i}') for i in range(6)]
+        for i, user in enumerate(self.users[:-1]):
+            for j, movie in enumerate(self.movies):
+                if (i + j) % 3:
+                    Rating.objects.create(user=user, movie=movie, rating=(i + j) % 5 + 1)
+
+    def stored(self, user):
+        return list(Recommendation.objects.filter(user=user).order_by('-score', 'id').values_list('movie_id', flat=True))
+
+    def test_matches_get_predictions(self):
+        """Ensure precomputed recommendations equal the ones computed on request."""
+        call_command('precompute_recommendations', '--shards', '3', '--workers', '2',
+                     '--checkpoint', self.checkpoint, stdout=StringIO())
+        for user in self.users[:-1]:
+            expected = Recommendation.get_predictions(user)
+            self.assertEqual(self.stored(user), list(expected['movie_id']))
+        cold_start = Recommendation.get_predictions(self.users[-1])
+        self.assertEqual(sorted(self.stored(self.users[-1])), sorted(cold_start['movie_id']))
+
+    def test_matches_get_predictions_of_engine(self):
+        """Ensure precompute scores with the RECOMMENDER_MODE engine and its artifacts."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        Rating.objects.create(user=self.users[0], movie=self.movies[0], is_skipped=True)
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=os.path.join(directory, 'item'),
+                           RECOMMENDER_FACTORS_DIR=os.path.join(directory, 'factors')):
+            call_command('build_item_index', '--neighbours', '3', stdout=StringIO())
+            call_command('train_factors', '--factors', '2', stdout=StringIO())
+            for mode in ('item', 'factors'):
+                with self.settings(RECOMMENDER_MODE=mode):
+                    precompute([user.id for user in self.users], 2, 1, 10, self.checkpoint)
+                    for user in self.users[:-1]:
+                        expected = Recommendation.get_predictions(user)
+                        self.assertEqual(self.stored(user), list(expected['movie_id']), mode)
+
+    def test_matches_get_predictions_with_content_index(self):
+        """Ensure precompute blends in the published content index like get_predictions."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for i, movie in enumerate(self.movies):
+            movie.overview = f'A story about topic{i % 2}'
+            movie.save()
+        unrated = Movie.objects.create(title='Pre Unrated', overview='Another story about topic0')
+        Rating.objects.create(user=self.users[1], movie=self.movies[2], is_skipped=True)
+        with self.settings(RECOMMENDER_CONTENT_INDEX_DIR=directory):
+            call_command('build_content_index', stdout=StringIO())
+            precompute([user.id for user in self.users], 2, 1, 10, self.checkpoint)
+            for user in self.users[:-1]:
+                expected = Recommendation.get_predictions(user)
+                self.assertEqual(self.stored(user), list(expected['movie_id']))
+        self.assertIn(unrated.id, self.stored(self.users[0]))
+
+    def test_rejects_engine_without_snapshot_scoring(self):
+        """Ensure an engine that cannot score a snapshot fails the command instead of being replaced."""
+        engines = {'user': 'Recommender.engines.UserEngine', 'fixed': 'Recommender.tests.FixedEngine'}
+        with self.settings(RECOMMENDER_ENGINES=engines, RECOMMENDER_MODE='fixed'):
+            with self.assertRaisesMessage(CommandError, 'The fixed engine cannot score a ratings snapshot'):
+                call_command('precompute_recommendations', '--checkpoint', self.checkpoint, stdout=StringIO())
+        self.assertFalse(Recommendation.objects.exists())
+
+    def test_resume_skips_finished_shards(self):
+        """Ensure a resumed run leaves shards recorded in the checkpoint alone."""
+        user_ids = sorted(user.id for user in self.users)
+        write_checkpoint(self.checkpoint, new_run(user_ids, 2, 0), {0})
+        precompute(user_ids, 2, 1, 10, self.checkpoint, resume=True)
+
+        self.assertFalse(Recommendation.objects.filter(user_id__in=user_ids[:3]).exists())
+        self.assertTrue(Recommendation.objects.filter(user_id__in=user_ids[3:]).exists())
+
+    def test_resume_after_new_ratings_and_users(self):
+        """Ensure an interrupted run resumes with its own sharding after ratings and users were added."""
+        user_ids = sorted(user.id for user in self.users)
+        run = new_run(user_ids, 2, load_snapshot()['last_rating_id'])
+        write_checkpoint(self.checkpoint, run, {0})
+
+        newcomer = User.objects.create_user(username='pre_newcomer', password='123')
+        Rating.objects.create(user=newcomer, movie=self.movies[0], rating=5)
+        written = precompute(user_ids + [newcomer.id], 2, 1, 10, self.checkpoint, resume=True)
+
+        self.assertEqual(written, 1)
+        self.assertFalse(Recommendation.objects.filter(user_id__in=user_ids[:3]).exists())
+        self.assertTrue(Recommendation.objects.filter(user=newcomer).exists())
+        with open(self.checkpoint) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        self.assertEqual((checkpoint['run_id'], checkpoint['finished']), (run['run_id'], [0, 1]))
+
+        # Without --resume, a new run starts over
+        self.assertEqual(precompute(user_ids, 2, 1, 10, self.checkpoint), 2)
+
+
+@override_settings(RECOMMENDER_QUEUE_BACKEND='Recommender.queues.CacheQueue',
+                   CACHES=LOCMEM_CACHES)
+class CacheQueueTests(TestCase):
+    """Test case for the cache-backed recommendation queue."""
+
+    def setUp(self):
+        """Set up a user, movies and an empty cache."""
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='queue_user', password='123')
+        self.movies = [Movie.objects.create(title=f'Queue Movie {i}') for i in range(3)]
+        self.predictions = pd.DataFrame({'movie_id': [movie.id for movie in self.movies],
+                                         'predicted_rating': [0.9, 0.5, 0.1]})
+
+    def test_pop_does_not_touch_the_database(self):
+        """Ensure cached pops return the ranked movies without any query."""
+        queue = get_recommendation_queue()
+        queue.push(self.user, self.predictions)
+        self.assertEqual(Recommendation.objects.filter(user=self.user).count(), 3)
+        with self.assertNumQueries(0):
+            popped = [queue.pop(self.user) for _ in range(4)]
+        self.assertEqual(popped, [movie.id for movie in self.movies] + [None])
+
+    def test_database_fallback_after_cache_miss(self):
+        """Ensure a lost cache entry is rebuilt from the durable table without movies already seen."""
+        queue = get_recommendation_queue()
+        queue.push(self.user, self.predictions)
+        self.assertEqual(queue.pop(self.user), self.movies[0].id)
+        Rating.objects.create(user=self.user, movie=self.movies[0], rating=4)
+
+        caches['default'].clear()
+        self.assertEqual(queue.pop(self.user), self.movies[1].id)
+        self.assertEqual(queue.pop(self.user), self.movies[2].id)
+
+    def test_non_atomic_cache_is_refused(self):
+        """Ensure a cache whose incr() is not atomic is refused by the queue and reported by the checks."""
+        self.assertEqual([warning.id for warning in check_queue_cache(None)], ['Recommender.W003'])
+        with self.settings(CACHES={'default': DATABASE_CACHE}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_recommendation_queue()
+            self.assertEqual([error.id for error in check_queue_cache(None)], ['Recommender.E002'])
+        with self.settings(RECOMMENDER_QUEUE_BACKEND='Recommender.queues.DatabaseQueue'):
+            self.assertEqual(check_queue_cache(None), [])
+
+    def test_fetch_next_recommendation_uses_cache(self):
+        """Ensure fetch_next_recommendation serves the cached queue in rank order."""
+        get_recommendation_queue().push(self.user, self.predictions)
+        data = fetch_next_recommendation(self.user)
+        self.assertEqual(data['recommended_movie']['title'], 'Queue Movie 0')
+        data = fetch_next_recommendation(self.user)
+        self.assertEqual(data['recommended_movie']['title'], 'Queue Movie 1')
+
+    def test_invalidate(self):
+        """Ensure invalidated users are served from the Recommendation table again."""
+        queue = get_recommendation_queue()
+        queue.push(self.user, self.predictions)
+        Recommendation.objects.filter(user=self.user, movie=self.movies[0]).delete()
+        queue.invalidate([self.user.id])
+        self.assertEqual(queue.pop(self.user), self.movies[1].id)
+
+
+class PrefetchTests(TestCase):
+    """Test case for the low-watermark background prefetcher."""
+
+    def setUp(self):
+        """Set up a user with three queued recommendations."""
+        self.user = User.objects.create_user(username='prefetch_user', password='123')
+        self.movies = [Movie.objects.create(title=f'Prefetch Movie {i}') for i in range(3)]
+        for score, movie in zip([0.9, 0.5, 0.1], self.movies):
+            Recommendation.objects.create(user=self.user, movie=movie, score=score)
+
+    @override_settings(RECOMMENDER_PREFETCH_THRESHOLD=2, RECOMMENDER_PREFETCH_WORKERS=0)
+    def test_refresh_scheduled_below_watermark(self):
+        """Ensure a refresh is only scheduled once the queue drops below the threshold."""
+        with mock.patch('Recommender.utils.refresh_recommendation') as refresh:
+            fetch_next_recommendation(self.user)
+            refresh.assert_not_called()
+            fetch_next_recommendation(self.user)
+            refresh.assert_called_once_with(self.user)
+
+    @override_settings(RECOMMENDER_PREFETCH_THRESHOLD=3, RECOMMENDER_PREFETCH_WORKERS=0)
+    def test_rated_movies_are_not_shown_again(self):
+        """Ensure a movie queued again by a prefetch while it was on screen is not shown once rated."""
+        Recommendation.objects.filter(user=self.user).delete()
+        others = [User.objects.create_user(username=f'prefetch_other{i}', password='123') for i in range(2)]
+        movies = self.movies + [Movie.objects.create(title=f'Prefetch Extra {i}') for i in range(3)]
+        for i, other in enumerate(others):
+            for j, movie in enumerate(movies):
+                Rating.objects.create(user=other, movie=movie, rating=(i + j) % 5 + 1)
+        Rating.objects.create(user=self.user, movie=movies[0], rating=5)
+
+        shown = []
+        for _ in range(6):
+            data = fetch_next_recommendation(self.user)
+            if 'recommended_movie' not in data:
+                break
+            shown.append(data['recommended_movie']['id'])
+            Rating.objects.update_or_create(user=self.user, movie_id=shown[-1], defaults={'rating': 3})
+        # Every unrated movie once, and no movie again after it was rated
+        self.assertEqual(sorted(shown), sorted(movie.id for movie in movies[1:]))
+
+    def test_schedule_refresh_deduplicates_pending_users(self):
+        """Ensure a user only ever has one background refresh in flight."""
+        release = threading.Event()
+        with mock.patch('Recommender.prefetch.run_refresh', side_effect=lambda user_id: release.wait(5)):
+            first = prefetch.schedule_refresh(self.user)
+            self.assertIs(prefetch.schedule_refresh(self.user), first)
+            release.set()
+            first.result(5)
+        prefetch._pending.pop(self.user.id, None)
+
+    def test_empty_queue_waits_for_pending_refresh(self):
+        """Ensure an empty queue waits for the background refresh instead of computing another."""
+        Recommendation.objects.filter(user=self.user).delete()
+        future = Future()
+        future.set_result(None)
+        prefetch._pending[self.user.id] = future
+        try:
+            with mock.patch('Recommender.utils.refresh_recommendation') as refresh:
+                data = fetch_next_recommendation(self.user)
+            refresh.assert_not_called()
+            self.assertEqual(data, {'message': 'No more recommendations available'})
+        finally:
+            prefetch._pending.pop(self.user.id, None)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PopularityTests(TestCase):
+    """Test case for the shared, TTL-cached popularity list."""
+
+    def setUp(self):
+        """Set up liked movies and an empty cache."""
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.users = [User.objects.create_user(username=f'popular_user{i}', password='123') for i in range(3)]
+        self.movies = [Movie.objects.create(title=f'Popular Movie {i}') for i in range(3)]
+        for i, user in enumerate(self.users):
+            for movie in self.movies[:i + 1]:
+                Rating.objects.create(user=user, movie=movie, rating=5)
+
+    def test_ranking_is_cached(self):
+        """Ensure the aggregation runs once and later readers only hit the cache."""
+        self.assertEqual(get_popular_movie_ids(2), [self.movies[0].id, self.movies[1].id])
+        Rating.objects.create(user=self.users[0], movie=self.movies[2], rating=5)
+        Rating.objects.create(user=self.users[1], movie=self.movies[2], rating=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_popular_movie_ids(2), [self.movies[0].id, self.movies[1].id])
+
+        invalidate_popular_movies()
+        self.assertIn(self.movies[2].id, get_popular_movie_ids(2))
+
+    def test_expired_list_is_refreshed_once(self):
+        """Ensure an expired list is recomputed by one caller while others read the stale copy."""
+        with self.settings(RECOMMENDER_POPULAR_TTL=-1):
+            get_popular_movie_ids()
+        caches['default'].add('popular-movies-refreshing', True)
+        with self.assertNumQueries(0):
+            get_popular_movie_ids()
+        caches['default'].delete('popular-movies-refreshing')
+        with self.assertNumQueries(1):
+            get_popular_movie_ids()
+
+    def test_missing_list_is_computed_once(self):
+        """Ensure a missing list is computed by the lock holder while others wait for it or go on without it."""
+        caches['default'].add('popular-movies-refreshing', True)
+        with self.settings(RECOMMENDER_POPULAR_WAIT=0), self.assertNumQueries(0):
+            self.assertEqual(get_popular_movie_ids(), [])
+
+        def holder_finishes(seconds):
+            caches['default'].set('popular-movies', {'movie_ids': [self.movies[2].id], 'expires': time.time() + 60})
+
+        with mock.patch('Recommender.popularity.time.sleep', side_effect=holder_finishes), self.assertNumQueries(0):
+            self.assertEqual(get_popular_movie_ids(), [self.movies[2].id])
+
+    def test_cold_start_reads_popular_list(self):
+        """Ensure users without positive ratings get the cached popular movies."""
+        new_user = User.objects.create_user(username='popular_new', password='123')
+        predictions = Recommendation.get_predictions(new_user, top_n=2)
+        self.assertEqual(list(predictions['movie_id']), get_popular_movie_ids(2))
+
+    def test_deleting_a_movie_invalidates(self):
+        """Ensure a deleted movie never stays in the cached list."""
+        get_popular_movie_ids()
+        deleted_id = self.movies[0].id
+        self.movies[0].delete()
+        self.assertNotIn(deleted_id, get_popular_movie_ids())
+
+
+class RatingsSnapshotTests(TestCase):
+    """Test case for the incremental columnar ratings snapshot."""
+
+    def setUp(self):
+        """Set up a few ratings and a fresh shared snapshot."""
+        reset_ratings_snapshot()
+        self.addCleanup(reset_ratings_snapshot)
+        self.users = [User.objects.create_user(username=f'snap_user{i}', password='123') for i in range(3)]
+        self.movies = [Movie.objects.create(title=f'Snap Movie {i}') for i in range(3)]
+        self.ratings = [Rating.objects.create(user=user, movie=movie, rating=(i + j) % 5 + 1)
+                        for i, user in enumerate(self.users) for j, movie in enumerate(self.movies) if i != j]
+
+    def assertSnapshotMatchesDatabase(self, snapshot):
+        """Compare every column of the snapshot with the Rating table."""
+        rows = list(Rating.objects.order_by('id').values_list('id', 'user_id', 'movie_id', 'rating', 'is_skipped'))
+        self.assertEqual(list(snapshot.ids), [row[0] for row in rows])
+        self.assertEqual(list(snapshot.user_ids), [row[1] for row in rows])
+        self.assertEqual(list(snapshot.movie_ids), [row[2] for row in rows])
+        self.assertEqual(list(snapshot.ratings), [-1 if row[3] is None else row[3] for row in rows])
+        self.assertEqual(list(snapshot.skipped), [row[4] for row in rows])
+
+    def test_typed_columns(self):
+        """Ensure the snapshot uses compact column types."""
+        snapshot = RatingsSnapshot.from_database(chunk_size=2)
+        self.assertSnapshotMatchesDatabase(snapshot)
+        self.assertEqual(snapshot.user_ids.dtype, np.int32)
+        self.assertEqual(snapshot.movie_ids.dtype, np.int32)
+        self.assertEqual(snapshot.ratings.dtype, np.int8)
+
+    def test_catch_up_reads_only_changes(self):
+        """Ensure a catch-up applies new and updated rows and reads nothing when idle."""
+        Rating.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        snapshot = RatingsSnapshot.from_database()
+        self.ratings[0].rating = 1
+        self.ratings[0].save()
+        self.ratings[1].is_skipped = True
+        self.ratings[1].save()
+        Rating.objects.create(user=self.users[0], movie=self.movies[0], is_skipped=True)
+
+        self.assertEqual(snapshot.catch_up(), 3)
+        self.assertSnapshotMatchesDatabase(snapshot)
+
+        snapshot.synced_at = timezone.now() + timedelta(minutes=5)
+        self.assertEqual(snapshot.catch_up(), 0)
+
+    def test_save_and_load(self):
+        """Ensure a persisted snapshot loads back identically and can keep catching up."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'ratings.npz')
+        RatingsSnapshot.from_database().save(path)
+
+        snapshot = RatingsSnapshot.load(path)
+        self.assertSnapshotMatchesDatabase(snapshot)
+        Rating.objects.create(user=self.users[1], movie=self.movies[1], rating=2)
+        snapshot.catch_up()
+        self.assertSnapshotMatchesDatabase(snapshot)
+
+    def test_get_predictions_from_shared_snapshot(self):
+        """Ensure predictions from the shared snapshot follow new ratings and match a fresh load."""
+        with self.settings(RECOMMENDER_RATINGS_SNAPSHOT=True, RECOMMENDER_SNAPSHOT_PATH=None):
+            Recommendation.get_predictions(self.users[0])
+            Rating.objects.create(user=self.users[1], movie=self.movies[1], rating=5)
+            from_snapshot = Recommendation.get_predictions(self.users[0])
+        fresh = Recommendation.get_predictions(self.users[0])
+        self.assertEqual(list(from_snapshot['movie_id']), list(fresh['movie_id']))
+        np.testing.assert_allclose(from_snapshot['predicted_rating'], fresh['predicted_rating'])
+
+    def test_shrunk_table_triggers_full_reload(self):
+        """Ensure deleting the newest ratings makes the shared snapshot reload in full."""
+        with self.settings(RECOMMENDER_RATINGS_SNAPSHOT=True, RECOMMENDER_SNAPSHOT_PATH=None):
+            get_ratings_snapshot()
+            self.ratings[-1].delete()
+            self.assertSnapshotMatchesDatabase(get_ratings_snapshot())
+
+
+class RatingHistoryTests(TestCase):
+    """Test case for the back/next rating history cursor."""
+
+    def setUp(self):
+        """Set up a user who rated three movies and is logged in."""
+        self.user = User.objects.create_user(username='history_user', password='123')
+        self.client.login(username='history_user', password='123')
+        self.movies = [Movie.objects.create(title=f'History Movie {i}') for i in range(4)]
+        self.ratings = [Rating.objects.create(user=self.user, movie=movie, rating=4) for movie in self.movies[:3]]
+
+    def test_each_step_is_one_query(self):
+        """Ensure every navigation step, including loading its movie, runs a single query."""
+        with self.assertNumQueries(1):
+            previous = previous_rating(self.user, movie_id=self.movies[2].id)
+            self.assertEqual(previous.movie.title, 'History Movie 1')
+        with self.assertNumQueries(1):
+            previous = previous_rating(self.user, cursor=encode_cursor(previous))
+            self.assertEqual(previous.movie.title, 'History Movie 0')
+        with self.assertNumQueries(1):
+            following = next_rating(self.user, cursor=encode_cursor(previous))
+            self.assertEqual(following.movie.title, 'History Movie 1')
+        with self.assertNumQueries(1):
+            self.assertEqual(previous_rating(self.user, movie_id=self.movies[3].id), self.ratings[2])
+        with self.assertNumQueries(1):
+            self.assertIsNone(next_rating(self.user, movie_id=self.movies[3].id))
+
+    def test_view_round_trip_with_cursor(self):
+        """Ensure the view hands out cursors and follows them."""
+        response = self.client.get(reverse('get_recommendation'), {'action': 'back', 'movie_id': self.movies[3].id})
+        data = response.json()
+        self.assertEqual(data['recommended_movie']['title'], 'History Movie 2')
+
+        response = self.client.get(reverse('get_recommendation'), {'action': 'back', 'cursor': data['cursor']})
+        data = response.json()
+        self.assertEqual(data['recommended_movie']['title'], 'History Movie 1')
+
+        response = self.client.get(reverse('get_recommendation'), {'action': 'next', 'cursor': data['cursor']})
+        self.assertEqual(response.json()['recommended_movie']['title'], 'History Movie 2')
+
+    def test_tampered_cursor_is_rejected(self):
+        """Ensure a cursor that was not issued by the server is refused."""
+        response = self.client.get(reverse('get_recommendation'), {'action': 'back', 'cursor': '1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_rating_per_user_and_movie(self):
+        """Ensure the database refuses a second rating of the same movie by the same user."""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.create(user=self.user, movie=self.movies[0], rating=1)
+
+    @override_settings(RECOMMENDER_PREFETCH_WORKERS=0)
+    def test_racing_writes_do_not_fail(self):
+        """Ensure a rate or skip racing another write of the same movie updates the row instead of failing."""
+        real_get = QuerySet.get
+        raced = []
+
+        def racing_get(queryset, *args, **kwargs):
+            # The first lookup misses the row, as if a concurrent request had not committed yet
+            if queryset.model is Rating and not raced:
+                raced.append(True)
+                raise Rating.DoesNotExist
+            return real_get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', racing_get):
+            response = self.client.post(reverse('rate_movie'), content_type='application/json',
+                                        data={'movie_id': self.movies[0].id, 'user_id': self.user.id, 'rating': 2})
+        self.assertEqual(response.json(), {'status': 'success'})
+        self.assertEqual(Rating.objects.get(user=self.user, movie=self.movies[0]).rating, 2)
+
+        # The skip of a movie whose rating lands between the check and the write
+        Rating.objects.create(user=self.user, movie=self.movies[3], rating=5)
+        with mock.patch.object(QuerySet, 'aexists', mock.AsyncMock(return_value=False)):
+            response = self.client.get(reverse('get_recommendation'), {'action': 'next', 'movie_id': self.movies[3].id})
+        self.assertEqual(response.status_code, 200)
+        rating = Rating.objects.get(user=self.user, movie=self.movies[3])
+        self.assertEqual((rating.rating, rating.is_skipped), (5, False))
+
+
+class RatingMigrationTests(TransactionTestCase):
+    """Test case for the migration adding the one-rating-per-movie constraint to existing data."""
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_removed_before_the_constraint(self):
+        """Ensure only the newest of duplicate (user, movie) ratings survives the migration."""
+        before, after = [('Recommender', '0003_rating_updated_at')], [('Recommender', '0004_rating_unique_user_movie')]
+        executor = MigrationExecutor(connection)
+        executor.migrate(before)
+        apps = executor.loader.project_state(before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='duplicate_rater')
+        movies = [apps.get_model('Recommender', 'Movie').objects.create(title=f'Duplicate Movie {i}') for i in range(2)]
+        HistoricalRating = apps.get_model('Recommender', 'Rating')
+        for rating in (2, 5, 3):
+            HistoricalRating.objects.create(user=user, movie=movies[0], rating=rating)
+        HistoricalRating.objects.create(user=user, movie=movies[1], rating=4)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(after)
+        self.assertEqual(sorted(Rating.objects.filter(user_id=user.id).values_list('movie_id', 'rating')),
+                         [(movies[0].id, 3), (movies[1].id, 4)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.create(user_id=user.id, movie_id=movies[1].id, rating=1)
+
+
+class BenchmarkTests(TestCase):
+    """Test case for the synthetic-data benchmarks."""
+
+    def test_synthetic_ratings_are_seeded_and_unique(self):
+        """Ensure the generator is reproducible and never rates a movie twice for the same user."""
+        users, movies, ratings = synthetic_ratings(50, 40, 0.2, seed=3)
+        again = synthetic_ratings(50, 40, 0.2, seed=3)
+        for array, repeated in zip((users, movies, ratings), again):
+            np.testing.assert_array_equal(array, repeated)
+        self.assertEqual(len(set(zip(users, movies))), len(users))
+        self.assertTrue(((ratings >= 1) & (ratings <= 5)).all())
+
+    def test_run_benchmarks_reports_every_path(self):
+        """Ensure each hot path is measured for wall time, memory and queries."""
+        dataset = populate(30, 20, 0.3, seed=1)
+        self.assertEqual(Rating.objects.count(), dataset['ratings'])
+
+        report = run_benchmarks(samples=3, seed=1)
+        self.assertEqual(set(report), {'get_predictions', 'refresh_recommendation',
+                                       'fetch_next_recommendation', 'rate_movie'})
+        for measurement in report.values():
+            self.assertEqual(measurement['calls'], 3)
+            self.assertGreater(measurement['queries_max'], 0)
+            self.assertGreaterEqual(measurement['wall_ms_p95'], measurement['wall_ms_p50'])
+        self.assertEqual(Rating.objects.count(), dataset['ratings'] + 4)
+
+
+class MetricsTests(TestCase):
+    """Test case for the pipeline timers and the /metrics endpoint."""
+
+    def setUp(self):
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+        self.user = User.objects.create_user(username='metrics_user', password='12345')
+        self.other = User.objects.create_user(username='metrics_other', password='12345')
+        self.movies = [Movie.objects.create(title=f'Metrics Movie {i}') for i in range(3)]
+        Rating.objects.create(user=self.user, movie=self.movies[0], rating=5)
+        Rating.objects.create(user=self.other, movie=self.movies[0], rating=4)
+        Rating.objects.create(user=self.other, movie=self.movies[1], rating=3)
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """Ensure observations land in cumulative buckets with sum and count."""
+        histogram = Histogram('test_seconds', 'Test.', buckets=(0.1, 1), labelnames=('stage',))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(5, 'a')
+        text = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{stage="a",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_sum{stage="a"} 5.55', text)
+        self.assertIn('test_seconds_count{stage="a"} 3', text)
+
+    def test_refresh_records_each_stage(self):
+        """Ensure a refresh times every stage of the pipeline."""
+        refresh_recommendation(self.user)
+        text = STAGE_SECONDS.render()
+        for stage in ('load_ratings', 'pivot', 'similarity', 'scoring', 'top_n', 'persist'):
+            self.assertIn(f'recommender_stage_seconds_count{{stage="{stage}"}} 1', text)
+
+    @override_settings(RECOMMENDER_PREFETCH_WORKERS=0)
+    def test_requests_are_measured_and_exposed(self):
+        """Ensure the middleware records query counts per view and /metrics renders them."""
+        self.client.login(username='metrics_user', password='12345')
+        self.client.get(reverse('get_recommendation'))
+        self.assertIn('recommender_request_queries_count{view="get_recommendation"} 1', REQUEST_QUERIES.render())
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('recommender_stage_seconds_bucket{stage="top_n",le="+Inf"} 1', response.content.decode())
+
+    @override_settings(RECOMMENDER_METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Ensure a configured token is required to read /metrics."""
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class BulkRatingTests(TestCase):
+    """Test case for the bulk rating endpoint and the import_ratings command."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulk_user', password='12345')
+        self.other = User.objects.create_user(username='bulk_other', password='12345')
+        self.movies = [Movie.objects.create(title=f'Bulk Movie {i}') for i in range(4)]
+        Rating.objects.create(user=self.user, movie=self.movies[0], rating=1)
+        self.client.login(username='bulk_user', password='12345')
+
+    def post(self, body, content_type='application/json'):
+        return self.client.post(reverse('rate_movies'), data=body, content_type=content_type)
+
+    def test_json_array_is_upserted(self):
+        """Ensure existing ratings are updated and new ones created in one request."""
+        response = self.post(json.dumps([
+            {'movie_id': self.movies[0].id, 'rating': 5},
+            {'movie_id': self.movies[1].id, 'rating': 3},
+            {'movie_id': self.movies[2].id, 'rating': None},
+        ]))
+        self.assertEqual(response.json(), {'status': 'success', 'count': 3})
+        ratings = {rating.movie_id: rating for rating in Rating.objects.filter(user=self.user)}
+        self.assertEqual(len(ratings), 3)
+        self.assertEqual(ratings[self.movies[0].id].rating, 5)
+        self.assertEqual(ratings[self.movies[1].id].rating, 3)
+        self.assertTrue(ratings[self.movies[2].id].is_skipped)
+
+    def test_jsonl_last_rating_wins(self):
+        """Ensure JSON lines are accepted and a repeated movie keeps its last rating."""
+        body = '\n'.join(json.dumps({'movie_id': self.movies[1].id, 'rating': rating}) for rating in (2, 4.5))
+        response = self.post(body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(Rating.objects.get(user=self.user, movie=self.movies[1]).rating, 5)
+
+    def test_invalid_batches_are_rejected_atomically(self):
+        """Ensure unknown movies, bad ratings and other users' ratings reject the whole batch."""
+        response = self.post(json.dumps([{'movie_id': self.movies[1].id, 'rating': 4}, {'movie_id': 0, 'rating': 4}]))
+        self.assertEqual(response.status_code, 400)
+        response = self.post(json.dumps([{'movie_id': self.movies[1].id, 'rating': 9}]))
+        self.assertEqual(response.status_code, 400)
+        response = self.post(json.dumps([{'movie_id': self.movies[1].id, 'rating': 4, 'user_id': self.other.id}]))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Rating.objects.count(), 1)
+
+    def test_is_skipped_must_be_a_boolean(self):
+        """Ensure "is_skipped" only accepts JSON booleans, so the string "false" does not record a skip."""
+        response = self.post(json.dumps([{'movie_id': self.movies[1].id, 'rating': 4, 'is_skipped': 'false'}]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Rating.objects.filter(movie=self.movies[1]).exists())
+
+        response = self.post(json.dumps([{'movie_id': self.movies[1].id, 'rating': 4, 'is_skipped': False},
+                                         {'movie_id': self.movies[2].id, 'rating': 4, 'is_skipped': True}]))
+        self.assertEqual(response.json()['count'], 2)
+        self.assertFalse(Rating.objects.get(user=self.user, movie=self.movies[1]).is_skipped)
+        self.assertTrue(Rating.objects.get(user=self.user, movie=self.movies[2]).is_skipped)
+
+    @override_settings(RECOMMENDER_SIMILARITY_STORE=True)
+    def test_similarity_store_follows_bulk_writes(self):
+        """Ensure the incremental similarity store matches a rebuild after a bulk write."""
+        Rating.objects.create(user=self.other, movie=self.movies[0], rating=4)
+        Rating.objects.create(user=self.other, movie=self.movies[1], rating=2)
+        similarity.rebuild()
+        self.post(json.dumps([{'movie_id': self.movies[0].id, 'rating': 3},
+                              {'movie_id': self.movies[1].id, 'rating': 5}]))
+        incremental = similarity.similarity_row(self.user.id)
+        similarity.rebuild()
+        rebuilt = similarity.similarity_row(self.user.id)
+        self.assertAlmostEqual(incremental[self.other.id], rebuilt[self.other.id])
+
+    def test_clean_rating(self):
+        """Ensure half stars round up and out-of-range values are refused."""
+        self.assertEqual(clean_rating('3.5'), 4)
+        self.assertEqual(clean_rating(0.5), 1)
+        self.assertIsNone(clean_rating(None))
+        with self.assertRaises(ValueError):
+            clean_rating('0')
+
+    def test_import_ratings_command(self):
+        """Ensure the importer streams a CSV in chunks and skips unknown users and movies."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'ratings.csv')
+        with open(path, 'w') as file:
+            file.write('userId,movieId,rating,timestamp\n')
+            file.write(f'{self.user.id},{self.movies[0].id},4.5,964982703\n')
+            file.write(f'{self.other.id},{self.movies[1].id},3.0,964982703\n')
+            file.write(f'{self.other.id},0,3.0,964982703\n')
+            file.write(f'{self.other.id},{self.movies[2].id},1.0,964982703\n')
+
+        out = StringIO()
+        call_command('import_ratings', path, '--chunk-size', '2', '--movie-pk', stdout=out)
+        self.assertIn('Successfully imported 3 ratings (1 skipped)', out.getvalue())
+        self.assertEqual(Rating.objects.get(user=self.user, movie=self.movies[0]).rating, 5)
+        self.assertEqual(Rating.objects.filter(user=self.other).count(), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ImportMoviesTests(TestCase):
+    """Test case for the import_movies command."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def test_reimport_skips_unchanged_rows(self):
+        """Ensure movies are upserted on their external id and unchanged rows are not written again."""
+        path = self.write('movies.csv', 'movieId,title,genres\n1,Toy Story (1995),Animation\n2,Jumanji (1995),Adventure\n')
+        out = StringIO()
+        call_command('import_movies', path, '--chunk-size', '1', stdout=out)
+        self.assertIn('2 created, 0 updated, 0 unchanged', out.getvalue())
+        self.assertEqual(Movie.objects.get(external_id='1').genre, 'Animation')
+
+        path = self.write('movies.csv', 'movieId,title,genres\n1,Toy Story (1995),Animation\n2,Jumanji (1995),Fantasy\n'
+                                        '3,Heat (1995),Action\n')
+        out = StringIO()
+        # One lookup of the stored hashes and one INSERT for the two changed rows, within a savepoint
+        with self.assertNumQueries(4):
+            call_command('import_movies', path, stdout=out)
+        self.assertIn('1 created, 1 updated, 1 unchanged', out.getvalue())
+        self.assertEqual(Movie.objects.count(), 3)
+        self.assertEqual(Movie.objects.get(external_id='2').genre, 'Fantasy')
+
+    def test_ratings_follow_imported_movie_ids(self):
+        """Ensure import_ratings attaches MovieLens movieIds to the movies import_movies created for them."""
+        user = User.objects.create_user(username='movielens_user', password='123')
+        # Primary keys that collide with the MovieLens ids of other movies
+        decoys = [Movie.objects.create(title=f'Decoy {i}') for i in range(3)]
+        movies = self.write('movies.csv', f'movieId,title,genres\n{decoys[1].id},Toy Story (1995),Animation\n'
+                                          f'{decoys[0].id},Jumanji (1995),Adventure\n')
+        call_command('import_movies', movies, stdout=StringIO())
+        ratings = self.write('ratings.csv', f'userId,movieId,rating,timestamp\n{user.id},{decoys[1].id},5,1\n'
+                                            f'{user.id},{decoys[0].id},2,1\n{user.id},{decoys[2].id},4,1\n')
+        out = StringIO()
+        call_command('import_ratings', ratings, stdout=out)
+
+        self.assertIn('Successfully imported 2 ratings (1 skipped)', out.getvalue())
+        rated = dict(Rating.objects.filter(user=user).values_list('movie__title', 'rating'))
+        self.assertEqual(rated, {'Toy Story (1995)': 5, 'Jumanji (1995)': 2})
+
+    def test_jsonl_input(self):
+        """Ensure JSON lines are imported with their overview and poster."""
+        path = self.write('movies.jsonl', json.dumps({'id': 'tt0114709', 'title': 'Toy Story', 'overview': 'Toys.',
+                                                      'poster_url': 'https://example.com/p.jpg'}) + '\n')
+        call_command('import_movies', path, stdout=StringIO())
+        movie = Movie.objects.get(external_id='tt0114709')
+        self.assertEqual((movie.overview, movie.poster_url), ('Toys.', 'https://example.com/p.jpg'))
+
+
+class AsyncViewTests(TransactionTestCase):
+    """Test case for the async views and their bounded refresh executor."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='async_user', password='12345')
+        other = User.objects.create_user(username='async_other', password='12345')
+        self.movies = [Movie.objects.create(title=f'Async Movie {i}') for i in range(4)]
+        Rating.objects.create(user=self.user, movie=self.movies[0], rating=5)
+        Rating.objects.create(user=self.user, movie=self.movies[1], rating=4)
+        for movie in self.movies:
+            Rating.objects.create(user=other, movie=movie, rating=4)
+        self.async_client = AsyncClient()
+        self.async_client.force_login(self.user)
+
+    def test_navigation_is_not_starved_during_refresh(self):
+        """Ensure back navigation is answered while a refresh is still being computed."""
+        started, release = threading.Event(), threading.Event()
+        get_predictions = Recommendation.get_predictions
+
+        def slow_predictions(user, *args, **kwargs):
+            started.set()
+            release.wait(10)
+            return get_predictions(user, *args, **kwargs)
+
+        async def scenario():
+            refresh = asyncio.ensure_future(self.async_client.get(reverse('get_recommendation')))
+            self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, started.wait, 10))
+
+            back = await self.async_client.get(reverse('get_recommendation'),
+                                               {'action': 'back', 'movie_id': self.movies[1].id})
+            refresh_pending = not refresh.done()
+            release.set()
+            return back, refresh_pending, await refresh
+
+        with mock.patch.object(Recommendation, 'get_predictions', side_effect=slow_predictions):
+            back, refresh_pending, refreshed = async_to_sync(scenario)()
+
+        self.assertTrue(refresh_pending)
+        self.assertEqual(back.json()['recommended_movie']['title'], 'Async Movie 0')
+        self.assertEqual(refreshed.json()['recommended_movie']['title'], 'Async Movie 2')
+
+    def test_genre_scoring_runs_on_the_prefetch_pool(self):
+        """Ensure genre lists are scored on the bounded pool rather than the thread-sensitive executor."""
+        Movie.objects.filter(id__in=[movie.id for movie in self.movies]).update(genre='Drama')
+        threads = []
+        get_predictions = Recommendation.get_predictions
+
+        def record_thread(user, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return get_predictions(user, *args, **kwargs)
+
+        async def scenario():
+            first = await self.async_client.get(reverse('get_recommendation'), {'genre': 'drama'})
+            second = await self.async_client.get(reverse('get_recommendation'), {'genre': 'drama'})
+            return first.json(), second.json()
+
+        with mock.patch.object(Recommendation, 'get_predictions', side_effect=record_thread):
+            first, second = async_to_sync(scenario)()
+
+        self.assertEqual(first['recommended_movie']['title'], 'Async Movie 2')
+        self.assertEqual(second, first)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('recommendation-prefetch'))
+
+    def test_rate_movie(self):
+        """Ensure the async rate_movie view creates and updates ratings."""
+        async def rate(rating):
+            response = await self.async_client.post(reverse('rate_movie'), content_type='application/json', data={
+                'movie_id': self.movies[2].id, 'user_id': self.user.id, 'rating': rating})
+            return response.json()
+
+        self.assertEqual(async_to_sync(rate)(2), {'status': 'success'})
+        self.assertEqual(async_to_sync(rate)(3), {'status': 'success'})
+        self.assertEqual(Rating.objects.get(user=self.user, movie=self.movies[2]).rating, 3)
+
+
+class FactorModelTests(TestCase):
+    """Test case for the matrix-factorization model and the factors mode."""
+
+    def setUp(self):
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir)
+
+    def low_rank_matrix(self):
+        rng = np.random.default_rng(5)
+        users, movies = np.meshgrid(np.arange(1, 31), np.arange(1, 21), indexing='ij')
+        ratings = 3 + rng.normal(size=(30, 2)) @ rng.normal(size=(2, 20)) / 2
+        return UserItemMatrix.from_arrays(users.ravel(), movies.ravel(), ratings.ravel())
+
+    def test_als_fits_low_rank_ratings(self):
+        """Ensure ALS recovers ratings that have an exact low-rank structure (rank 3 once centred)."""
+        matrix = self.low_rank_matrix()
+        model = FactorModel.train(matrix, factors=3, regularization=0.001, iterations=50)
+        predicted = model.user_factors @ model.item_factors.T + model.global_mean
+        np.testing.assert_allclose(predicted, matrix.matrix.toarray(), atol=0.05)
+
+    def test_fold_in_matches_trained_user(self):
+        """Ensure a user folded in from half their ratings gets the other half predicted."""
+        matrix = self.low_rank_matrix()
+        model = FactorModel.train(matrix, factors=3, regularization=0.001, iterations=50)
+        row = matrix.matrix[4].toarray().ravel()
+        vector = model.fold_in(matrix.movie_ids[:10], row[:10])
+        predictions = model.predict(vector, exclude=matrix.movie_ids[:10])
+        self.assertEqual(set(predictions['movie_id']), set(matrix.movie_ids[10:]))
+        expected = dict(zip(matrix.movie_ids, row))
+        for movie_id, predicted in zip(predictions['movie_id'], predictions['predicted_rating']):
+            self.assertAlmostEqual(predicted, expected[movie_id], delta=0.1)
+
+    def test_factors_mode_excludes_rated_and_skipped_movies(self):
+        """Ensure the factors mode folds in users added after training and never returns their rated or skipped movies."""
+        users = [User.objects.create_user(username=f'factor_user{i}', password='123') for i in range(4)]
+        movies = [Movie.objects.create(title=f'Factor Movie {i}') for i in range(6)]
+        for i, user in enumerate(users):
+            for j, movie in enumerate(movies):
+                Rating.objects.create(user=user, movie=movie, rating=(i * j) % 5 + 1)
+
+        with self.settings(RECOMMENDER_FACTORS_DIR=self.model_dir, RECOMMENDER_MODE='factors'):
+            call_command('train_factors', '--factors', '2', stdout=StringIO())
+            self.assertIsNotNone(get_factor_model())
+
+            newcomer = User.objects.create_user(username='factor_newcomer', password='123')
+            Rating.objects.create(user=newcomer, movie=movies[0], rating=5)
+            Rating.objects.create(user=newcomer, movie=movies[1], rating=2)
+            Rating.objects.create(user=newcomer, movie=movies[2], is_skipped=True)
+            predictions = Recommendation.get_predictions(newcomer, top_n=10)
+
+        self.assertEqual(set(predictions['movie_id']), {movie.id for movie in movies[3:]})
+        self.assertTrue(predictions['predicted_rating'].is_monotonic_decreasing)
+
+
+class FixedEngine(Engine):
+    """Engine recommending every movie with the same score, registered by EngineRegistryTests."""
+    name = 'fixed'
+
+    def predict(self, user, top_n=None, candidates=None):
+        movie_ids = list(Movie.objects.order_by('id').values_list('id', flat=True)[:top_n])
+        return pd.DataFrame({'movie_id': movie_ids, 'predicted_rating': [3.0] * len(movie_ids)})
+
+
+class EngineRegistryTests(TestCase):
+    """Test case for the engine registry and the offline engine evaluation."""
+
+    def test_engine_selected_from_settings(self):
+        """Ensure get_predictions scores with the engine registered under RECOMMENDER_MODE."""
+        user = User.objects.create_user(username='engine_user', password='123')
+        movies = [Movie.objects.create(title=f'Engine Movie {i}') for i in range(3)]
+        Rating.objects.create(user=user, movie=movies[0], rating=5)
+
+        engines = {'user': 'Recommender.engines.UserEngine', 'fixed': 'Recommender.tests.FixedEngine'}
+        with self.settings(RECOMMENDER_ENGINES=engines, RECOMMENDER_MODE='fixed'):
+            predictions = Recommendation.get_predictions(user, top_n=2)
+        self.assertEqual(list(predictions['movie_id']), [movies[0].id, movies[1].id])
+
+    def test_unready_engine_falls_back_to_user_engine(self):
+        """Ensure an engine without its artifacts falls back to user-user similarity, and unknown names are rejected."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=tempfile.mkdtemp()):
+            self.assertIsInstance(get_engine('item'), UserEngine)
+        with self.assertRaises(ValueError):
+            get_engine('missing')
+
+    def test_evaluation_reports_every_engine(self):
+        """Ensure the evaluation fits every engine on older ratings and reports quality and cost metrics."""
+        populate(40, 30, 0.3, seed=2)
+        report = run_evaluation(test_fraction=0.2, k=5, users=10)
+
+        self.assertEqual(report['split']['test_users'], 10)
+        self.assertEqual(set(report['engines']), {'user', 'item', 'factors'})
+        for metrics in report['engines'].values():
+            self.assertGreaterEqual(metrics['precision_at_5'], 0)
+            self.assertLessEqual(metrics['recall_at_5'], 1)
+            self.assertGreater(metrics['rmse'], 0)
+            self.assertLessEqual(metrics['latency_ms_p50'], metrics['latency_ms_p99'])
+        self.assertGreater(report['engines']['factors']['fit_peak_memory_kb'], 0)
+
+
+class ContentIndexTests(TestCase):
+    """Test case for the content-based neighbour index and its blending into predictions."""
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir)
+
+    def test_neighbours_share_overview_terms_and_genres(self):
+        """Ensure movies are neighbours through their overview and genres, and movies without text have none."""
+        movies = [
+            (1, 'A space crew travels to a distant planet', 'Sci-Fi|Adventure'),
+            (2, 'Astronauts on a space station fight an alien', 'Sci-Fi'),
+            (3, 'Two friends open a bakery in Paris', 'Comedy|Romance'),
+            (4, 'A bakery owner falls in love', 'Romance'),
+            (5, None, None),
+        ]
+        index = ContentIndex.build(movies, {1: 3, 3: 1}, k=2)
+
+        self.assertEqual(index.neighbours[0, 0], 1)
+        self.assertEqual(index.neighbours[2, 0], 3)
+        self.assertTrue((index.neighbours[4] == -1).all())
+        self.assertEqual(index.similarities.dtype, np.float16)
+        np.testing.assert_array_equal(index.counts_of([1, 3, 4, 99]), [3, 1, 0, 0])
+
+    def test_unrated_movies_reach_users_through_content(self):
+        """Ensure a movie nobody has rated is recommended through the content of the movies a user liked."""
+        users = [User.objects.create_user(username=f'content_user{i}', password='123') for i in range(3)]
+        rated = [Movie.objects.create(title=f'Rated Movie {i}', overview=f'A story about topic{i}', genre='Drama')
+                 for i in range(4)]
+        for i, user in enumerate(users):
+            for j, movie in enumerate(rated):
+                Rating.objects.create(user=user, movie=movie, rating=(i + j) % 5 + 1)
+        newcomer = User.objects.create_user(username='content_newcomer', password='123')
+        Rating.objects.create(user=newcomer, movie=rated[0], rating=5)
+        sequel = Movie.objects.create(title='Sequel', overview='Another story about topic0', genre='Drama')
+        skipped = Movie.objects.create(title='Skipped', overview='Yet another story about topic0', genre='Drama')
+        Rating.objects.create(user=newcomer, movie=skipped, is_skipped=True)
+
+        with self.settings(RECOMMENDER_CONTENT_INDEX_DIR=self.index_dir):
+            self.assertIsNone(get_content_index())
+            self.assertNotIn(sequel.id, set(Recommendation.get_predictions(newcomer)['movie_id']))
+
+            call_command('build_content_index', stdout=StringIO())
+            predictions = Recommendation.get_predictions(newcomer, top_n=3)
+
+        self.assertEqual(predictions['movie_id'].iloc[0], sequel.id)
+        self.assertNotIn(skipped.id, set(predictions['movie_id']))
+        self.assertNotIn(rated[0].id, set(predictions['movie_id']))
+        self.assertTrue(predictions['predicted_rating'].is_monotonic_decreasing)
+
+
+@override_settings(RECOMMENDER_PREFETCH_WORKERS=0)
+class GenreRecommendationTests(TestCase):
+    """Test case for the per-genre candidate lists and genre-filtered recommendations."""
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.users = [User.objects.create_user(username=f'genre_user{i}', password='123') for i in range(4)]
+        genres = ['Comedy', 'Drama', 'Comedy|Romance', 'Drama', 'Comedy', 'Horror']
+        self.movies = [Movie.objects.create(title=f'Genre Movie {i}', genre=genre) for i, genre in enumerate(genres)]
+        for i, user in enumerate(self.users[1:]):
+            for j, movie in enumerate(self.movies[:5]):
+                Rating.objects.create(user=user, movie=movie, rating=(i + 2 * j) % 5 + 1)
+
+    def test_genre_lists_follow_movie_writes(self):
+        """Ensure genres are matched case-insensitively and the lists are rebuilt after a movie changes."""
+        comedies = [self.movies[0].id, self.movies[2].id, self.movies[4].id]
+        self.assertEqual(list(get_genre_movie_ids('comedy')), comedies)
+        self.assertEqual(list(get_genre_movie_ids(' Romance ')), [self.movies[2].id])
+        self.assertEqual(len(get_genre_movie_ids('Western')), 0)
+        self.assertEqual(get_genres(), ['comedy', 'drama', 'horror', 'romance'])
+
+        self.movies[5].genre = 'Comedy'
+        self.movies[5].save()
+        self.assertEqual(list(get_genre_movie_ids('Comedy')), comedies + [self.movies[5].id])
+
+    def test_invalidation_drops_previous_lists(self):
+        """Ensure a rebuild leaves no lists of the previous version behind, and lists expire."""
+        cache = caches['shared']
+        get_genres()
+        version = cache.get(GENRE_VERSION_KEY)
+        self.movies[5].genre = 'Comedy'
+        self.movies[5].save()
+        get_genre_movie_ids('comedy')
+
+        self.assertNotEqual(cache.get(GENRE_VERSION_KEY), version)
+        self.assertEqual(cache.get_many([genre_key(version, 'comedy'), genres_key(version)]), {})
+
+        with self.settings(RECOMMENDER_GENRE_TIMEOUT=60), mock.patch.object(cache, 'set_many') as set_many:
+            build_genre_index()
+        self.assertEqual(set_many.call_args.args[1], 60)
+
+        # Invalidation only reaches every process through a shared cache
+        self.assertEqual(check_genre_cache(None), [])
+        with self.settings(CACHES=LOCMEM_CACHES):
+            self.assertEqual([warning.id for warning in check_genre_cache(None)], ['Recommender.W002'])
+
+    def test_genre_is_scored_once_per_list(self):
+        """Ensure genre requests are served from the queued list until the user has seen all of it."""
+        user = self.users[0]
+        comedies = {self.movies[0].id, self.movies[2].id, self.movies[4].id}
+        shown = []
+        with mock.patch.object(Recommendation, 'get_predictions', wraps=Recommendation.get_predictions) as predict:
+            for _ in range(3):
+                payload = fetch_genre_payload(user, 'Comedy')
+                shown.append(payload.data['id'])
+                Rating.objects.create(user=user, movie_id=payload.data['id'], is_skipped=True)
+            self.assertEqual(predict.call_count, 1)
+            self.assertIsNone(fetch_genre_payload(user, 'comedy'))
+        self.assertEqual(set(shown), comedies)
+
+    def test_candidates_restrict_scoring(self):
+        """Ensure scoring only the candidates gives the same scores as filtering a full scoring."""
+        matrix = UserItemMatrix.from_triples(
+            Rating.objects.order_by('id').values_list('user_id', 'movie_id', 'rating'))
+        user_id = self.users[1].id
+        candidates = [self.movies[0].id, self.movies[2].id, self.movies[5].id]
+        # The user rated every candidate the matrix knows, so nothing is left
+        self.assertTrue(matrix.predict(user_id, candidates=candidates).empty)
+
+        Rating.objects.filter(user=self.users[1], movie__in=self.movies[:3]).delete()
+        matrix = UserItemMatrix.from_triples(
+            Rating.objects.order_by('id').values_list('user_id', 'movie_id', 'rating'))
+        full = matrix.predict(user_id)
+        filtered = matrix.predict(user_id, candidates=candidates)
+        expected = full[full['movie_id'].isin(candidates)].reset_index(drop=True)
+        pd.testing.assert_frame_equal(filtered.reset_index(drop=True), expected)
+
+    def test_get_recommendation_filters_by_genre(self):
+        """Ensure recommendations stay in the requested genre, for rated and cold-start users alike."""
+        Rating.objects.create(user=self.users[0], movie=self.movies[1], rating=4)
+        self.client.login(username='genre_user0', password='123')
+
+        response = self.client.get(reverse('get_recommendation'), {'genre': 'comedy'})
+        first = response.json()['recommended_movie']['id']
+        self.assertIn(first, {self.movies[0].id, self.movies[2].id, self.movies[4].id})
+
+        # Skipping moves on to another comedy, never back to a skipped one
+        response = self.client.get(reverse('get_recommendation'),
+                                   {'action': 'next', 'movie_id': first, 'genre': 'comedy'})
+        second = response.json()['recommended_movie']['id']
+        self.assertNotEqual(second, first)
+        self.assertIn(second, {self.movies[0].id, self.movies[2].id, self.movies[4].id})
+
+        newcomer = User.objects.create_user(username='genre_newcomer', password='123')
+        self.client.force_login(newcomer)
+        response = self.client.get(reverse('home'), {'genre': 'Horror'})
+        self.assertEqual(response.context['recommended_movie']['id'], self.movies[5].id)
+        self.assertIn('horror', response.context['genres'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MoviePayloadTests(TestCase):
+    """Test case for the cached movie payloads and the conditional get_recommendation responses."""
+
+    def setUp(self):
+        caches['default'].clear()
+        clear_payload_lru()
+        self.user = User.objects.create_user(username='payload_user', password='123')
+        self.client.login(username='payload_user', password='123')
+        self.movies = [Movie.objects.create(title=f'Payload Movie {i}', overview='x' * 2000) for i in range(3)]
+        for movie in self.movies:
+            Rating.objects.create(user=self.user, movie=movie, rating=4)
+
+    def test_payloads_are_cached_and_invalidated(self):
+        """Ensure a payload is loaded once, served from the LRU or the shared cache, and dropped on save."""
+        with self.assertNumQueries(1):
+            payload = get_movie_payload(self.movies[0].id)
+        self.assertEqual(json.loads(payload.json), build_movie_data(self.movies[0])['recommended_movie'])
+        with self.assertNumQueries(0):
+            self.assertIs(get_movie_payload(self.movies[0].id), payload)
+        clear_payload_lru()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_movie_payload(self.movies[0].id), payload)
+
+        self.movies[0].title = 'Renamed'
+        self.movies[0].save()
+        self.assertEqual(get_movie_payload(self.movies[0].id).data['title'], 'Renamed')
+        self.assertNotEqual(get_movie_payload(self.movies[0].id).etag, payload.etag)
+        self.assertIsNone(get_movie_payload(10 ** 9))
+
+    def test_write_racing_a_load_is_not_cached(self):
+        """Ensure a payload built from rows read before a concurrent save is not served from the shared cache."""
+        movie = self.movies[0]
+        from_values = MoviePayload.from_values
+
+        def save_after_read(values):
+            # The rows were read with the old title; the save lands before they are cached
+            Movie.objects.filter(id=movie.id).update(title='Renamed')
+            Movie.objects.get(id=movie.id).save()
+            return from_values(values)
+
+        with mock.patch.object(MoviePayload, 'from_values', side_effect=save_after_read):
+            self.assertEqual(get_movie_payload(movie.id).data['title'], 'Payload Movie 0')
+        clear_payload_lru()
+        self.assertEqual(get_movie_payload(movie.id).data['title'], 'Renamed')
+
+    def test_process_local_cache_is_reported(self):
+        """Ensure a process-local payload cache, which breaks the LRU staleness bound, is reported by the checks."""
+        self.assertEqual([warning.id for warning in check_movie_payload_cache(None)], ['Recommender.W001'])
+        with self.settings(CACHES={'default': LOCMEM_CACHE, 'shared': DATABASE_CACHE}):
+            self.assertEqual(check_movie_payload_cache(None), [])
+
+    def test_lru_is_bounded(self):
+        """Ensure the in-process layer keeps at most RECOMMENDER_MOVIE_PAYLOAD_LRU_SIZE payloads."""
+        with self.settings(RECOMMENDER_MOVIE_PAYLOAD_LRU_SIZE=2, RECOMMENDER_MOVIE_PAYLOAD_CACHE='dummy',
+                           CACHES={**settings.CACHES,
+                                   'dummy': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            for movie in self.movies:
+                get_movie_payload(movie.id)
+            with self.assertNumQueries(0):
+                get_movie_payload(self.movies[2].id)
+                get_movie_payload(self.movies[1].id)
+            with self.assertNumQueries(1):
+                get_movie_payload(self.movies[0].id)
+
+    def test_if_none_match_returns_not_modified(self):
+        """Ensure repeat navigation with the ETag gets 304 without loading the movie, and a changed movie does not."""
+        params = {'action': 'back', 'movie_id': self.movies[2].id}
+        response = self.client.get(reverse('get_recommendation'), params)
+        self.assertEqual(response.json()['recommended_movie']['title'], 'Payload Movie 1')
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        # The ETag covers the history cursor, which must not change from one second to the next
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('django.core.signing.time.time', return_value=time.time() + 5):
+            response = self.client.get(reverse('get_recommendation'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in queries if 'Recommender_movie' in query['sql']])
+
+        # Neither update() nor the bulk upsert sends save signals; the upsert drops the payload itself
+        Movie.objects.filter(id=self.movies[1].id).update(external_id='payload-1')
+        upsert_movies([{'external_id': 'payload-1', 'title': 'Renamed', 'overview': None, 'genre': None,
+                        'poster_url': None}])
+        response = self.client.get(reverse('get_recommendation'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['recommended_movie']['title'], 'Renamed')
+
+
+@override_settings(RECOMMENDER_READ_DATABASE='replica')
+class ReadReplicaTests(TestCase):
+    """Test case for routing the recommender's heavy reads to a read replica."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # A second SQLite database stands in for the replica
+        cls.directory = tempfile.mkdtemp()
+        configured = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory, 'replica.sqlite3')},
+        })
+        connections.settings['replica'] = configured['replica']
+        call_command('migrate', database='replica', run_syncdb=True, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.directory)
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.users = [User.objects.create_user(username=f'replica_user{i}', password='123') for i in range(3)]
+        self.movies = [Movie.objects.create(title=f'Replica Movie {i}') for i in range(5)]
+        for i, user in enumerate(self.users):
+            for j, movie in enumerate(self.movies[:4]):
+                Rating.objects.create(user=user, movie=movie, rating=(i + j) % 5 + 1)
+        # Replicate the rows written so far, then forget who wrote them
+        for model in (User, Movie, Rating):
+            model.objects.using('replica').all().delete()
+            model.objects.using('replica').bulk_create(model.objects.all())
+        caches['shared'].clear()
+
+    def test_reads_are_routed_and_writes_stay_on_primary(self):
+        """Ensure reads inside read_replica() hit the replica while writes and other reads hit the primary."""
+        Rating.objects.using('replica').filter(user=self.users[0]).delete()
+        with read_replica() as alias:
+            self.assertEqual(alias, 'replica')
+            self.assertEqual(Rating.objects.filter(user=self.users[0]).count(), 0)
+            Rating.objects.create(user=self.users[0], movie=self.movies[4], rating=3)
+        self.assertEqual(Rating.objects.filter(user=self.users[0]).count(), 5)
+        self.assertFalse(Rating.objects.using('replica').filter(movie=self.movies[4]).exists())
+
+        with override_settings(RECOMMENDER_READ_DATABASE=None), read_replica() as alias:
+            self.assertEqual(alias, 'default')
+            self.assertEqual(Rating.objects.filter(user=self.users[0]).count(), 5)
+
+    def test_recent_writers_read_their_writes(self):
+        """Ensure a user who just rated is scored from the primary, and everyone else from the replica."""
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            with read_replica(self.users[1]):
+                Recommendation.get_predictions(self.users[1])
+        self.assertGreater(len(replica_queries), 0)
+
+        # The rating has not reached the replica yet
+        upsert_ratings([(self.users[1].id, self.movies[4].id, 5, False)])
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            with read_replica(self.users[1]) as alias:
+                self.assertEqual(alias, 'default')
+                # Nested blocks do not switch back to the replica
+                with read_replica():
+                    predictions = Recommendation.get_predictions(self.users[1])
+        self.assertEqual(len(replica_queries), 0)
+        self.assertNotIn(self.movies[4].id, list(predictions['movie_id']))
+
+        with read_replica(self.users[2]) as alias:
+            self.assertEqual(alias, 'replica')
+
+    def test_worker_watermark_follows_the_replica(self):
+        """Ensure a rebuild records the ratings the replica held, so those still replicating count as pending."""
+        lagging = Rating.objects.create(user=self.users[0], movie=self.movies[4], rating=2)
+        with self.settings(RECOMMENDER_WORKER_STATUS_PATH=os.path.join(self.directory, 'status.json')), \
+                mock.patch('Recommender.worker.call_command'):
+            worker = RetrainingWorker(['item'], min_changes=1000, max_staleness=60 * 60)
+            worker.rebuild()
+        self.assertEqual(worker.status['last_rating_id'], Rating.objects.using('replica').order_by('-id')[0].id)
+
+        Rating.objects.using('replica').bulk_create([Rating.objects.get(id=lagging.id)])
+        with read_replica():
+            self.assertEqual(worker.pending_changes()[0], 1)
+
+    @override_settings(CACHES={'default': LOCMEM_CACHE, 'shared': DATABASE_CACHE})
+    def test_database_cache_reads_the_primary(self):
+        """Ensure the read-your-writes marks in the database cache are read from the primary inside read_replica()."""
+        note_rating_writes([self.users[0].id])
+        with read_replica():
+            self.assertTrue(wrote_recently(self.users[0].id))
+            with read_replica(self.users[0]) as alias:
+                self.assertEqual(alias, 'default')
+
+    def test_process_local_cache_fails_the_checks(self):
+        """Ensure a replica with a process-local read-your-writes cache is reported as a system check error."""
+        with override_settings(CACHES=LOCMEM_CACHES):
+            self.assertEqual([error.id for error in check_read_your_writes_cache(None)], ['Recommender.E001'])
+            with override_settings(RECOMMENDER_READ_DATABASE=None):
+                self.assertEqual(check_read_your_writes_cache(None), [])
+        with override_settings(CACHES={'default': LOCMEM_CACHE, 'shared': DATABASE_CACHE}):
+            self.assertEqual(check_read_your_writes_cache(None), [])
+
+
+class ArtifactTests(TestCase):
+    """Test case for the versioned, memory-mapped model artifacts."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def index(self, size):
+        return ItemIndex(np.arange(size, dtype=np.int64), np.zeros((size, 2), dtype=np.int32),
+                         np.ones((size, 2), dtype=np.float32))
+
+    def test_published_versions_switch_atomically(self):
+        """Ensure readers memory-map the current version and switch to a new one without reloading by hand."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory, RECOMMENDER_ARTIFACT_VERSIONS_KEPT=2):
+            self.assertIsNone(get_item_index())
+            first = publish(self.directory, self.index(3).save)
+            index = get_item_index()
+            self.assertIsInstance(index.neighbours, np.memmap)
+            self.assertFalse(index.neighbours.flags.writeable)
+            self.assertIs(get_item_index(), index)
+
+            publish(self.directory, self.index(5).save)
+            self.assertEqual(len(get_item_index().movie_ids), 5)
+            # The replaced version is still readable by workers that have it mapped
+            self.assertEqual(len(index.movie_ids), 3)
+
+            latest = publish(self.directory, self.index(7).save)
+            self.assertEqual(current_version(self.directory), os.path.basename(latest))
+            self.assertFalse(os.path.exists(first))
+            self.assertEqual(len([name for name in os.listdir(self.directory) if name != 'CURRENT']), 2)
+
+    def test_failed_build_keeps_current_version(self):
+        """Ensure a build that fails while writing never becomes current."""
+        publish(self.directory, self.index(3).save)
+
+        def fail(directory):
+            self.index(4).save(directory)
+            raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            publish(self.directory, fail)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory, RECOMMENDER_ARTIFACT_MMAP=False):
+            index = get_item_index()
+        self.assertNotIsInstance(index.neighbours, np.memmap)
+        self.assertEqual(len(index.movie_ids), 3)
+
+
+class RetrainingWorkerTests(TestCase):
+    """Test case for the change-driven retraining worker."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        status_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, status_directory)
+        status_settings = self.settings(RECOMMENDER_WORKER_STATUS_PATH=os.path.join(status_directory, 'status.json'))
+        status_settings.enable()
+        self.addCleanup(status_settings.disable)
+        self.users = [User.objects.create_user(username=f'worker_user{i}', password='123') for i in range(3)]
+        self.movies = [Movie.objects.create(title=f'Worker Movie {i}') for i in range(6)]
+        for i, user in enumerate(self.users):
+            for j, movie in enumerate(self.movies[:3]):
+                Rating.objects.create(user=user, movie=movie, rating=(i + j) % 5 + 1)
+
+    def test_rebuilds_on_change_volume_or_staleness(self):
+        """Ensure artifacts are rebuilt once enough ratings changed or the oldest change waited too long."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory):
+            worker = RetrainingWorker(['item'], min_changes=3, max_staleness=60 * 60)
+            # Nothing is known about the live artifacts yet
+            self.assertTrue(worker.check())
+            first = current_version(self.directory)
+            self.assertEqual(get_worker_status()['last_rating_id'], Rating.objects.order_by('-id')[0].id)
+
+            Rating.objects.create(user=self.users[0], movie=self.movies[3], rating=5)
+            Rating.objects.filter(user=self.users[1], movie=self.movies[0]).update(rating=1, updated_at=timezone.now())
+            self.assertFalse(worker.check())
+            self.assertEqual(get_worker_status()['pending_changes'], 2)
+            self.assertEqual(current_version(self.directory), first)
+
+            Rating.objects.create(user=self.users[2], movie=self.movies[4], rating=4)
+            self.assertTrue(worker.check())
+            self.assertNotEqual(current_version(self.directory), first)
+            self.assertEqual(len(get_item_index().movie_ids), 5)
+
+            # A single change is enough once it has waited longer than the budget
+            rating = Rating.objects.create(user=self.users[0], movie=self.movies[5], rating=3)
+            self.assertFalse(worker.check())
+            Rating.objects.filter(id=rating.id).update(updated_at=timezone.now() - timedelta(hours=2))
+            self.assertTrue(worker.check())
+
+    def test_command_and_metrics(self):
+        """Ensure the command runs one check and /metrics exposes the freshness it recorded."""
+        with self.assertRaises(CommandError):
+            with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory):
+                call_command('recommender_worker', '--once', stdout=StringIO())
+
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory):
+            output = StringIO()
+            call_command('recommender_worker', '--artifacts', 'item', '--once', stdout=output)
+            self.assertIn('Rebuilt item', output.getvalue())
+
+            # The worker now picks up the published artifact by itself
+            output = StringIO()
+            call_command('recommender_worker', '--once', stdout=output)
+            self.assertIn('0 ratings changed since the last rebuild', output.getvalue())
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('recommender_model_staleness_seconds 0', text)
+        self.assertIn('recommender_model_pending_changes 0', text)
+        self.assertIn('recommender_model_build_seconds{artifact="item"}', text)
+
+    def test_status_is_shared_across_processes(self):
+        """Ensure the status written by one process is read back by another, e.g. a restarted worker or a web process."""
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory):
+            self.assertTrue(RetrainingWorker(['item'], min_changes=3, max_staleness=60 * 60).check())
+        recorded = get_worker_status()
+
+        # The child stands in for another process: it sees the parent's status and records its own
+        reader, writer = multiprocessing.get_context('fork').Pipe(duplex=False)
+        child = os.fork()
+        if child == 0:
+            try:
+                status = get_worker_status()
+                writer.send(status)
+                write_worker_status(dict(status, pending_changes=7, oldest_pending_at=status['built_at']))
+            finally:
+                os._exit(0)
+        self.assertEqual(reader.recv(), recorded)
+        os.waitpid(child, 0)
+
+        self.assertEqual(get_worker_status()['pending_changes'], 7)
+        self.assertIn('recommender_model_pending_changes 7', self.client.get(reverse('metrics')).content.decode())
+
+        # A restarted worker resumes from the recorded build instead of rebuilding
+        with self.settings(RECOMMENDER_ITEM_INDEX_DIR=self.directory):
+            version = current_version(self.directory)
+            self.assertFalse(RetrainingWorker(['item'], min_changes=3, max_staleness=60 * 60).check())
+            self.assertEqual(current_version(self.directory), version)
+
+
+class AnonymizeDbTests(TestCase):
+    """Test case for the anonymize_db command."""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'person{i}', password='secret', email=f'person{i}@mail.com',
+                                               first_name='First', last_name='Last') for i in range(5)]
+
+    def test_scrubs_users_in_batches(self):
+        """Ensure every user is scrubbed with one shared password hash, in bulk updates of the batch size."""
+        output = StringIO()
+        with mock.patch('Recommender.management.commands.anonymize_db.make_password',
+                        wraps=make_password) as hashed:
+            call_command('anonymize_db', '--batch-size', '2', stdout=output)
+        self.assertEqual(hashed.call_count, 1)
+        self.assertIn('Anonymized 4 of 5 users', output.getvalue())
+        self.assertIn('Anonymized 5 of 5 users', output.getvalue())
+
+        users = list(User.objects.order_by('id'))
+        self.assertEqual(len({user.password for user in users}), 1)
+        for user in users:
+            self.assertEqual(user.username, f'user_{user.id}')
+            self.assertEqual(user.email, f'user_{user.id}@example.com')
+            self.assertEqual((user.first_name, user.last_name, user.last_login), ('', '', None))
+        self.assertTrue(users[0].check_password('defaultPassword123!'))
+
+    def test_dry_run_writes_nothing(self):
+        """Ensure a dry run reports the users it would scrub and leaves them unchanged."""
+        output = StringIO()
+        call_command('anonymize_db', '--dry-run', stdout=output)
+        self.assertIn('Would anonymize 5 of 5 users', output.getvalue())
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)),
+                         [f'person{i}' for i in range(5)])
+
+    def test_existing_anonymized_names_do_not_collide(self):
+        """Ensure users already named like another user's anonymized name do not make the renaming fail."""
+        first, last = self.users[0], self.users[-1]
+        User.objects.filter(id=first.id).update(username=f'user_{last.id}')
+        User.objects.filter(id=last.id).update(username=f'user_{first.id}')
+        User.objects.filter(id=self.users[1].id).update(username=f'user_{self.users[1].id}')
+
+        output = StringIO()
+        call_command('anonymize_db', '--batch-size', '2', stdout=output)
+        self.assertIn('Renamed 2 users', output.getvalue())
+        for user in User.objects.all():
+            self.assertEqual(user.username, f'user_{user.id}')
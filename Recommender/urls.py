@@ -5,6 +5,8 @@ from . import views
 urlpatterns = [
     path('', views.Home.as_view(), name='home'),
     path('rate_movie/', views.rate_movie, name='rate_movie'),
+    path('rate_movies/', views.rate_movies, name='rate_movies'),
     path('get_recommendation/', views.get_recommendation, name='get_recommendation'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
\ No newline at end of file
@@ -1,66 +1,186 @@
+import logging
+from asgiref.sync import sync_to_async
 from .models import Recommendation, Movie, Rating
+from .queues import get_recommendation_queue, GenreQueue
+from . import prefetch
+from .metrics import timed
+from .payloads import get_movie_payload, get_movie_payloads
+from .routers import read_replica
 
 """
 Utility functions for the Recommender app.
 These functions assist with fetching and refreshing movie recommendations.
 """
 
+logger = logging.getLogger(__name__)
+
+NO_RECOMMENDATIONS = 'No more recommendations available'
+
 
 def refresh_recommendation(user):
     """
     Clears the current recommendations for the given user and
     Refreshes the movie recommendations for a given user.
-    Calculates new recommendations based on user ratings and stores them in the database.
+    Calculates new recommendations based on user ratings and stores them in the
+    configured recommendation queue, which writes them to the database in bulk.
 
     Arguments:
     - user: The user for whom recommendations need to be refreshed.
     """
-    print('Refreshing recommendations')
-    # Fetch new movie recommendations for the user
-    recommended_movies = Recommendation.get_predictions(user)
-    print(f"Recommendations from get_predictions: {recommended_movies}")
-
-    # Remove old recommendations
-    Recommendation.objects.filter(user=user).delete()
+    on_screen = prefetch.take_on_screen(user.id)
+    # Fetch new movie recommendations for the user, from the read replica unless they have just rated
+    with timed('predict'), read_replica(user):
+        recommended_movies = Recommendation.get_predictions(user)
+    if on_screen:
+        # Shown to the user but not rated yet when this refresh was scheduled
+        recommended_movies = recommended_movies[~recommended_movies['movie_id'].isin(list(on_screen))]
 
-    # Store the new recommendations in the database
-    for _, row in recommended_movies.iterrows():
-        movie_id = row['movie_id']
-        predicted_rating = row['predicted_rating']
-        recommendation = Recommendation(user=user, movie_id=movie_id, score=predicted_rating)
-        recommendation.save()
-    print(f"Recommendation objects after refresh: {Recommendation.objects.filter(user=user)}")
+    # Replace the old recommendations with the new ones
+    with timed('persist'):
+        get_recommendation_queue().push(user, recommended_movies)
+    logger.info('refreshed recommendations user_id=%s count=%d', user.id, len(recommended_movies))
 
 
-def fetch_next_recommendation(user):
+def fetch_next_recommendation(user, genre=None):
     """
-    Fetch the next movie recommendation for a given user from the database.
+    Fetch the next movie recommendation for a given user from their recommendation queue.
     If there are no stored recommendations, new ones are calculated.
 
     Parameters:
     - user (User model instance): The user for whom the next recommendation needs to be fetched.
+    - genre (str): If given, recommend only movies of this genre.
 
     Returns:
     - context (dict): Contains the next recommended movie details.
     """
-    recommendation = Recommendation.objects.filter(user=user).order_by('-score').first()
+    payload = fetch_next_payload(user, genre)
+    if payload is None:
+        # No recommendations found, even after refreshing
+        return {'message': NO_RECOMMENDATIONS}
+    return payload.context()
+
+
+def fetch_next_payload(user, genre=None):
+    """
+    Fetch the MoviePayload of the next recommendation, or None if there is none.
+    """
+    if genre:
+        return fetch_genre_payload(user, genre)
+
+    queue = get_recommendation_queue()
+    payload = pop_movie_payload(queue, user)
 
     # Check if there are no more recommendations
-    if not recommendation:
-        # No recommendation was found, so we try to refresh recommendations
-        refresh_recommendation(user)
-        recommendation = Recommendation.objects.filter(user=user).order_by('-score').first()
-        print(f"Recommendation after refresh: {recommendation}")
-
-    # Check if a recommendation was found (either initially or after refreshing)
-    if recommendation:
-        context = build_movie_data(recommendation.movie)
-        recommendation.delete()
-    else:
-        # No recommendations found, even after refreshing
-        return {'message': 'No more recommendations available'}
+    if not payload:
+        # No recommendation was found, so wait for a background refresh already
+        # under way, or refresh the recommendations here if none is
+        pending = prefetch.pending_refresh(user)
+        if pending is not None:
+            pending.result()
+        else:
+            refresh_recommendation(user)
+        payload = pop_movie_payload(queue, user)
+        logger.debug('recommendation after refresh user_id=%s movie_id=%s', user.id,
+                     payload.data['id'] if payload else None)
+
+    if payload:
+        # Start computing the next batch before this one runs out
+        prefetch.maybe_prefetch(queue, user, payload.data['id'])
+    return payload
+
+
+async def afetch_next_recommendation(user, genre=None):
+    """
+    Async version of fetch_next_recommendation for the async views.
+    """
+    payload = await afetch_next_payload(user, genre)
+    if payload is None:
+        return {'message': NO_RECOMMENDATIONS}
+    return payload.context()
+
+
+async def afetch_next_payload(user, genre=None):
+    """
+    Async version of fetch_next_payload.
+    An empty queue is refilled on the bounded prefetch executor, so the event
+    loop keeps serving other requests while the scores are computed.
+    """
+    if genre:
+        queue = GenreQueue()
+        payload = await sync_to_async(pop_genre_payload)(queue, user, genre)
+        if payload is None:
+            movie_ids = await prefetch.run_on_executor(refresh_genre_queue, user, genre)
+            payload = await sync_to_async(first_movie_payload)(movie_ids)
+        return payload
+
+    queue = get_recommendation_queue()
+    payload = await sync_to_async(pop_movie_payload)(queue, user)
+
+    if not payload:
+        await prefetch.await_refresh(user)
+        payload = await sync_to_async(pop_movie_payload)(queue, user)
+        logger.debug('recommendation after refresh user_id=%s movie_id=%s', user.id,
+                     payload.data['id'] if payload else None)
+
+    if payload:
+        await sync_to_async(prefetch.maybe_prefetch)(queue, user, payload.data['id'])
+    return payload
+
 
-    return context
+def fetch_genre_payload(user, genre):
+    """
+    Fetch the MoviePayload of the best movie of one genre for a user, or None.
+    Genre recommendations bypass the user's queue and come from a GenreQueue:
+    only the genre's candidate movies are scored, once per list of
+    RECOMMENDER_TOP_N, and movies already rated or skipped are never served.
+    """
+    queue = GenreQueue()
+    payload = pop_genre_payload(queue, user, genre)
+    if payload is None:
+        payload = first_movie_payload(refresh_genre_queue(user, genre))
+    return payload
+
+
+def refresh_genre_queue(user, genre):
+    """
+    Score the genre's movies the user has not rated or skipped yet and queue them.
+
+    Returns:
+    - The queued movie ids, best first.
+    """
+    with timed('predict'), read_replica(user):
+        predictions = Recommendation.get_predictions(user, genre=genre)
+    GenreQueue().push(user, genre, predictions)
+    return [int(movie_id) for movie_id in predictions['movie_id']]
+
+
+def pop_genre_payload(queue, user, genre):
+    """
+    Return the MoviePayload of the best queued movie of the genre the user has not seen yet, or None.
+    """
+    return first_movie_payload(queue.unseen(user, genre))
+
+
+def first_movie_payload(movie_ids):
+    """
+    Return the MoviePayload of the first of the movie ids that still exists, or None.
+    """
+    payloads = get_movie_payloads(movie_ids)
+    return next((payloads[movie_id] for movie_id in movie_ids if movie_id in payloads), None)
+
+
+def pop_movie_payload(queue, user):
+    """
+    Pop movie ids from the user's queue until one still exists, and return its MoviePayload.
+    Returns None once the queue is empty.
+    """
+    while True:
+        movie_id = queue.pop(user)
+        if movie_id is None:
+            return None
+        payload = get_movie_payload(movie_id)
+        if payload:
+            return payload
 
 
 def build_movie_data(movie):
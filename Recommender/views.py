@@ -1,28 +1,55 @@
-from django.shortcuts import render, get_object_or_404
+import hashlib
 import json
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, Http404
+from django.template.response import TemplateResponse
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags
 from django.views.generic import TemplateView
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.auth.mixins import AccessMixin
 from .models import User, Movie, Rating
-from .utils import fetch_next_recommendation, build_movie_data
+from .utils import afetch_next_recommendation, afetch_next_payload, NO_RECOMMENDATIONS
+from .history import aprevious_rating, anext_rating, encode_cursor, InvalidCursor
+from .metrics import render_metrics
+from .worker import render_worker_metrics
+from .ingest import InvalidRating, parse_ratings, clean_rating, upsert_ratings
+from .genres import get_genres
+from .payloads import get_movie_payload
 
 
-class Home(LoginRequiredMixin, TemplateView):
+def resolve_user(request):
+    # Evaluating the lazy request.user reads the session and user tables
+    request.user.is_authenticated
+    return request.user
+
+
+get_user = sync_to_async(resolve_user)
+get_payload = sync_to_async(get_movie_payload)
+
+
+class Home(AccessMixin, TemplateView):
     template_name = 'Recommender/home.html'
 
-    def get(self, request, *args, **kwargs):
+    async def get(self, request, *args, **kwargs):
         '''
         Handles the GET request for the Home view. Fetches the next movie
         recommendation for the user and renders it using the template.
         '''
-        user = request.user
-        context = fetch_next_recommendation(user)
+        user = await get_user(request)
+        if not user.is_authenticated:
+            return self.handle_no_permission()
+        genre = request.GET.get('genre') or None
+        context = await afetch_next_recommendation(user, genre=genre)
+        context['genre'] = genre
+        context['genres'] = await sync_to_async(get_genres)()
 
-        return render(request, self.template_name, context)
+        # Rendered by the handler in a worker thread, as template context processors may query the session
+        return TemplateResponse(request, self.template_name, context)
 
 
-def rate_movie(request):
+async def rate_movie(request):
     if request.method == 'POST':
         data = json.loads(request.body)
 
@@ -32,92 +59,165 @@ def rate_movie(request):
         rating_value = data.get('rating')
 
         try:
-            movie = Movie.objects.get(id=movie_id)
-            user = User.objects.get(id=user_id)
+            movie = await Movie.objects.aget(id=movie_id)
+            user = await User.objects.aget(id=user_id)
         except Movie.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'Movie does not exist'})
         except User.DoesNotExist:
             return JsonResponse({'status': 'error', 'message': 'User does not exist'})
 
-        try:
-            rating = Rating.objects.get(user=user, movie=movie)
-            rating.rating = rating_value
-            rating.is_skipped = False
-            rating.save()
-        except ObjectDoesNotExist:
-            # Create and save the rating
-            rating = Rating(user=user, movie=movie, rating=rating_value)
-            rating.save()
+        # Safe against a concurrent write of the same (user, movie) row, e.g. a double click
+        await Rating.objects.aupdate_or_create(user=user, movie=movie,
+                                               defaults={'rating': rating_value, 'is_skipped': False})
 
         return JsonResponse({'status': 'success'})
     else:
         return JsonResponse({'status': 'error'})
 
 
-def get_recommendation(request):
+def rate_movies(request):
+    """
+    View to rate many movies in one request, e.g. ratings made offline or a backfill.
+    The body is a JSON array of {"movie_id", "rating"} objects, or one object per line.
+    A null rating or "is_skipped": true records a skip; "is_skipped" must be a JSON boolean. Staff may give a "user_id" per
+    rating; everyone else rates as themselves. The batch is applied atomically.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'})
+    if not request.user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Authentication required'}, status=401)
+
+    try:
+        rows = parse_ratings(request.body)
+        max_ratings = getattr(settings, 'RECOMMENDER_BULK_MAX_RATINGS', 10000)
+        if len(rows) > max_ratings:
+            return JsonResponse({'status': 'error', 'message': f'At most {max_ratings} ratings per request'},
+                                status=413)
+
+        ratings = []
+        for position, row in enumerate(rows):
+            try:
+                user_id = int(row.get('user_id', request.user.id))
+                movie_id = int(row['movie_id'])
+                rating = clean_rating(row.get('rating'))
+            except (KeyError, TypeError, ValueError) as error:
+                raise InvalidRating(f'Rating {position}: {error}')
+            is_skipped = row.get('is_skipped', False)
+            if not isinstance(is_skipped, bool):
+                raise InvalidRating(f'Rating {position}: is_skipped must be true or false, not {is_skipped!r}')
+            if user_id != request.user.id and not request.user.is_staff:
+                return JsonResponse({'status': 'error', 'message': f'Rating {position}: cannot rate for another user'},
+                                    status=403)
+            ratings.append((user_id, movie_id, rating, is_skipped or rating is None))
+    except InvalidRating as error:
+        return JsonResponse({'status': 'error', 'message': str(error)}, status=400)
+
+    # Foreign keys are checked up front so one bad id rejects the batch with a clear message
+    movie_ids = {movie_id for _, movie_id, _, _ in ratings}
+    missing_movies = movie_ids - set(Movie.objects.filter(id__in=movie_ids).values_list('id', flat=True))
+    if missing_movies:
+        return JsonResponse({'status': 'error', 'message': f'Movies do not exist: {sorted(missing_movies)}'},
+                            status=400)
+    user_ids = {user_id for user_id, _, _, _ in ratings}
+    missing_users = user_ids - set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    if missing_users:
+        return JsonResponse({'status': 'error', 'message': f'Users do not exist: {sorted(missing_users)}'},
+                            status=400)
+
+    written = upsert_ratings(ratings)
+    return JsonResponse({'status': 'success', 'count': written})
+
+
+async def get_recommendation(request):
     """
     View to fetch the next movie recommendation for a user.
     Also handles going back to a previously rated movie.
+    New recommendations are restricted to the optional 'genre' parameter.
     """
     if request.method == 'GET':
 
-        user = request.user
+        user = await get_user(request)
         action = request.GET.get('action')
+        genre = request.GET.get('genre') or None
+
+        # Navigation continues from the cursor of the previous step, or from the movie on screen
+        cursor = request.GET.get('cursor')
+        movie_id = request.GET.get('movie_id')
 
         # Handle 'back' action
         if action == 'back':
-            current_id = request.GET.get('movie_id')
-            # Try to get the current rating for the given movie_id and user
             try:
-                current_rating = Rating.objects.get(movie__id=current_id, user=user)
-            except Rating.DoesNotExist:
-                current_rating = None
-            except Rating.MultipleObjectsReturned:
-                # If multiple ratings are found, use the latest one
-                current_rating = Rating.objects.filter(movie__id=current_id, user=user).latest('id')
-
-            if current_rating:
-                previous_ratings = Rating.objects.filter(user=user, id__lt=current_rating.id).order_by('-id')
-                previous_movie = previous_ratings.first()
-            else:
-                previous_movie = Rating.objects.filter(user=user).last()
+                previous_movie = await aprevious_rating(user, cursor=cursor, movie_id=movie_id, with_movie=False)
+            except InvalidCursor:
+                return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
 
-            if previous_movie:
-                data = build_movie_data(previous_movie.movie)
-                return JsonResponse(data)
+            payload = previous_movie and await get_payload(previous_movie.movie_id)
+            if payload:
+                return movie_response(request, payload, encode_cursor(previous_movie))
             else:
                 return JsonResponse({'message': 'No previous movie available'})
 
         elif action == 'next':
-            movie_id = request.GET.get('movie_id')
-
-            # Check for current rating for the given movie_id and user for navigation to previous movies
             try:
-                current_rating = Rating.objects.get(movie__id=movie_id, user=user)
-            except Rating.DoesNotExist:
-                current_rating = None
-            except Rating.MultipleObjectsReturned:
-                # If multiple ratings are found, use the latest one
-                current_rating = Rating.objects.filter(movie__id=movie_id, user=user).latest('id')
-
-            next_movie = None
-            if current_rating:
-                next_movie_ratings = Rating.objects.filter(user=user, id__gt=current_rating.id).order_by('id')
-                next_movie = next_movie_ratings.first()
-            else:
+                next_movie = await anext_rating(user, cursor=cursor, movie_id=movie_id, with_movie=False)
+            except InvalidCursor:
+                return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+            payload = next_movie and await get_payload(next_movie.movie_id)
+            if payload:
+                return movie_response(request, payload, encode_cursor(next_movie))
+
+            # A movie that was never rated is being skipped
+            if not cursor and not await Rating.objects.filter(user=user, movie__id=movie_id).aexists():
                 # If the movie does not exist, return an error response with status code 404
-                movie = get_object_or_404(Movie, id=movie_id)
-                Rating.objects.create(user=user, movie=movie, is_skipped=True)
+                try:
+                    payload = await get_payload(int(movie_id))
+                except (TypeError, ValueError):
+                    payload = None
+                if payload is None:
+                    raise Http404('No Movie matches the given query.')
+                # A rating made concurrently, e.g. a rate request still in flight, is kept
+                await Rating.objects.aget_or_create(user=user, movie_id=payload.data['id'],
+                                                    defaults={'is_skipped': True})
+
+        payload = await afetch_next_payload(user, genre=genre)
+        if payload is None:
+            return JsonResponse({'message': NO_RECOMMENDATIONS})
+        return movie_response(request, payload)
+
+
+def movie_response(request, payload, cursor=None):
+    """
+    Respond with a pre-serialized movie payload, and its history cursor if any.
+    The ETag is derived from the payload's, so a client sending it back in
+    If-None-Match gets 304 Not Modified without the body being assembled.
+    """
+    etag = payload.etag
+    if cursor:
+        etag = '"%s"' % hashlib.blake2b((payload.etag + cursor).encode(), digest_size=16).hexdigest()
 
-            if next_movie:
-                data = build_movie_data(next_movie.movie)
-                return JsonResponse(data)
-            else:
-                data = fetch_next_recommendation(user)
-                return JsonResponse(data)
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if etag in etags or '*' in etags:
+        response = HttpResponseNotModified()
+    else:
+        body = b'{"recommended_movie": ' + payload.json
+        if cursor:
+            body += b', "cursor": ' + json.dumps(cursor).encode()
+        response = HttpResponse(body + b'}', content_type='application/json')
+    response['ETag'] = etag
+    # Browsers keep the response but revalidate it on every request, as the next movie may differ
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-        else:
-            data = fetch_next_recommendation(user)
-            return JsonResponse(data)
 
+def metrics(request):
+    """
+    Expose the recommender timings of this process, and the freshness of the
+    scoring artifacts recorded by the retraining worker, in the Prometheus text format.
+    When RECOMMENDER_METRICS_TOKEN is set, scrapers must send it as a bearer token.
+    """
+    token = getattr(settings, 'RECOMMENDER_METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=403)
 
+    return HttpResponse(render_metrics() + render_worker_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
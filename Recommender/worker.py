@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from .models import Rating
+from .artifacts import current_version
+from .item_index import get_item_index_dir
+from .factorization import get_factor_model_dir
+from .content_index import get_content_index_dir
+from .routers import read_replica
+from .metrics import render_gauge
+
+"""
+Change-driven retraining for the Recommender app.
+`manage.py recommender_worker` polls the Rating table for rows added or
+updated since the scoring artifacts were last built, and rebuilds them once
+RECOMMENDER_WORKER_MIN_CHANGES rows have changed or the oldest change has
+waited RECOMMENDER_WORKER_MAX_STALENESS seconds, whichever comes first. A
+lower threshold or budget buys fresher recommendations for more CPU.
+
+The worker's state (what the live artifacts were built from, how long each
+build took, how many changes are pending and since when) is written to a
+JSON file next to the artifacts, RECOMMENDER_WORKER_STATUS_PATH, which is
+atomically replaced on every check. A restarted worker resumes where it
+stopped, and the web processes, which read the artifacts from the same
+place, expose it on /metrics.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Status fields stored as ISO 8601 strings
+DATETIME_FIELDS = ('checked_at', 'built_from', 'built_at', 'oldest_pending_at')
+
+# Management command that publishes each artifact, and the directory it is published in
+ARTIFACTS = {
+    'item': ('build_item_index', get_item_index_dir),
+    'factors': ('train_factors', get_factor_model_dir),
+    'content': ('build_content_index', get_content_index_dir),
+}
+
+
+def get_status_path():
+    return getattr(settings, 'RECOMMENDER_WORKER_STATUS_PATH',
+                   os.path.join(settings.BASE_DIR, 'artifacts', 'worker_status.json'))
+
+
+def get_worker_status():
+    """
+    Return the status the worker recorded last, or None if it never ran.
+    """
+    try:
+        with open(get_status_path()) as status_file:
+            status = json.load(status_file)
+    except (OSError, ValueError):
+        return None
+    for field in DATETIME_FIELDS:
+        if status.get(field) is not None:
+            status[field] = datetime.fromisoformat(status[field])
+    return status
+
+
+def write_worker_status(status):
+    """
+    Record the worker's status; readers see either the previous or the new file, never a partial one.
+    """
+    path = get_status_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as status_file:
+        json.dump({field: value.isoformat() if field in DATETIME_FIELDS and value is not None else value
+                   for field, value in status.items()}, status_file)
+    os.replace(temporary_path, path)
+
+
+def published_artifacts():
+    """
+    Return the names of the artifacts that have a published version.
+    """
+    return [name for name, (_, get_dir) in ARTIFACTS.items() if current_version(get_dir()) is not None]
+
+
+class RetrainingWorker:
+    """
+    Decides when the scoring artifacts are stale enough to rebuild, and rebuilds them.
+
+    Arguments:
+    - artifacts: Names of the ARTIFACTS entries to rebuild.
+    - min_changes: Number of changed ratings that triggers a rebuild.
+    - max_staleness: Seconds the oldest pending change may wait before it triggers a rebuild.
+    """
+
+    def __init__(self, artifacts, min_changes, max_staleness):
+        unknown = set(artifacts) - set(ARTIFACTS)
+        if unknown:
+            raise ValueError(f'Unknown artifacts: {", ".join(sorted(unknown))}')
+        self.artifacts = list(artifacts)
+        self.min_changes = min_changes
+        self.max_staleness = max_staleness
+        self.status = get_worker_status() or {}
+
+    def pending_changes(self):
+        """
+        Count the ratings added or updated since the last build.
+
+        Returns:
+        - (number of changed rows, datetime of the oldest change or None).
+        """
+        if 'last_rating_id' not in self.status:
+            return None, None
+        changed = Q(id__gt=self.status['last_rating_id']) | Q(updated_at__gt=self.status['built_from'])
+        pending = Rating.objects.filter(changed).aggregate(count=Count('id'), oldest=Min('updated_at'))
+        return pending['count'], pending['oldest']
+
+    def check(self):
+        """
+        Rebuild the artifacts if the pending changes call for it, and record the status.
+
+        Returns:
+        - True if the artifacts were rebuilt.
+        """
+        with read_replica():
+            changes, oldest = self.pending_changes()
+        now = timezone.now()
+        if changes is None:
+            # Unknown freshness, e.g. the first run: build to establish a baseline
+            due = True
+        elif changes:
+            # A NULL update time means the row was not written since updated_at was added;
+            # such rows only show up here by id, so count them as changed at the last build
+            oldest = oldest or self.status['built_from']
+            due = changes >= self.min_changes or (now - oldest).total_seconds() >= self.max_staleness
+        else:
+            due = False
+
+        self.status.update(checked_at=now, pending_changes=changes or 0, oldest_pending_at=oldest if changes else None)
+        if due:
+            self.rebuild()
+        write_worker_status(self.status)
+        return due
+
+    def rebuild(self):
+        """
+        Rebuild every artifact from the current ratings and record how long each build took.
+        """
+        # Read where the builds read, before them, so changes that have not reached the
+        # replica yet, or are made during a build, count as pending
+        with read_replica():
+            watermark = Rating.objects.aggregate(last=Max('id'), changed=Max('updated_at'))
+        last_rating_id = watermark['last'] or 0
+        built_from = watermark['changed'] or timezone.now()
+        durations = {}
+        for name in self.artifacts:
+            command = ARTIFACTS[name][0]
+            started = time.perf_counter()
+            with read_replica():
+                call_command(command, stdout=StringIO())
+            durations[name] = time.perf_counter() - started
+            logger.info('rebuilt artifact=%s seconds=%.3f', name, durations[name])
+
+        self.status.update(built_from=built_from, built_at=timezone.now(), last_rating_id=last_rating_id,
+                           build_seconds=durations, pending_changes=0, oldest_pending_at=None)
+
+
+def render_worker_metrics():
+    """
+    Return the worker's status as Prometheus gauges, or an empty string if it never ran.
+    """
+    status = get_worker_status()
+    if not status or 'built_at' not in status:
+        return ''
+    now = timezone.now()
+    oldest = status.get('oldest_pending_at')
+    return '\n'.join([
+        render_gauge('recommender_model_age_seconds', 'Time since the scoring artifacts were last rebuilt.',
+                     [((), (now - status['built_at']).total_seconds())]),
+        render_gauge('recommender_model_staleness_seconds',
+                     'Age of the oldest rating change not yet in the scoring artifacts.',
+                     [((), (now - oldest).total_seconds() if oldest else 0)]),
+        render_gauge('recommender_model_pending_changes', 'Ratings changed since the last rebuild.',
+                     [((), status['pending_changes'])]),
+        render_gauge('recommender_model_build_seconds', 'Duration of the last rebuild of each artifact.',
+                     [((name,), seconds) for name, seconds in sorted(status['build_seconds'].items())],
+                     labelnames=('artifact',)),
+    ]) + '\n'
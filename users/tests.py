@@ -1,3 +1,34 @@
 from django.test import TestCase
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from Recommender.models import Movie, Rating, Recommendation
+from .views import get_initial_movies
 
 # Create your tests here.
+
+
+class InitialMoviesTest(TestCase):
+    """Test case for the initial recommendations of newly registered users."""
+
+    def setUp(self):
+        """Set up movies and an empty cache."""
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.inception = Movie.objects.create(title='Inception')
+        self.other = Movie.objects.create(title='Some Other Movie')
+
+    def test_curated_titles_without_ratings(self):
+        """Ensure the curated titles are used while nothing has been rated."""
+        user = User.objects.create_user(username='new_user', password='123')
+        get_initial_movies(user)
+        self.assertEqual(list(Recommendation.objects.filter(user=user).values_list('movie_id', flat=True)),
+                         [self.inception.id])
+
+    def test_popular_movies_once_rated(self):
+        """Ensure new users start on the shared popularity ranking once ratings exist."""
+        rater = User.objects.create_user(username='rater', password='123')
+        Rating.objects.create(user=rater, movie=self.other, rating=5)
+        user = User.objects.create_user(username='new_user', password='123')
+        get_initial_movies(user)
+        self.assertEqual(list(Recommendation.objects.filter(user=user).values_list('movie_id', flat=True)),
+                         [self.other.id])
@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.models import User
 from Recommender.models import Recommendation, Rating, Movie
+from Recommender.popularity import get_popular_movie_ids
 from .forms import UserRegisterForm
 
 
@@ -45,7 +46,13 @@ def get_initial_movies(user):
         'No Country for Old Men',
     ]
     
-    movie_objects = Movie.objects.filter(title__in=popular_movies)
+    # Start new users on the shared popularity ranking, and on the curated list
+    # above while there are no ratings to rank by
+    popular_movie_ids = get_popular_movie_ids(len(popular_movies))
+    if popular_movie_ids:
+        movie_objects = Movie.objects.filter(id__in=popular_movie_ids)
+    else:
+        movie_objects = Movie.objects.filter(title__in=popular_movies)
     
     recommendations_to_create = [Recommendation(user=user, movie=movie) for movie in movie_objects]
 